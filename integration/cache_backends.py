@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, List, Optional, Tuple, Type
+
+logger = logging.getLogger("cache_backends")
+
+# Where cache entries live: "memory" for each process on its own, or "sqlite" for a local database file
+# shared by every worker on the host, in a directory only the service can write
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "/var/cache/integration/integration_cache.db")
+
+# Seconds a worker may hold a key's refresh lease before other workers assume it died and fetch the key themselves
+CACHE_LEASE_DURATION = float(os.getenv("CACHE_LEASE_DURATION", "30"))
+
+
+@dataclass
+class CacheEntry:
+    value: Any = None
+    error: Optional[Exception] = None  # Set for a cached upstream failure
+    fresh_until: float = 0.0  # time.time() until which it is served as-is
+    stale_until: float = 0.0  # Then served while a background refresh runs, until then
+    fetched_at: float = 0.0  # time.time() when the value was fetched
+
+
+# Storage of a TTLCache's entries, with refresh leases so that one worker at a time fetches a key
+class CacheBackend:
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        raise NotImplementedError
+
+    def set(self, key: Hashable, entry: CacheEntry) -> None:
+        raise NotImplementedError
+
+    # All entries, least recently used or stored first
+    def items(self) -> List[Tuple[Hashable, CacheEntry]]:
+        raise NotImplementedError
+
+    # Drop the entries whose key matches, or all entries
+    def delete(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        raise NotImplementedError
+
+    # Take the lease on refreshing key; False while another worker holds it
+    def acquire_lease(self, key: Hashable) -> bool:
+        raise NotImplementedError
+
+    def release_lease(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+
+# Bounded LRU of this process's entries. A single process needs no leases: concurrent fetches of a key
+# are already coalesced into one by single-flight
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: Hashable, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def items(self) -> List[Tuple[Hashable, CacheEntry]]:
+        return list(self._entries.items())
+
+    def delete(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        for key in [key for key in self._entries if match is None or match(key)]:
+            del self._entries[key]
+
+    def acquire_lease(self, key: Hashable) -> bool:
+        return True
+
+    def release_lease(self, key: Hashable) -> None:
+        pass
+
+
+# Entries in a SQLite database in WAL mode, shared by the workers on one host; each cache uses its own namespace.
+# Keys and values are stored as JSON, so values must be JSON data, as upstream responses are. A cached failure
+# is stored as its message and read back as error_type. Beyond max_entries, the least recently stored entries
+# are evicted. Calls are synchronous: each is one indexed statement on a local file, well under a millisecond.
+class SQLiteCacheBackend(CacheBackend):
+    def __init__(
+        self, path: str, namespace: str, max_entries: int, lease_duration: float, error_type: Type[Exception] = Exception
+    ):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.lease_duration = lease_duration
+        self.error_type = error_type
+        self.owner = str(os.getpid())
+        self._connection: Optional[sqlite3.Connection] = None
+
+    # Open the database on first use, so each worker process has its own connection
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # Cached data is disposable, so a table written by an older version is recreated rather than migrated
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(cache_entries)")}
+            if columns and "value" not in columns:
+                connection.execute("DROP TABLE cache_entries")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, is_error INTEGER NOT NULL, "
+                "fresh_until REAL NOT NULL, stale_until REAL NOT NULL, fetched_at REAL NOT NULL, stored_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_stored_at ON cache_entries (namespace, stored_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_leases ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(key)
+
+    @staticmethod
+    def _decode_key(key: str) -> Hashable:
+        decoded = json.loads(key)
+        return tuple(decoded) if isinstance(decoded, list) else decoded
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        row = self.connection.execute(
+            "SELECT value, is_error, fresh_until, stale_until, fetched_at FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, self._encode_key(key)),
+        ).fetchone()
+        return None if row is None else self._entry(key, *row)
+
+    def _entry(
+        self, key: Hashable, value: str, is_error: int, fresh_until: float, stale_until: float, fetched_at: float
+    ) -> Optional[CacheEntry]:
+        try:
+            payload = json.loads(value)
+        except ValueError as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            return None
+        if is_error:
+            return CacheEntry(
+                error=self.error_type(payload), fresh_until=fresh_until, stale_until=stale_until, fetched_at=fetched_at
+            )
+        return CacheEntry(value=payload, fresh_until=fresh_until, stale_until=stale_until, fetched_at=fetched_at)
+
+    def set(self, key: Hashable, entry: CacheEntry) -> None:
+        try:
+            value = json.dumps(str(entry.error) if entry.error is not None else entry.value)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Not caching {key}, which cannot be stored: {e}")
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.namespace, self._encode_key(key), value, entry.error is not None,
+                entry.fresh_until, entry.stale_until, entry.fetched_at, time.time(),
+            ),
+        )
+        self.connection.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+
+    def items(self) -> List[Tuple[Hashable, CacheEntry]]:
+        rows = self.connection.execute(
+            "SELECT key, value, is_error, fresh_until, stale_until, fetched_at FROM cache_entries "
+            "WHERE namespace = ? ORDER BY stored_at",
+            (self.namespace,),
+        )
+        items = [(self._decode_key(key), self._entry(key, *row)) for key, *row in rows]
+        return [(key, entry) for key, entry in items if entry is not None]
+
+    def delete(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        if match is None:
+            self.connection.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            return
+        keys = [row[0] for row in self.connection.execute("SELECT key FROM cache_entries WHERE namespace = ?", (self.namespace,))]
+        self.connection.executemany(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+            [(self.namespace, key) for key in keys if match(self._decode_key(key))],
+        )
+
+    # Take the lease if it is free or expired; this worker's own lease can be taken again, since its
+    # concurrent fetches of the key are coalesced anyway
+    def acquire_lease(self, key: Hashable) -> bool:
+        now = time.time()
+        cursor = self.connection.execute(
+            "INSERT INTO cache_leases VALUES (?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE "
+            "SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE cache_leases.expires_at < ? OR cache_leases.owner = excluded.owner",
+            (self.namespace, self._encode_key(key), self.owner, now + self.lease_duration, now),
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, key: Hashable) -> None:
+        self.connection.execute(
+            "DELETE FROM cache_leases WHERE namespace = ? AND key = ? AND owner = ?",
+            (self.namespace, self._encode_key(key), self.owner),
+        )
+
+
+# Backend for the cache named namespace, as configured by CACHE_BACKEND; cached failures that go through
+# storage come back as error_type
+def create_cache_backend(namespace: str, max_entries: int, error_type: Type[Exception] = Exception) -> CacheBackend:
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCacheBackend(CACHE_SQLITE_PATH, namespace, max_entries, CACHE_LEASE_DURATION, error_type)
+    if CACHE_BACKEND != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}, using memory")
+    return MemoryCacheBackend(max_entries)
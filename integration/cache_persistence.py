@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict
+
+from cache_backends import CacheEntry
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("cache_persistence")
+
+
+# Write the successful entries of the named caches to path as JSON, with the time each was fetched.
+# The file is replaced atomically, so a crash mid-write leaves the previous one; each save writes its own
+# temporary file, so workers saving at once never write into each other's. Returns the entries written.
+def save_caches(path: str, caches: Dict[str, TTLCache]) -> int:
+    records = []
+    for name, cache in caches.items():
+        for key, entry in cache.backend.items():
+            if entry.error is None:
+                records.append({"cache": name, "key": key, "value": entry.value, "fetched_at": entry.fetched_at})
+
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(records, f)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return len(records)
+
+
+# Load the entries written by save_caches into the named caches, dropping those fetched more than max_age seconds ago.
+# Entries still within their cache's TTL are fresh again; older ones are served as stale until max_age, so the
+# first requests are answered from them while they are refreshed. Returns the entries loaded.
+def load_caches(path: str, caches: Dict[str, TTLCache], max_age: float) -> int:
+    try:
+        with open(path) as f:
+            records = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read the saved caches from {path}: {e}")
+        return 0
+
+    now = time.time()
+    loaded = 0
+    for record in records:
+        cache = caches.get(record.get("cache"))
+        fetched_at = record.get("fetched_at", 0)
+        if cache is None or not 0 <= now - fetched_at <= max_age:
+            continue
+
+        # JSON turned tuple keys into lists
+        key = record["key"]
+        key = tuple(key) if isinstance(key, list) else key
+        cache.backend.set(
+            key,
+            CacheEntry(
+                value=record["value"],
+                fresh_until=fetched_at + cache.ttl,
+                stale_until=fetched_at + max(cache.ttl + cache.stale_ttl, max_age),
+                fetched_at=fetched_at,
+            ),
+        )
+        loaded += 1
+    return loaded
+
+
+# Save the caches every interval seconds
+async def persist_caches(path: str, caches: Dict[str, TTLCache], interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            save_caches(path, caches)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving the caches to {path}: {e}")
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+# Collects the keys requested in one pass of the event loop and resolves each distinct key once:
+# with one batch_load call for all of them, or with load per key, at most max_concurrency at a time.
+# Create one per document build, so results are shared within the build but never go stale.
+class DataLoader:
+    def __init__(
+        self,
+        batch_load: Optional[Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]] = None,
+        load: Optional[Callable[[Hashable], Awaitable[Any]]] = None,
+        max_concurrency: int = 10,
+    ):
+        if (batch_load is None) == (load is None):
+            raise ValueError("Pass exactly one of batch_load and load")
+        self._batch_load = batch_load
+        self._load = load
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+
+    # Get the value for key; keys missing from a batch result resolve to None
+    async def load(self, key: Hashable) -> Any:
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return await asyncio.shield(future)
+
+    async def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        if self._batch_load is not None:
+            try:
+                results = await self._batch_load(keys)
+            except Exception as e:
+                for key in keys:
+                    self._futures[key].set_exception(e)
+                return
+            for key in keys:
+                self._futures[key].set_result(results.get(key))
+        else:
+            await asyncio.gather(*(self._load_one(key) for key in keys))
+
+    async def _load_one(self, key: Hashable) -> None:
+        async with self._semaphore:
+            try:
+                self._futures[key].set_result(await self._load(key))
+            except Exception as e:
+                self._futures[key].set_exception(e)
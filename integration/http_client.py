@@ -0,0 +1,27 @@
+import os
+from typing import Optional
+import httpx
+
+# Connection pool limits for the client shared by all adapters
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+# Get the shared async client, creating it on first use so it binds to the running event loop
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+        )
+    return _client
+
+
+# Close the shared client and its pooled connections
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,17 +1,57 @@
 import os
+import asyncio
 import logging
 from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 
-from lab_utilization_adapter import LabUtilizationAdapter, IntegrationError as LabIntegrationError
+from lab_utilization_adapter import LabUtilizationAdapter, IntegrationError as LabIntegrationError, USAGE_ANALYTICS_BASE_URL
 from server_allocation_adapter import ServerAllocationAdapter, IntegrationError as ServerIntegrationError
+from http_client import close_client
+from single_flight import upstream_fetches
+from snapshots import Snapshot, SnapshotMaterializer, watch_change_feed
+from resilience import DeadlineExceeded, circuit_breakers, deadline, within_deadline
+from cache_backends import CACHE_BACKEND
+from cache_persistence import load_caches, persist_caches, save_caches
+from lab_registry import LAB_CATALOG_REFRESH_INTERVAL, lab_type_registry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("integration_api")
 
+# Seconds between scheduled snapshot rebuilds, and the least time between rebuilds triggered by usage changes
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "60"))
+SNAPSHOT_MIN_INTERVAL = int(os.getenv("SNAPSHOT_MIN_INTERVAL", "5"))
+
+# Oldest full snapshot the per-lab utilization endpoint answers from before fetching the lab's data itself
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", str(2 * SNAPSHOT_INTERVAL)))
+
+# Seconds a request may spend waiting on upstreams, across all of its nested upstream calls and retries
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "10"))
+
+# File the adapter caches are saved to every CACHE_PERSIST_INTERVAL seconds and on shutdown, and loaded from on
+# startup unless older than CACHE_PERSIST_MAX_AGE; empty to start cold. The sqlite cache backend is already on disk.
+CACHE_PERSIST_PATH = os.getenv("CACHE_PERSIST_PATH", "/tmp/integration_cache.json")
+CACHE_PERSIST_INTERVAL = int(os.getenv("CACHE_PERSIST_INTERVAL", "60"))
+CACHE_PERSIST_MAX_AGE = int(os.getenv("CACHE_PERSIST_MAX_AGE", "3600"))
+persist_cache = bool(CACHE_PERSIST_PATH) and CACHE_BACKEND == "memory"
+adapter_caches = {"lab_utilization": LabUtilizationAdapter._cache, "server_allocation": ServerAllocationAdapter._cache}
+
+# Combined documents served by the enhanced analytics endpoints, rebuilt in the background
+lab_utilization_snapshots = SnapshotMaterializer(
+    "lab utilization",
+    LabUtilizationAdapter.get_enhanced_lab_analytics,
+    SNAPSHOT_INTERVAL,
+    SNAPSHOT_MIN_INTERVAL,
+    is_degraded=LabUtilizationAdapter.is_degraded,
+    max_age=SNAPSHOT_MAX_AGE,
+)
+server_allocation_snapshots = SnapshotMaterializer(
+    "server allocation", ServerAllocationAdapter.get_enhanced_performance_metrics, SNAPSHOT_INTERVAL, SNAPSHOT_MIN_INTERVAL
+)
+
 # Create the FastAPI app
 app = FastAPI(title="Infrastructure Integration API")
 
@@ -25,6 +65,81 @@ app.add_middleware(
 )
 
 
+# Bound the upstream calls made while answering each request by the request deadline
+@app.middleware("http")
+async def apply_request_deadline(request: Request, call_next):
+    with deadline(REQUEST_DEADLINE):
+        return await call_next(request)
+
+
+# New usage events make the cached usage data stale, so drop it and rebuild both snapshots
+def on_usage_change() -> None:
+    LabUtilizationAdapter.invalidate_cache(usage_only=True)
+    ServerAllocationAdapter.invalidate_cache(usage_only=True)
+    lab_utilization_snapshots.notify_changed()
+    server_allocation_snapshots.notify_changed()
+
+
+# A new lab catalog can map upstream labs to other lab types, so rebuild both snapshots
+def on_lab_catalog_change() -> None:
+    lab_utilization_snapshots.notify_changed()
+    server_allocation_snapshots.notify_changed()
+
+
+# Load the saved caches, so the first snapshots are built from them, then start the snapshot materializers,
+# the usage change feed watcher, the lab catalog refreshes and the periodic cache saves
+@app.on_event("startup")
+async def start_snapshots() -> None:
+    if persist_cache:
+        loaded = load_caches(CACHE_PERSIST_PATH, adapter_caches, CACHE_PERSIST_MAX_AGE)
+        logger.info(f"Loaded {loaded} cached upstream responses from {CACHE_PERSIST_PATH}")
+    app.state.snapshot_tasks = [
+        asyncio.create_task(lab_utilization_snapshots.run()),
+        asyncio.create_task(server_allocation_snapshots.run()),
+        asyncio.create_task(watch_change_feed(USAGE_ANALYTICS_BASE_URL, on_usage_change, SNAPSHOT_INTERVAL, SNAPSHOT_MIN_INTERVAL)),
+        asyncio.create_task(lab_type_registry.run(LAB_CATALOG_REFRESH_INTERVAL, on_lab_catalog_change)),
+    ]
+    if persist_cache:
+        app.state.snapshot_tasks.append(
+            asyncio.create_task(persist_caches(CACHE_PERSIST_PATH, adapter_caches, CACHE_PERSIST_INTERVAL))
+        )
+
+
+# Stop the background tasks, save the caches and close the shared upstream connection pool
+@app.on_event("shutdown")
+async def shutdown_http_client() -> None:
+    for task in app.state.snapshot_tasks:
+        task.cancel()
+    if persist_cache:
+        try:
+            saved = save_caches(CACHE_PERSIST_PATH, adapter_caches)
+            logger.info(f"Saved {saved} cached upstream responses to {CACHE_PERSIST_PATH}")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving the caches to {CACHE_PERSIST_PATH}: {e}")
+    await close_client()
+
+
+# Get a materializer's current snapshot; fresh drops the adapter's cached upstream data and rebuilds it first.
+# A build that outlasts the request deadline leaves the previous snapshot, if any, to be served.
+async def current_snapshot(materializer: SnapshotMaterializer, adapter, fresh: bool) -> Snapshot:
+    if fresh:
+        adapter.invalidate_cache()
+    try:
+        return await within_deadline(materializer.get(fresh=fresh))
+    except DeadlineExceeded:
+        if materializer.snapshot is None:
+            raise
+        return materializer.snapshot
+
+
+# Serve a snapshot's pre-serialized document, or a document derived from it, with the snapshot's age
+def snapshot_response(snapshot: Snapshot, document: Optional[Dict[str, Any]] = None) -> Response:
+    headers = {"X-Snapshot-Age": f"{snapshot.age:.1f}"}
+    if document is not None:
+        return JSONResponse(content=document, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+
 # Root endpoint
 @app.get("/")
 async def root() -> Dict[str, Any]:
@@ -36,15 +151,22 @@ async def root() -> Dict[str, Any]:
             "/integration/lab-utilization/{lab_type}",
             "/integration/server-allocation",
             "/integration/server-allocation/{lab_type}",
+            "/integration/upstream-stats",
         ],
     }
 
 
 # Utilization endpoints
 @app.get("/integration/lab-utilization")
-async def get_lab_utilization() -> Dict[str, Any]:
+async def get_lab_utilization(fresh: bool = False) -> Response:
     try:
-        return LabUtilizationAdapter.get_enhanced_lab_analytics()
+        return snapshot_response(await current_snapshot(lab_utilization_snapshots, LabUtilizationAdapter, fresh))
+    except DeadlineExceeded as e:
+        logger.error("Deadline exceeded building lab analytics")
+        raise HTTPException(
+            status_code=504,  # Gateway Timeout
+            detail=f"Integration failed: {str(e)}"
+        )
     except LabIntegrationError as e:
         logger.error(f"Integration error fetching lab analytics: {e}")
         raise HTTPException(
@@ -60,44 +182,17 @@ async def get_lab_utilization() -> Dict[str, Any]:
 
 
 @app.get("/integration/lab-utilization/{lab_type}")
-async def get_lab_utilization_by_type(lab_type: str) -> Dict[str, Any]:
+async def get_lab_utilization_by_type(lab_type: str, fresh: bool = False) -> Response:
     try:
-        analytics = LabUtilizationAdapter.get_enhanced_lab_analytics()
-
-        # Filter for the specific lab type
-        filtered_analytics = {
-            "timestamp": analytics.get("timestamp"),
-            "lab_usage": {},
-            "infrastructure_insights": {"popular_labs": [], "utilization_status": {}},
-            "integration_status": analytics.get("integration_status", "success")
-        }
+        # A recent full snapshot already holds this lab's data
+        snapshot = lab_utilization_snapshots.snapshot
+        if not fresh and snapshot is not None and snapshot.age <= SNAPSHOT_MAX_AGE:
+            return snapshot_response(snapshot, LabUtilizationAdapter.filter_lab_analytics(snapshot.document, lab_type))
 
-        # Extract lab usage data for the specified lab type
-        if analytics.get("lab_usage") and lab_type in analytics["lab_usage"]:
-            filtered_analytics["lab_usage"][lab_type] = analytics["lab_usage"][lab_type]
-
-        # Extract popular labs data for the specified lab type
-        for lab in analytics.get("infrastructure_insights", {}).get("popular_labs", []):
-            if lab.get("lab_type") == lab_type:
-                filtered_analytics["infrastructure_insights"]["popular_labs"].append(lab)
-
-        # Extract utilization status for the specified lab type
-        if lab_type in analytics.get("infrastructure_insights", {}).get("utilization_status", {}):
-            filtered_analytics["infrastructure_insights"]["utilization_status"][lab_type] = analytics["infrastructure_insights"]["utilization_status"][lab_type]
-
-        # If we didn't find any relevant data for this lab type, add default data
-        if not filtered_analytics["lab_usage"] and not filtered_analytics["infrastructure_insights"]["popular_labs"] and not filtered_analytics["infrastructure_insights"]["utilization_status"]:
-            filtered_analytics["lab_usage"][lab_type] = {
-                "lab_type": lab_type,
-                "time_period_days": 7,
-                "unique_users": 0,
-                "total_events": 0,
-                "event_distribution": {},
-                "average_session_time_seconds": 0
-            }
-            filtered_analytics["integration_status"] = "partial"
-            
-        return filtered_analytics
+        # Otherwise fetch just this lab's data rather than rebuilding the full document
+        if fresh:
+            LabUtilizationAdapter.invalidate_cache()
+        return JSONResponse(content=await LabUtilizationAdapter.get_lab_analytics(lab_type), headers={"X-Snapshot-Age": "0.0"})
     except LabIntegrationError as e:
         logger.error(f"Integration error fetching lab utilization for {lab_type}: {e}")
         raise HTTPException(
@@ -114,9 +209,15 @@ async def get_lab_utilization_by_type(lab_type: str) -> Dict[str, Any]:
 
 # Server allocation endpoints
 @app.get("/integration/server-allocation")
-async def get_server_allocation() -> Dict[str, Any]:
+async def get_server_allocation(fresh: bool = False) -> Response:
     try:
-        return ServerAllocationAdapter.get_enhanced_performance_metrics()
+        return snapshot_response(await current_snapshot(server_allocation_snapshots, ServerAllocationAdapter, fresh))
+    except DeadlineExceeded as e:
+        logger.error("Deadline exceeded building performance metrics")
+        raise HTTPException(
+            status_code=504,  # Gateway Timeout
+            detail=f"Integration failed: {str(e)}"
+        )
     except ServerIntegrationError as e:
         logger.error(f"Integration error fetching performance metrics: {e}")
         raise HTTPException(
@@ -132,9 +233,29 @@ async def get_server_allocation() -> Dict[str, Any]:
 
 
 @app.get("/integration/server-allocation/{lab_type}")
-async def get_server_allocation_by_lab(lab_type: str) -> Dict[str, Any]:
+async def get_server_allocation_by_lab(lab_type: str, fresh: bool = False) -> Response:
     try:
-        return ServerAllocationAdapter.get_enhanced_performance_metrics(lab_type=lab_type)
+        snapshot = await current_snapshot(server_allocation_snapshots, ServerAllocationAdapter, fresh)
+        metrics = snapshot.document
+
+        # Keep only the specified lab type's performance data and allocations
+        filtered_metrics = {
+            **metrics,
+            "labs": {lab: data for lab, data in metrics["labs"].items() if lab == lab_type},
+            "infrastructure": {
+                **metrics["infrastructure"],
+                "allocation_map": {
+                    lab: servers for lab, servers in metrics["infrastructure"]["allocation_map"].items() if lab == lab_type
+                },
+            },
+        }
+        return snapshot_response(snapshot, filtered_metrics)
+    except DeadlineExceeded as e:
+        logger.error(f"Deadline exceeded building server allocation for {lab_type}")
+        raise HTTPException(
+            status_code=504,  # Gateway Timeout
+            detail=f"Integration failed: {str(e)}"
+        )
     except ServerIntegrationError as e:
         logger.error(f"Integration error fetching server allocation for {lab_type}: {e}")
         raise HTTPException(
@@ -149,6 +270,17 @@ async def get_server_allocation_by_lab(lab_type: str) -> Dict[str, Any]:
         )
 
 
+# Upstream fetches issued versus coalesced into a fetch already in flight, and the upstream circuit states
+@app.get("/integration/upstream-stats")
+async def get_upstream_stats() -> Dict[str, Any]:
+    return {**upstream_fetches.stats(), "circuit_breakers": circuit_breakers.states()}
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("INTEGRATION_API_PORT", 8007))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.environ.get("INTEGRATION_API_WORKERS", 1))
+    if workers > 1:
+        # Workers share upstream data only with CACHE_BACKEND=sqlite
+        uvicorn.run("integration_api:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+from http_client import get_client
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger("lab_registry")
+
+# Our lab catalog, which the registry maps upstream lab names onto
+USER_PROGRESS_BASE_URL = os.getenv("USER_PROGRESS_URL", "http://user-progress:8000")
+LABS_ENDPOINT = f"{USER_PROGRESS_BASE_URL}/labs/"
+CATALOG_PAGE_SIZE = 500
+
+# Seconds between catalog refreshes
+LAB_CATALOG_REFRESH_INTERVAL = int(os.getenv("LAB_CATALOG_REFRESH_INTERVAL", "300"))
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "5"))  # seconds
+
+# Upstream lab names mapped to lab types ahead of the catalog; LAB_TYPE_OVERRIDES adds to them, as a JSON object
+DEFAULT_LAB_TYPE_OVERRIDES = {
+    "Linux Basics": "linux-basics",
+    "Networking": "networking",
+    "Docker": "docker",
+    "Kubernetes": "kubernetes",
+    "Filesystem": "filesystem",
+}
+
+
+def _load_overrides() -> Dict[str, str]:
+    overrides = dict(DEFAULT_LAB_TYPE_OVERRIDES)
+    try:
+        overrides.update(json.loads(os.getenv("LAB_TYPE_OVERRIDES", "{}")))
+    except ValueError as e:
+        logger.error(f"Ignoring LAB_TYPE_OVERRIDES, which is not a JSON object: {e}")
+    return overrides
+
+
+# Lower-case, with hyphens and underscores as spaces and runs of whitespace collapsed,
+# so "Linux Basics", "linux-basics" and "LINUX  basics" all compare equal
+def normalize_lab_name(name: str) -> str:
+    return " ".join(re.sub(r"[-_]", " ", name.lower()).split())
+
+
+# Aho-Corasick automaton over a set of patterns: finds every occurrence of all of them in one pass over a text,
+# in time linear in the text's length plus the number of occurrences
+class AhoCorasick:
+    def __init__(self, patterns: Dict[str, Any]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[int, Any]]] = [[]]  # (pattern length, value) of the patterns ending here
+
+        for pattern, value in patterns.items():
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append([])
+                node = child
+            self._outputs[node].append((len(pattern), value))
+
+        # Breadth-first, point each node at the node of its longest proper suffix in the trie,
+        # and inherit that node's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    # (start, end, value) of every occurrence of a pattern in text
+    def find_all(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._outputs[node]:
+                yield index + 1 - length, index + 1, value
+
+
+# Maps upstream lab names to our lab types. A name equal to a catalog lab's name or lab type, or to an override,
+# is found in a hash index; otherwise the longest catalog name, lab type or override occurring in it as whole words
+# is found with an Aho-Corasick automaton; otherwise the name is slugified. Both indexes are rebuilt together
+# from the catalog and swapped in, so lookups never see a half-built registry.
+class LabTypeRegistry:
+    def __init__(self, overrides: Dict[str, str]):
+        self.overrides = overrides
+        self.catalog_size = 0
+        self._exact: Dict[str, str] = {}
+        self._automaton = AhoCorasick({})
+        self.rebuild([])
+
+    # Rebuild the indexes from catalog labs (dicts with name and lab_type); overrides win over names,
+    # and names over lab types. Returns whether the mapping changed; the automaton is only rebuilt if it did.
+    def rebuild(self, labs: List[Dict[str, Any]]) -> bool:
+        exact: Dict[str, str] = {}
+        for lab in labs:
+            if lab.get("lab_type"):
+                exact[normalize_lab_name(lab["lab_type"])] = lab["lab_type"]
+        for lab in labs:
+            if lab.get("name") and lab.get("lab_type"):
+                exact[normalize_lab_name(lab["name"])] = lab["lab_type"]
+        for name, lab_type in self.overrides.items():
+            exact[normalize_lab_name(name)] = lab_type
+
+        self.catalog_size = len(labs)
+        if exact == self._exact:
+            return False
+        self._exact, self._automaton = exact, AhoCorasick(exact)
+        return True
+
+    # Our lab type for an upstream lab name, or None without a name
+    def lab_type(self, lab_name: Optional[str]) -> Optional[str]:
+        if not lab_name:
+            return None
+        name = normalize_lab_name(lab_name)
+        lab_type = self._exact.get(name)
+        if lab_type is not None:
+            return lab_type
+
+        best = None
+        for start, end, lab_type in self._automaton.find_all(name):
+            whole_words = (start == 0 or name[start - 1] == " ") and (end == len(name) or name[end] == " ")
+            if whole_words and (best is None or end - start > best[0]):
+                best = (end - start, lab_type)
+        if best is not None:
+            return best[1]
+
+        # If no mapping found, generate a generic one based on name
+        return lab_name.lower().replace(" ", "-")
+
+    # Fetch the whole catalog from User Progress and rebuild the indexes; returns whether the mapping changed.
+    # On failure the current indexes are kept.
+    async def refresh(self) -> bool:
+        labs: List[Dict[str, Any]] = []
+        try:
+            while True:
+                response = await get_client().get(
+                    LABS_ENDPOINT, params={"skip": len(labs), "limit": CATALOG_PAGE_SIZE}, timeout=REQUEST_TIMEOUT
+                )
+                response.raise_for_status()
+                page = response.json()
+                labs.extend(page)
+                if len(page) < CATALOG_PAGE_SIZE:
+                    break
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Could not refresh the lab catalog, keeping {self.catalog_size} catalog labs: {e}")
+            return False
+
+        changed = self.rebuild(labs)
+        if changed:
+            logger.info(f"Loaded {len(labs)} labs from the lab catalog")
+        return changed
+
+    # Refresh the catalog now and every interval seconds, calling on_change when the mapping changes
+    async def run(self, interval: float, on_change: Callable[[], None]) -> None:
+        while True:
+            if await self.refresh():
+                on_change()
+            await asyncio.sleep(interval)
+
+
+# Shared by both adapters
+lab_type_registry = LabTypeRegistry(_load_overrides())
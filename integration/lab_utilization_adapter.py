@@ -1,12 +1,18 @@
-import requests
+import asyncio
+import httpx
 import json
 from typing import Dict, Any, List, Optional
 import os
 import logging
 from datetime import datetime
-import time
-from functools import lru_cache
 from dotenv import load_dotenv
+from http_client import get_client, close_client
+from ttl_cache import TTLCache
+from cache_backends import create_cache_backend
+from single_flight import upstream_fetches
+from data_loader import DataLoader
+from lab_registry import lab_type_registry
+from resilience import CircuitOpenError, DeadlineExceeded, backoff_delay, circuit_breakers, time_remaining, within_deadline
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,15 +29,20 @@ LAB_UTILIZATION_ENDPOINT = f"{LAB_MONITORING_BASE_URL}/monitor/labs/over-under-u
 # Our service endpoint - Use service name for internal docker networking
 USAGE_ANALYTICS_BASE_URL = os.getenv("USAGE_ANALYTICS_URL", "http://usage-analytics:8000")
 USAGE_ANALYTICS_TRENDS_ENDPOINT = f"{USAGE_ANALYTICS_BASE_URL}/analytics/trends"
-USAGE_ANALYTICS_LAB_ENDPOINT = f"{USAGE_ANALYTICS_BASE_URL}/analytics/usage/lab"
+USAGE_ANALYTICS_LABS_ENDPOINT = f"{USAGE_ANALYTICS_BASE_URL}/analytics/usage/labs"
 
 # Configure request timeout and retry settings
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "5"))  # seconds
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "2"))
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "1"))  # seconds
+RETRY_DELAY = float(os.getenv("RETRY_DELAY", "1"))  # seconds before the first retry, doubling for each further one
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))  # seconds
 
-# Cache duration in seconds (5 minutes by default)
+# Cache duration in seconds (5 minutes by default); expired data is served for up to CACHE_STALE_DURATION more
+# while it is refreshed in the background, and upstream failures are cached for CACHE_FAILURE_DURATION
 CACHE_DURATION = int(os.getenv("CACHE_DURATION", "300"))
+CACHE_STALE_DURATION = int(os.getenv("CACHE_STALE_DURATION", "900"))
+CACHE_FAILURE_DURATION = int(os.getenv("CACHE_FAILURE_DURATION", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
 
 # Print connection information
 logger.info(f"Connecting to Lab Monitoring Service at: {LAB_MONITORING_BASE_URL}")
@@ -53,170 +64,191 @@ Ensure that both services are running for proper integration.
 
 # Adapter class for lab utilization and analytics
 class LabUtilizationAdapter:
-    _last_fetch_time = {
-        "popular_labs": 0,
-        "lab_utilization": 0,
-        "usage_analytics": 0,
-    }
-    _cached_data = {
-        "popular_labs": None,
-        "lab_utilization": None,
-        "usage_analytics": {},
-    }
-
-    # Check if cached data should be used based on cache duration
+    _cache = TTLCache(
+        CACHE_DURATION,
+        CACHE_STALE_DURATION,
+        CACHE_FAILURE_DURATION,
+        create_cache_backend("lab_utilization", CACHE_MAX_ENTRIES, IntegrationError),
+    )
+
+    # Drop cached upstream data so it is fetched again; with usage_only, just the data from our Usage Analytics Service
     @classmethod
-    def _should_use_cache(cls, cache_key: str) -> bool:
-        current_time = time.time()
-        return (cls._cached_data.get(cache_key) is not None and current_time - cls._last_fetch_time.get(cache_key, 0) < CACHE_DURATION)
+    def invalidate_cache(cls, usage_only: bool = False) -> None:
+        cls._cache.invalidate((lambda key: isinstance(key, tuple) and key[0] == "usage_analytics") if usage_only else None)
 
-    # Fetch popular labs data from the Infrastructure-Microservice
+    # GET an upstream endpoint, sharing the result with concurrent fetches of the same URL and parameters;
+    # endpoint names the circuit breaker, for URLs carrying a path parameter. Raises DeadlineExceeded, which is
+    # not an upstream failure and so is not cached, once the request's deadline passes.
     @classmethod
-    @lru_cache(maxsize=32)
-    def get_popular_labs(cls) -> List[Dict[str, Any]]:
-        if cls._should_use_cache("popular_labs"):
-            logger.info("Using cached popular labs data")
-            return cls._cached_data["popular_labs"]
+    async def _fetch(
+        cls,
+        url: str,
+        description: str,
+        params: Optional[Dict[str, Any]] = None,
+        retries: int = MAX_RETRIES,
+        endpoint: Optional[str] = None,
+    ) -> Any:
+        key = (url, tuple(sorted((params or {}).items())))
+        return await within_deadline(
+            upstream_fetches.do(key, lambda: cls._request(url, description, endpoint or url, retries, params))
+        )
+
+    # GET an upstream endpoint, retrying failures with jittered exponential backoff within the request's deadline.
+    # Raises IntegrationError once all attempts fail, at once while the endpoint's circuit is open, and without
+    # retrying when the upstream rejects the request.
+    @staticmethod
+    async def _request(
+        url: str, description: str, endpoint: str, retries: int, params: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        breaker = circuit_breakers.get(endpoint)
+        for attempt in range(retries + 1):
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded(f"Failed to fetch {description}: request deadline exceeded")
+            try:
+                breaker.check()
+            except CircuitOpenError as e:
+                raise IntegrationError(f"Failed to fetch {description}: {str(e)}")
 
-        for attempt in range(MAX_RETRIES + 1):
             try:
-                logger.info(f"Fetching popular labs data (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(POPULAR_LABS_ENDPOINT, timeout=REQUEST_TIMEOUT)
+                logger.info(f"Fetching {description} (attempt {attempt + 1}/{retries + 1})")
+                timeout = REQUEST_TIMEOUT if remaining is None else min(REQUEST_TIMEOUT, remaining)
+                response = await get_client().get(url, params=params, timeout=timeout)
                 response.raise_for_status()
-                
+
                 data = response.json()
-                logger.info("Successfully connected to Infrastructure-Microservice popular labs endpoint")
-                
-                # Update cache
-                cls._cached_data["popular_labs"] = data
-                cls._last_fetch_time["popular_labs"] = time.time()
-                
+                breaker.record_success()
+                logger.info(f"Successfully fetched {description}")
                 return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching popular labs (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch popular labs failed.")
-                    # Return empty data instead of raising an exception
-                    empty_data = []
-                    cls._cached_data["popular_labs"] = empty_data
-                    cls._last_fetch_time["popular_labs"] = time.time()
-                    return empty_data
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500:
+                    # The upstream is up and answered; asking again would get the same answer
+                    breaker.record_success()
+                    raise IntegrationError(f"Failed to fetch {description}: {str(e)}")
+                breaker.record_failure()
+                error = e
+            except httpx.HTTPError as e:
+                breaker.record_failure()
+                error = e
+
+            logger.warning(f"Error fetching {description} (attempt {attempt + 1}): {error}")
+            delay = backoff_delay(attempt, RETRY_DELAY, RETRY_MAX_DELAY)
+            remaining = time_remaining()
+            if attempt < retries and (remaining is None or delay < remaining):
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"All {attempt + 1} attempts to fetch {description} failed.")
+                raise IntegrationError(f"Failed to fetch {description}: {str(error)}")
 
-    # Fetch lab utilization data from the Infrastructure-Microservice
+    # Fetch popular labs data from the Infrastructure-Microservice
     @classmethod
-    @lru_cache(maxsize=32)
-    def get_lab_utilization(cls) -> List[Dict[str, Any]]:
-        if cls._should_use_cache("lab_utilization"):
-            logger.info("Using cached lab utilization data")
-            return cls._cached_data["lab_utilization"]
+    async def get_popular_labs(cls) -> List[Dict[str, Any]]:
+        try:
+            return await cls._cache.get("popular_labs", lambda: cls._fetch(POPULAR_LABS_ENDPOINT, "popular labs"))
+        except (IntegrationError, DeadlineExceeded):
+            # Return empty data instead of raising an exception
+            return []
 
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                logger.info(f"Fetching lab utilization data (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(LAB_UTILIZATION_ENDPOINT, timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-                
-                data = response.json()
-                logger.info("Successfully connected to Infrastructure-Microservice lab utilization endpoint")
-                
-                # Update cache
-                cls._cached_data["lab_utilization"] = data
-                cls._last_fetch_time["lab_utilization"] = time.time()
-                
-                return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching lab utilization (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch lab utilization failed.")
-                    # Return empty data instead of raising an exception
-                    empty_data = []  # Return an empty list of labs instead of raising an exception
-                    cls._cached_data["lab_utilization"] = empty_data
-                    cls._last_fetch_time["lab_utilization"] = time.time()
-                    return empty_data
+    # Fetch lab utilization data from the Infrastructure-Microservice
+    @classmethod
+    async def get_lab_utilization(cls) -> List[Dict[str, Any]]:
+        try:
+            return await cls._cache.get("lab_utilization", lambda: cls._fetch(LAB_UTILIZATION_ENDPOINT, "lab utilization"))
+        except (IntegrationError, DeadlineExceeded):
+            # Return an empty list of labs instead of raising an exception
+            return []
 
     # Fetch usage analytics trends from our CC_Project's Usage Analytics Service
     @classmethod
-    def get_our_usage_analytics(cls, days: int = 30) -> Dict[str, Any]:
-        cache_key = f"usage_analytics_{days}"
-        if cache_key in cls._cached_data and cls._should_use_cache(cache_key):
-            logger.info(f"Using cached usage analytics data for {days} days")
-            return cls._cached_data[cache_key]
-
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                logger.info(f"Fetching usage analytics trends for {days} days (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(f"{USAGE_ANALYTICS_TRENDS_ENDPOINT}?days={days}", timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-                
-                data = response.json()
-                logger.info(f"Successfully fetched usage analytics trends for {days} days")
-                
-                # Update cache
-                cls._cached_data[cache_key] = data
-                cls._last_fetch_time[cache_key] = time.time()
-                
-                return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching usage analytics (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch usage analytics failed.")
-                    # Return empty data instead of raising an exception
-                    empty_data = {"lab_usage": {}}
-                    cls._cached_data[cache_key] = empty_data
-                    cls._last_fetch_time[cache_key] = time.time()
-                    return empty_data
-
-    # Fetch lab usage data from our CC_Project's Usage Analytics Service
-    @staticmethod
-    def get_lab_usage(lab_type: str, days: int = 7) -> Dict[str, Any]:
+    async def get_our_usage_analytics(cls, days: int = 30) -> Dict[str, Any]:
         try:
-            response = requests.get(f"{USAGE_ANALYTICS_LAB_ENDPOINT}/{lab_type}?days={days}", timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            logger.error(f"Error fetching lab usage for {lab_type}: {e}")
+            return await cls._cache.get(
+                ("usage_analytics", days),
+                lambda: cls._fetch(
+                    USAGE_ANALYTICS_TRENDS_ENDPOINT, f"usage analytics trends for {days} days", params={"days": days}
+                ),
+            )
+        except (IntegrationError, DeadlineExceeded):
             # Return empty data instead of raising an exception
-            return {
-                "lab_type": lab_type,
-                "time_period_days": days,
-                "unique_users": 0,
-                "total_events": 0,
-                "event_distribution": {},
-                "average_session_time_seconds": 0
-            }
+            return {"lab_usage": {}}
+
+    # Fetch lab usage data for several lab types from our Usage Analytics Service in one request
+    @classmethod
+    async def get_labs_usage(cls, lab_types: List[str], days: int = 7) -> Dict[str, Dict[str, Any]]:
+        labs = await cls._get_labs_usage(lab_types, days)
+        # Labs without data get empty data
+        return {lab_type: labs.get(lab_type) or cls._empty_lab_usage(lab_type, days) for lab_type in sorted(set(lab_types))}
 
-    # Map lab ID from Infrastructure-Microservice to our lab type
+    # Usage data of the lab types that have any, cached per set of lab types; empty on failure
+    @classmethod
+    async def _get_labs_usage(cls, lab_types: List[str], days: int = 7) -> Dict[str, Dict[str, Any]]:
+        lab_types = sorted(set(lab_types))
+        try:
+            data = await cls._cache.get(
+                ("usage_analytics", days, ",".join(lab_types)),
+                lambda: cls._fetch(
+                    USAGE_ANALYTICS_LABS_ENDPOINT,
+                    f"lab usage for {len(lab_types)} labs",
+                    params={"lab_types": ",".join(lab_types), "days": days},
+                    retries=0,
+                ),
+            )
+            return data.get("labs", {})
+        except (IntegrationError, DeadlineExceeded):
+            return {}
+
+    # Usage data for a lab without any usage
     @staticmethod
-    def map_lab_id_to_type(lab_id: int, lab_name: str) -> Optional[str]:
-        name_to_type = {
-            "Linux Basics": "linux-basics",
-            "Networking": "networking",
-            "Docker": "docker",
-            "Kubernetes": "kubernetes",
-            "Filesystem": "filesystem",
-            # Add more mappings as needed
+    def _empty_lab_usage(lab_type: str, days: int = 7) -> Dict[str, Any]:
+        return {
+            "lab_type": lab_type,
+            "time_period_days": days,
+            "unique_users": 0,
+            "total_events": 0,
+            "event_distribution": {},
+            "average_session_time_seconds": 0
         }
 
-        # Try direct mapping from name to type (simplified)
-        for known_name, lab_type in name_to_type.items():
-            if known_name.lower() in lab_name.lower():
-                return lab_type
+    # Popular lab entry of the infrastructure insights
+    @staticmethod
+    def _popular_lab_entry(lab: Dict[str, Any], lab_type: str) -> Dict[str, Any]:
+        return {
+            "lab_type": lab_type,
+            "name": lab.get("name"),
+            "sessions": lab.get("total_sessions", 0),
+            "user_minutes": lab.get("total_user_minutes", 0),
+        }
 
-        # If no mapping found, generate a generic one based on name
-        return lab_name.lower().replace(" ", "-")
+    # Utilization status entry of the infrastructure insights
+    @staticmethod
+    def _utilization_entry(lab: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": lab.get("status"),
+            "avg_users": lab.get("avg_users"),
+            "estimated_users": lab.get("estimated_users"),
+            "ratio": lab.get("ratio"),
+        }
+
+    # Integration status given whether each side returned data
+    @staticmethod
+    def _integration_status(popular_labs: List[Dict[str, Any]], lab_utilization: List[Dict[str, Any]], our_usage_trends: Dict[str, Any]) -> str:
+        has_infrastructure_data = bool(popular_labs) or bool(lab_utilization)
+        has_analytics_data = "lab_usage" in our_usage_trends and bool(our_usage_trends["lab_usage"])
+        if not has_infrastructure_data and not has_analytics_data:
+            return "failed"
+        if not has_infrastructure_data or not has_analytics_data:
+            return "partial"
+        return "success"
+
+    # Whether an enhanced analytics document is missing data from either service
+    @staticmethod
+    def is_degraded(analytics: Dict[str, Any]) -> bool:
+        return analytics.get("integration_status") != "success" or "error_details" in analytics
 
     # Fetch enhanced lab analytics by combining data from both services
     @classmethod
-    def get_enhanced_lab_analytics(cls) -> Dict[str, Any]:
+    async def get_enhanced_lab_analytics(cls) -> Dict[str, Any]:
         # Initialize default response structure
         enhanced_analytics = {
             "timestamp": datetime.utcnow().isoformat(),
@@ -226,63 +258,45 @@ class LabUtilizationAdapter:
         }
         
         try:
-            # Get data from both services - these methods now return empty data on failure instead of raising exceptions
-            popular_labs = cls.get_popular_labs()
-            lab_utilization = cls.get_lab_utilization()
-            our_usage_trends = cls.get_our_usage_analytics()
+            # Get data from both services concurrently - these methods return empty data on failure instead of raising exceptions
+            popular_labs, lab_utilization, our_usage_trends = await asyncio.gather(
+                cls.get_popular_labs(), cls.get_lab_utilization(), cls.get_our_usage_analytics()
+            )
 
             # Track if we have partial data
-            has_infrastructure_data = bool(popular_labs) or bool(lab_utilization)
-            has_analytics_data = "lab_usage" in our_usage_trends and bool(our_usage_trends["lab_usage"])
-            
-            if not has_infrastructure_data and not has_analytics_data:
-                enhanced_analytics["integration_status"] = "failed"
-            elif not has_infrastructure_data or not has_analytics_data:
-                enhanced_analytics["integration_status"] = "partial"
+            enhanced_analytics["integration_status"] = cls._integration_status(popular_labs, lab_utilization, our_usage_trends)
 
             # Add our analytics data
             if our_usage_trends and "lab_usage" in our_usage_trends:
-                enhanced_analytics["lab_usage"] = our_usage_trends["lab_usage"]
+                enhanced_analytics["lab_usage"] = dict(our_usage_trends["lab_usage"])  # A copy, as entries are added below
 
             # Add infrastructure insights
+            missing_lab_types = []
             for lab in popular_labs:
-                lab_id = lab.get("lab_id")
-                name = lab.get("name")
-                lab_type = cls.map_lab_id_to_type(lab_id, name)
+                lab_type = lab_type_registry.lab_type(lab.get("name"))
 
                 if lab_type:
-                    enhanced_analytics["infrastructure_insights"]["popular_labs"].append(
-                        {
-                            "lab_type": lab_type,
-                            "name": name,
-                            "sessions": lab.get("total_sessions", 0),
-                            "user_minutes": lab.get("total_user_minutes", 0),
-                        }
-                    )
-
-                    # Try to get our usage data for this lab type
-                    try:
-                        our_lab_data = cls.get_lab_usage(lab_type)
-                        if our_lab_data and lab_type not in enhanced_analytics["lab_usage"]:
-                            enhanced_analytics["lab_usage"][lab_type] = our_lab_data
-                    except Exception as e:
-                        logger.warning(f"Could not get our usage data for {lab_type}: {e}")
+                    enhanced_analytics["infrastructure_insights"]["popular_labs"].append(cls._popular_lab_entry(lab, lab_type))
+                    if lab_type not in enhanced_analytics["lab_usage"]:
+                        missing_lab_types.append(lab_type)
+
+            # Try to get our usage data for popular labs missing from the trends, in one batched request
+            lab_usage_loader = DataLoader(batch_load=cls.get_labs_usage)
+            lab_usages = await asyncio.gather(
+                *(lab_usage_loader.load(lab_type) for lab_type in missing_lab_types), return_exceptions=True
+            )
+            for lab_type, our_lab_data in zip(missing_lab_types, lab_usages):
+                if isinstance(our_lab_data, Exception):
+                    logger.warning(f"Could not get our usage data for {lab_type}: {our_lab_data}")
+                elif our_lab_data:
+                    enhanced_analytics["lab_usage"][lab_type] = our_lab_data
 
             # Add utilization status information
             for lab in lab_utilization:
-                lab_id = lab.get("lab_id")
-                name = lab.get("name")
-                lab_type = cls.map_lab_id_to_type(lab_id, name)
+                lab_type = lab_type_registry.lab_type(lab.get("name"))
 
                 if lab_type:
-                    enhanced_analytics["infrastructure_insights"]["utilization_status"][
-                        lab_type
-                    ] = {
-                        "status": lab.get("status"),
-                        "avg_users": lab.get("avg_users"),
-                        "estimated_users": lab.get("estimated_users"),
-                        "ratio": lab.get("ratio"),
-                    }
+                    enhanced_analytics["infrastructure_insights"]["utilization_status"][lab_type] = cls._utilization_entry(lab)
 
             # Add default data for common lab types if we don't have data
             default_lab_types = ["linux-basics", "docker", "kubernetes", "networking", "filesystem"]
@@ -305,22 +319,102 @@ class LabUtilizationAdapter:
             enhanced_analytics["error_details"] = str(e)
             return enhanced_analytics
 
+    # Keep only one lab type's data from an enhanced analytics document, with default usage data if there is none
+    @staticmethod
+    def filter_lab_analytics(analytics: Dict[str, Any], lab_type: str) -> Dict[str, Any]:
+        filtered_analytics = {
+            "timestamp": analytics.get("timestamp"),
+            "lab_usage": {},
+            "infrastructure_insights": {"popular_labs": [], "utilization_status": {}},
+            "integration_status": analytics.get("integration_status", "success")
+        }
+
+        # Extract lab usage data for the specified lab type
+        if analytics.get("lab_usage") and lab_type in analytics["lab_usage"]:
+            filtered_analytics["lab_usage"][lab_type] = analytics["lab_usage"][lab_type]
+
+        # Extract popular labs data for the specified lab type
+        for lab in analytics.get("infrastructure_insights", {}).get("popular_labs", []):
+            if lab.get("lab_type") == lab_type:
+                filtered_analytics["infrastructure_insights"]["popular_labs"].append(lab)
+
+        # Extract utilization status for the specified lab type
+        if lab_type in analytics.get("infrastructure_insights", {}).get("utilization_status", {}):
+            filtered_analytics["infrastructure_insights"]["utilization_status"][lab_type] = analytics["infrastructure_insights"]["utilization_status"][lab_type]
+
+        # If we didn't find any relevant data for this lab type, add default data
+        if not filtered_analytics["lab_usage"] and not filtered_analytics["infrastructure_insights"]["popular_labs"] and not filtered_analytics["infrastructure_insights"]["utilization_status"]:
+            filtered_analytics["lab_usage"][lab_type] = {
+                "lab_type": lab_type,
+                "time_period_days": 7,
+                "unique_users": 0,
+                "total_events": 0,
+                "event_distribution": {},
+                "average_session_time_seconds": 0
+            }
+            filtered_analytics["integration_status"] = "partial"
+
+        return filtered_analytics
+
+    # Fetch enhanced lab analytics for one lab type, fetching our usage data for that lab only, through the
+    # cached batched usage request rather than the trends of every lab, and keeping only its entries of the
+    # infrastructure lists
+    @classmethod
+    async def get_lab_analytics(cls, lab_type: str) -> Dict[str, Any]:
+        lab_analytics = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "lab_usage": {},
+            "infrastructure_insights": {"popular_labs": [], "utilization_status": {}},
+            "integration_status": "success"
+        }
+
+        try:
+            popular_labs, lab_utilization, our_labs_usage = await asyncio.gather(
+                cls.get_popular_labs(), cls.get_lab_utilization(), cls._get_labs_usage([lab_type])
+            )
+            our_usage = {"lab_usage": our_labs_usage}
+            lab_analytics["integration_status"] = cls._integration_status(popular_labs, lab_utilization, our_usage)
+
+            lab_analytics["lab_usage"][lab_type] = our_labs_usage.get(lab_type) or cls._empty_lab_usage(lab_type)
+
+            for lab in popular_labs:
+                if lab_type_registry.lab_type(lab.get("name")) == lab_type:
+                    lab_analytics["infrastructure_insights"]["popular_labs"].append(cls._popular_lab_entry(lab, lab_type))
+
+            for lab in lab_utilization:
+                if lab_type_registry.lab_type(lab.get("name")) == lab_type:
+                    lab_analytics["infrastructure_insights"]["utilization_status"][lab_type] = cls._utilization_entry(lab)
+
+            return cls.filter_lab_analytics(lab_analytics, lab_type)
+        except Exception as e:
+            # Never fail, provide at least a minimal response
+            logger.error(f"Unexpected error in get_lab_analytics for {lab_type}: {e}")
+            lab_analytics["integration_status"] = "error"
+            lab_analytics["error_details"] = str(e)
+            return lab_analytics
+
 
 # Example usage
-if __name__ == "__main__":
+async def main():
     adapter = LabUtilizationAdapter()
 
     try:
         print("Fetching popular labs...")
-        popular_labs = adapter.get_popular_labs()
+        popular_labs = await adapter.get_popular_labs()
         print(json.dumps(popular_labs, indent=2))
 
         print("\nFetching lab utilization...")
-        lab_utilization = adapter.get_lab_utilization()
+        lab_utilization = await adapter.get_lab_utilization()
         print(json.dumps(lab_utilization, indent=2))
 
         print("\nFetching enhanced analytics...")
-        enhanced_analytics = adapter.get_enhanced_lab_analytics()
+        enhanced_analytics = await adapter.get_enhanced_lab_analytics()
         print(json.dumps(enhanced_analytics, indent=2))
     except IntegrationError as e:
         print(f"Integration failed: {e}")
+    finally:
+        await close_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterator, Optional
+
+logger = logging.getLogger("resilience")
+
+# Consecutive failures that open an upstream endpoint's circuit, and seconds it stays open before one trial request
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+
+# Raised instead of calling an upstream whose circuit is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# Raised when the current request's deadline passes before its upstream calls finish
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Circuit breaker of one upstream endpoint. Closed, requests go through; after failure_threshold consecutive
+# failures it opens and requests fail at once. After reset_timeout it is half-open: one trial request goes
+# through, and its success closes the circuit while its failure opens it again.
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+
+    # Raises CircuitOpenError unless a request may be sent now
+    def check(self) -> None:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit open for {self.name}")
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open":
+            # A trial that never reported back does not keep the circuit half-open for good
+            if self._trial_in_flight and time.monotonic() - self._trial_started < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit half-open for {self.name}, trial request in flight")
+            self._trial_in_flight = True
+            self._trial_started = time.monotonic()
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"Circuit closed for {self.name}")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit opened for {self.name} after {self.failures} failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+# Circuit breakers keyed by upstream endpoint, created on first use
+class CircuitBreakers:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {"state": b.state, "failures": b.failures} for name, b in self._breakers.items()}
+
+
+# Upstream endpoints of both adapters
+circuit_breakers = CircuitBreakers(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+# Seconds to wait before retry number attempt + 1: exponential in the attempt, capped, with full jitter
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# time.monotonic() by which the upstream calls made for the current request must finish
+_deadline: ContextVar[Optional[float]] = ContextVar("upstream_deadline", default=None)
+
+
+# Bound the upstream calls made inside the block, including those of tasks it starts, to seconds from now;
+# a deadline already in effect that ends sooner is kept
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Seconds left before the current deadline, or None when there is none
+def time_remaining() -> Optional[float]:
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+# Await a result for no longer than the current deadline allows; raises DeadlineExceeded past it
+async def within_deadline(awaitable: Awaitable[Any]) -> Any:
+    remaining = time_remaining()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(remaining, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded")
@@ -1,12 +1,18 @@
-import requests
+import asyncio
+import httpx
 import json
 from typing import Dict, Any, List, Optional
 import os
 import logging
 from datetime import datetime
-import time
-from functools import lru_cache
 from dotenv import load_dotenv
+from http_client import get_client, close_client
+from ttl_cache import TTLCache
+from cache_backends import create_cache_backend
+from single_flight import upstream_fetches
+from data_loader import DataLoader
+from lab_registry import lab_type_registry
+from resilience import CircuitOpenError, DeadlineExceeded, backoff_delay, circuit_breakers, time_remaining, within_deadline
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,18 +35,30 @@ PERFORMANCE_REPORTING_BASE_URL = os.getenv("PERFORMANCE_REPORTING_URL", "http://
 LAB_PERFORMANCE_ENDPOINT = f"{PERFORMANCE_REPORTING_BASE_URL}/performance/lab"
 USER_PERFORMANCE_ENDPOINT = f"{PERFORMANCE_REPORTING_BASE_URL}/performance/user"
 
+USAGE_ANALYTICS_BASE_URL = os.getenv("USAGE_ANALYTICS_URL", "http://usage-analytics:8000")
+LAB_CONCURRENCY_ENDPOINT = f"{USAGE_ANALYTICS_BASE_URL}/analytics/concurrency"
+
 # Configure request timeout and retry settings
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "5"))  # seconds
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "2"))
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "1"))  # seconds
+RETRY_DELAY = float(os.getenv("RETRY_DELAY", "1"))  # seconds before the first retry, doubling for each further one
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))  # seconds
+
+# Most per-key upstream lookups a document build runs at once
+LOADER_CONCURRENCY = int(os.getenv("LOADER_CONCURRENCY", "10"))
 
-# Cache duration in seconds (5 minutes by default)
+# Cache duration in seconds (5 minutes by default); expired data is served for up to CACHE_STALE_DURATION more
+# while it is refreshed in the background, and upstream failures are cached for CACHE_FAILURE_DURATION
 CACHE_DURATION = int(os.getenv("CACHE_DURATION", "300"))
+CACHE_STALE_DURATION = int(os.getenv("CACHE_STALE_DURATION", "900"))
+CACHE_FAILURE_DURATION = int(os.getenv("CACHE_FAILURE_DURATION", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
 
 # Print connection information
 logger.info(f"Connecting to Resource Allocation Service at: {RESOURCE_ALLOCATION_BASE_URL}")
 logger.info(f"Connecting to Performance Service at: {PERFORMANCE_SERVICE_BASE_URL}")
 logger.info(f"Connecting to Performance Reporting Service at: {PERFORMANCE_REPORTING_BASE_URL}")
+logger.info(f"Connecting to Usage Analytics Service at: {USAGE_ANALYTICS_BASE_URL}")
 
 # Define a custom exception for integration failures
 class IntegrationError(Exception):
@@ -59,234 +77,260 @@ Ensure that both services are running for proper integration.
 
 # Adapter class for integrating performance-reporting-service with resourceAllocation service
 class ServerAllocationAdapter:
-    _last_fetch_time = {
-        "servers": 0,
-        "allocations": 0,
-        "server_stats": 0,
-    }
-    _cached_data = {
-        "servers": None,
-        "allocations": None,
-        "server_stats": None,
-        "server_peaks": {},
-        "lab_performance": {},
-        "user_performance": {},
-    }
-
-    # Check if cached data should be used based on cache duration
+    _cache = TTLCache(
+        CACHE_DURATION,
+        CACHE_STALE_DURATION,
+        CACHE_FAILURE_DURATION,
+        create_cache_backend("server_allocation", CACHE_MAX_ENTRIES, IntegrationError),
+    )
+
+    # Drop cached upstream data so it is fetched again; with usage_only, just the data from our Usage Analytics Service
     @classmethod
-    def _should_use_cache(cls, cache_key: str) -> bool:
-        current_time = time.time()
-        return (
-            cls._cached_data.get(cache_key) is not None
-            and current_time - cls._last_fetch_time.get(cache_key, 0) < CACHE_DURATION
-        )
+    def invalidate_cache(cls, usage_only: bool = False) -> None:
+        cls._cache.invalidate((lambda key: isinstance(key, tuple) and key[0] == "lab_concurrency") if usage_only else None)
 
-    # Fetch server information from the Infrastructure-Microservice
+    # GET an upstream endpoint, sharing the result with concurrent fetches of the same URL and parameters;
+    # endpoint names the circuit breaker, for URLs carrying a path parameter. Raises DeadlineExceeded, which is
+    # not an upstream failure and so is not cached, once the request's deadline passes.
     @classmethod
-    @lru_cache(maxsize=32)
-    def get_servers(cls) -> List[Dict[str, Any]]:
-        if cls._should_use_cache("servers"):
-            logger.info("Using cached server data")
-            return cls._cached_data["servers"]
+    async def _fetch(
+        cls,
+        url: str,
+        description: str,
+        service: str,
+        params: Optional[Dict[str, Any]] = None,
+        retries: int = MAX_RETRIES,
+        endpoint: Optional[str] = None,
+    ) -> Any:
+        key = (url, tuple(sorted((params or {}).items())))
+        return await within_deadline(
+            upstream_fetches.do(key, lambda: cls._request(url, description, service, params, endpoint or url, retries))
+        )
 
-        for attempt in range(MAX_RETRIES + 1):
+    # GET an upstream endpoint, retrying failures with jittered exponential backoff within the request's deadline.
+    # Raises IntegrationError once all attempts fail, at once while the endpoint's circuit is open, and without
+    # retrying when the upstream rejects the request.
+    @staticmethod
+    async def _request(
+        url: str, description: str, service: str, params: Optional[Dict[str, Any]], endpoint: str, retries: int
+    ) -> Any:
+        breaker = circuit_breakers.get(endpoint)
+        for attempt in range(retries + 1):
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded(f"Failed to connect to {service}: request deadline exceeded")
             try:
-                logger.info(f"Fetching server data (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(SERVERS_ENDPOINT, timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-
-                data = response.json()
-                logger.info("Successfully connected to Infrastructure-Microservice servers endpoint")
+                breaker.check()
+            except CircuitOpenError as e:
+                raise IntegrationError(f"Failed to connect to {service}: {str(e)}")
 
-                # Update cache
-                cls._cached_data["servers"] = data
-                cls._last_fetch_time["servers"] = time.time()
-
-                return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching servers (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch servers failed.")
-                    raise IntegrationError(f"Failed to connect to Resource Allocation Service: {str(e)}")
-
-    # Fetch lab-server allocations from the Infrastructure-Microservice
-    @classmethod
-    @lru_cache(maxsize=32)
-    def get_allocations(cls) -> List[Dict[str, Any]]:
-        if cls._should_use_cache("allocations"):
-            logger.info("Using cached allocation data")
-            return cls._cached_data["allocations"]
-
-        for attempt in range(MAX_RETRIES + 1):
             try:
-                logger.info(f"Fetching allocation data (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(ALLOCATIONS_ENDPOINT, timeout=REQUEST_TIMEOUT)
+                logger.info(f"Fetching {description} (attempt {attempt + 1}/{retries + 1})")
+                timeout = REQUEST_TIMEOUT if remaining is None else min(REQUEST_TIMEOUT, remaining)
+                response = await get_client().get(url, params=params, timeout=timeout)
                 response.raise_for_status()
 
                 data = response.json()
-                logger.info("Successfully connected to Infrastructure-Microservice allocations endpoint")
-
-                # Update cache
-                cls._cached_data["allocations"] = data
-                cls._last_fetch_time["allocations"] = time.time()
-
+                breaker.record_success()
+                logger.info(f"Successfully fetched {description}")
                 return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching allocations (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch allocations failed.")
-                    raise IntegrationError(f"Failed to connect to Resource Allocation Service: {str(e)}")
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500:
+                    # The upstream is up and answered; asking again would get the same answer
+                    breaker.record_success()
+                    raise IntegrationError(f"Failed to connect to {service}: {str(e)}")
+                breaker.record_failure()
+                error = e
+            except httpx.HTTPError as e:
+                breaker.record_failure()
+                error = e
+
+            logger.warning(f"Error fetching {description} (attempt {attempt + 1}): {error}")
+            delay = backoff_delay(attempt, RETRY_DELAY, RETRY_MAX_DELAY)
+            remaining = time_remaining()
+            if attempt < retries and (remaining is None or delay < remaining):
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"All {attempt + 1} attempts to fetch {description} failed.")
+                raise IntegrationError(f"Failed to connect to {service}: {str(error)}")
 
-    # Fetch server performance statistics from the Infrastructure-Microservice
+    # Fetch server information from the Infrastructure-Microservice
     @classmethod
-    @lru_cache(maxsize=32)
-    def get_server_stats(cls) -> List[Dict[str, Any]]:
-        if cls._should_use_cache("server_stats"):
-            logger.info("Using cached server stats data")
-            return cls._cached_data["server_stats"]
-
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                logger.info(f"Fetching server stats data (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(SERVER_STATS_ENDPOINT, timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-
-                data = response.json()
-                logger.info("Successfully connected to Infrastructure-Microservice server stats endpoint")
+    async def get_servers(cls) -> List[Dict[str, Any]]:
+        return await cls._cache.get(
+            "servers", lambda: cls._fetch(SERVERS_ENDPOINT, "server data", "Resource Allocation Service")
+        )
 
-                # Update cache
-                cls._cached_data["server_stats"] = data
-                cls._last_fetch_time["server_stats"] = time.time()
+    # Fetch lab-server allocations from the Infrastructure-Microservice
+    @classmethod
+    async def get_allocations(cls) -> List[Dict[str, Any]]:
+        return await cls._cache.get(
+            "allocations", lambda: cls._fetch(ALLOCATIONS_ENDPOINT, "allocation data", "Resource Allocation Service")
+        )
 
-                return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching server stats (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch server stats failed.")
-                    raise IntegrationError(f"Failed to connect to Performance Service: {str(e)}")
+    # Fetch server performance statistics from the Infrastructure-Microservice
+    @classmethod
+    async def get_server_stats(cls) -> List[Dict[str, Any]]:
+        return await cls._cache.get(
+            "server_stats", lambda: cls._fetch(SERVER_STATS_ENDPOINT, "server stats", "Performance Service")
+        )
 
     # Fetch peak access times for a specific server from the Infrastructure-Microservice
     @classmethod
-    @lru_cache(maxsize=32)
-    def get_server_peaks(cls, server_id: int) -> List[Dict[str, Any]]:
-        cache_key = f"server_peaks_{server_id}"
-
-        # Check if we should use cached data
-        if cache_key in cls._cached_data and cls._should_use_cache(cache_key):
-            logger.info(f"Using cached server peaks data for server {server_id}")
-            return cls._cached_data[cache_key]
-
-        for attempt in range(MAX_RETRIES + 1):
-            try:
-                logger.info(f"Fetching server peaks for server {server_id} (attempt {attempt + 1}/{MAX_RETRIES + 1})")
-                response = requests.get(f"{SERVER_PEAKS_ENDPOINT}/{server_id}/peaks", timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-
-                data = response.json()
-                logger.info(f"Successfully fetched server peaks for server {server_id}")
-
-                # Update cache
-                cls._cached_data[cache_key] = data
-                cls._last_fetch_time[cache_key] = time.time()
-
-                return data
-            except requests.RequestException as e:
-                logger.warning(f"Error fetching server peaks for server {server_id} (attempt {attempt + 1}): {e}")
-                if attempt < MAX_RETRIES:
-                    logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    logger.error(f"All {MAX_RETRIES + 1} attempts to fetch server peaks for server {server_id} failed.")
-                    raise IntegrationError(f"Failed to connect to Performance Service: {str(e)}")
+    async def get_server_peaks(cls, server_id: int) -> List[Dict[str, Any]]:
+        return await cls._cache.get(
+            ("server_peaks", server_id),
+            lambda: cls._fetch(
+                f"{SERVER_PEAKS_ENDPOINT}/{server_id}/peaks",
+                f"server peaks for server {server_id}",
+                "Performance Service",
+                endpoint=SERVER_PEAKS_ENDPOINT,
+            ),
+        )
 
     # Fetch lab performance metrics from our CC_Project's Performance Reporting Service
     @classmethod
-    def get_lab_performance(cls, lab_type: str) -> Dict[str, Any]:
-        cache_key = f"lab_performance_{lab_type}"
-        if cache_key in cls._cached_data and cls._should_use_cache(cache_key):
-            logger.info(f"Using cached lab performance data for {lab_type}")
-            return cls._cached_data[cache_key]
-
-        try:
-            logger.info(f"Fetching lab performance data for {lab_type}")
-            response = requests.get(f"{LAB_PERFORMANCE_ENDPOINT}/{lab_type}", timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-
-            data = response.json()
-            logger.info(f"Successfully fetched lab performance data for {lab_type}")
-
-            # Update cache
-            cls._cached_data[cache_key] = data
-            cls._last_fetch_time[cache_key] = time.time()
-
-            return data
-        except requests.RequestException as e:
-            logger.error(f"Error fetching lab performance for {lab_type}: {e}")
-            raise IntegrationError(f"Failed to connect to Performance Reporting Service: {str(e)}")
+    async def get_lab_performance(cls, lab_type: str) -> Dict[str, Any]:
+        return await cls._cache.get(
+            ("lab_performance", lab_type),
+            lambda: cls._fetch(
+                f"{LAB_PERFORMANCE_ENDPOINT}/{lab_type}",
+                f"lab performance data for {lab_type}",
+                "Performance Reporting Service",
+                retries=0,
+                endpoint=LAB_PERFORMANCE_ENDPOINT,
+            ),
+        )
 
     # Fetch user performance metrics from our CC_Project's Performance Reporting Service
     @classmethod
-    def get_user_performance(cls, user_id: str) -> Dict[str, Any]:
-        cache_key = f"user_performance_{user_id}"
-        if cache_key in cls._cached_data and cls._should_use_cache(cache_key):
-            logger.info(f"Using cached user performance data for {user_id}")
-            return cls._cached_data[cache_key]
-
-        try:
-            logger.info(f"Fetching user performance data for {user_id}")
-            response = requests.get(f"{USER_PERFORMANCE_ENDPOINT}/{user_id}", timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-
-            data = response.json()
-            logger.info(f"Successfully fetched user performance data for {user_id}")
-
-            # Update cache
-            cls._cached_data[cache_key] = data
-            cls._last_fetch_time[cache_key] = time.time()
-
-            return data
-        except requests.RequestException as e:
-            logger.error(f"Error fetching user performance for {user_id}: {e}")
-            raise IntegrationError(f"Failed to connect to Performance Reporting Service: {str(e)}")
+    async def get_user_performance(cls, user_id: str) -> Dict[str, Any]:
+        return await cls._cache.get(
+            ("user_performance", user_id),
+            lambda: cls._fetch(
+                f"{USER_PERFORMANCE_ENDPOINT}/{user_id}",
+                f"user performance data for {user_id}",
+                "Performance Reporting Service",
+                retries=0,
+                endpoint=USER_PERFORMANCE_ENDPOINT,
+            ),
+        )
 
-    # Map lab names from Infrastructure-Microservice to our lab types; development mapping, change in production
-    @staticmethod
-    def map_lab_name_to_type(lab_name: str) -> Optional[str]:
-        name_to_type = {
-            "Linux Basics": "linux-basics",
-            "Networking": "networking",
-            "Docker": "docker",
-            "Kubernetes": "kubernetes",
-            "Filesystem": "filesystem",
-            # Add more mappings as needed
+    # Fetch hourly peak concurrent sessions for a lab from our CC_Project's Usage Analytics Service
+    @classmethod
+    async def get_lab_concurrency(cls, lab_type: str) -> List[Dict[str, Any]]:
+        async def fetch() -> List[Dict[str, Any]]:
+            data = await cls._fetch(
+                LAB_CONCURRENCY_ENDPOINT,
+                f"lab concurrency data for {lab_type}",
+                "Usage Analytics Service",
+                params={"lab_type": lab_type, "granularity": "hour"},
+                retries=0,
+            )
+            return data.get("labs", {}).get(lab_type, [])
+
+        return await cls._cache.get(("lab_concurrency", lab_type), fetch)
+
+    # Fetch hourly peak concurrent sessions for several labs; more than one lab is fetched for all labs in one request
+    @classmethod
+    async def get_labs_concurrency(cls, lab_types: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        if len(lab_types) == 1:
+            return {lab_types[0]: await cls.get_lab_concurrency(lab_types[0])}
+
+        async def fetch() -> Dict[str, List[Dict[str, Any]]]:
+            data = await cls._fetch(
+                LAB_CONCURRENCY_ENDPOINT,
+                "lab concurrency data for all labs",
+                "Usage Analytics Service",
+                params={"granularity": "hour"},
+                retries=0,
+            )
+            return data.get("labs", {})
+
+        labs = await cls._cache.get(("lab_concurrency", "*"), fetch)
+        return {lab_type: labs.get(lab_type, []) for lab_type in lab_types}
+
+    # Loaders for one document build: lab performance and server peaks have no batch endpoint, so they are
+    # fetched per key with limited concurrency, while concurrency data for all labs comes in one request
+    @classmethod
+    def _create_loaders(cls) -> Dict[str, DataLoader]:
+        return {
+            "performance": DataLoader(load=cls.get_lab_performance, max_concurrency=LOADER_CONCURRENCY),
+            "peaks": DataLoader(load=cls.get_server_peaks, max_concurrency=LOADER_CONCURRENCY),
+            "concurrency": DataLoader(batch_load=cls.get_labs_concurrency),
         }
 
-        # Try direct mapping from name to type
-        for known_name, lab_type in name_to_type.items():
-            if known_name.lower() in lab_name.lower():
-                return lab_type
+    # Build a lab's entry from our performance data and its server's peaks and concurrency, fetched through the loaders.
+    # Returns None when the lab's performance data is unavailable.
+    @classmethod
+    async def _get_lab_metrics(
+        cls,
+        loaders: Dict[str, DataLoader],
+        lab_type: str,
+        lab_name: str,
+        server_id: int,
+        server_name: str,
+        server_usage: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        our_lab_performance, peaks, concurrency = await asyncio.gather(
+            loaders["performance"].load(lab_type),
+            loaders["peaks"].load(server_id),
+            loaders["concurrency"].load(lab_type),
+            return_exceptions=True,
+        )
+        for result in (our_lab_performance, peaks, concurrency):
+            if isinstance(result, Exception) and not isinstance(result, (IntegrationError, DeadlineExceeded)):
+                raise result
+
+        if isinstance(our_lab_performance, (IntegrationError, DeadlineExceeded)):
+            logger.warning(f"Could not get performance data for lab {lab_type}: {our_lab_performance}")
+            return None
+        if not our_lab_performance:
+            return None
+
+        lab_metrics = {
+            "name": lab_name,
+            "performance": {
+                "total_users": our_lab_performance.get("total_users", 0),
+                "avg_completion_time": our_lab_performance.get("avg_completion_time", 0),
+                "success_rate": our_lab_performance.get("success_rate", 0),
+                "common_errors": our_lab_performance.get("common_errors", []),
+            },
+            "infrastructure": {
+                "server_id": server_id,
+                "server_name": server_name,
+                "resource_allocation": {
+                    "cpu": server_usage.get("cpu", 0),
+                    "memory": server_usage.get("memory", 0),
+                    "disk": server_usage.get("disk", 0),
+                },
+            },
+        }
 
-        # If no mapping found, generate a generic one based on name
-        return lab_name.lower().replace(" ", "-")
+        # Add peak times for this server, if available
+        if isinstance(peaks, (IntegrationError, DeadlineExceeded)):
+            logger.warning(f"Could not get peak times for server {server_id}: {peaks}")
+        elif peaks:
+            lab_metrics["infrastructure"]["peak_times"] = peaks
+
+        # Add the lab's peak concurrent sessions over the last day, if available
+        if isinstance(concurrency, (IntegrationError, DeadlineExceeded)):
+            logger.warning(f"Could not get concurrency data for lab {lab_type}: {concurrency}")
+        else:
+            lab_metrics["infrastructure"]["peak_concurrent_sessions_24h"] = max(
+                (bucket.get("peak_concurrent_sessions", 0) for bucket in concurrency), default=0
+            )
+        return lab_metrics
 
     # Get enhanced performance metrics by combining data from both services
     @classmethod
-    def get_enhanced_performance_metrics(cls, lab_type: Optional[str] = None) -> Dict[str, Any]:
+    async def get_enhanced_performance_metrics(cls, lab_type: Optional[str] = None) -> Dict[str, Any]:
         try:
-            # Get data from Infrastructure-Microservice
-            servers = cls.get_servers()
-            allocations = cls.get_allocations()
-            server_stats = cls.get_server_stats()
+            # Get data from Infrastructure-Microservice concurrently
+            servers, allocations, server_stats = await asyncio.gather(
+                cls.get_servers(), cls.get_allocations(), cls.get_server_stats()
+            )
 
             # Build lookup dictionaries for easier access
             server_lookup = {server.get("id"): server for server in servers}
@@ -317,13 +361,14 @@ class ServerAllocationAdapter:
                         },
                     }
 
-            # Process allocations and add our performance data
+            # Process allocations, noting the first allocation of each lab for our performance data
+            first_allocations = {}
             for allocation in allocations:
                 lab_name = allocation.get("lab_name")
                 server_id = allocation.get("server_id")
 
                 if lab_name and server_id:
-                    lab_type_mapped = cls.map_lab_name_to_type(lab_name)
+                    lab_type_mapped = lab_type_registry.lab_type(lab_name)
 
                     # Skip if we're filtering by lab_type and this isn't it
                     if lab_type and lab_type_mapped != lab_type:
@@ -335,52 +380,28 @@ class ServerAllocationAdapter:
 
                     enhanced_metrics["infrastructure"]["allocation_map"][lab_type_mapped].append(server_id)
 
-                    # Get our performance data for this lab
-                    if (lab_type_mapped and lab_type_mapped not in enhanced_metrics["labs"]):
-                        try:
-                            our_lab_performance = cls.get_lab_performance(lab_type_mapped)
-
-                            if our_lab_performance:
-                                enhanced_metrics["labs"][lab_type_mapped] = {
-                                    "name": lab_name,
-                                    "performance": {
-                                        "total_users": our_lab_performance.get("total_users", 0),
-                                        "avg_completion_time": our_lab_performance.get("avg_completion_time", 0),
-                                        "success_rate": our_lab_performance.get("success_rate", 0),
-                                        "common_errors": our_lab_performance.get("common_errors", []),
-                                    },
-                                    "infrastructure": {
-                                        "server_id": server_id,
-                                        "server_name": server_lookup.get(server_id, {}).get("name", f"Server-{server_id}"),
-                                        "resource_allocation": {
-                                            "cpu": enhanced_metrics["infrastructure"]["servers"]
-                                            .get(server_id, {})
-                                            .get("usage", {})
-                                            .get("cpu", 0),
-                                            "memory": enhanced_metrics["infrastructure"]["servers"]
-                                            .get(server_id, {})
-                                            .get("usage", {})
-                                            .get("memory", 0),
-                                            "disk": enhanced_metrics["infrastructure"]["servers"]
-                                            .get(server_id, {})
-                                            .get("usage", {})
-                                            .get("disk", 0),
-                                        },
-                                    },
-                                }
-
-                                # Try to get peak times for this server
-                                try:
-                                    peaks = cls.get_server_peaks(server_id)
-                                    if peaks:
-                                        enhanced_metrics["labs"][lab_type_mapped]["infrastructure"]["peak_times"] = peaks
-                                except IntegrationError as e:
-                                    logger.warning(f"Could not get peak times for server {server_id}: {e}")
-                        except IntegrationError as e:
-                            logger.warning(f"Could not get performance data for lab {lab_type_mapped}: {e}")
+                    if lab_type_mapped and lab_type_mapped not in first_allocations:
+                        first_allocations[lab_type_mapped] = (lab_name, server_id)
+
+            # Get our performance data for all labs at once, sharing lookups of servers hosting several labs
+            loaders = cls._create_loaders()
+            lab_metrics = await asyncio.gather(*(
+                cls._get_lab_metrics(
+                    loaders,
+                    lab_type_mapped,
+                    lab_name,
+                    server_id,
+                    server_lookup.get(server_id, {}).get("name", f"Server-{server_id}"),
+                    enhanced_metrics["infrastructure"]["servers"].get(server_id, {}).get("usage", {}),
+                )
+                for lab_type_mapped, (lab_name, server_id) in first_allocations.items()
+            ))
+            for lab_type_mapped, metrics in zip(first_allocations, lab_metrics):
+                if metrics is not None:
+                    enhanced_metrics["labs"][lab_type_mapped] = metrics
 
             return enhanced_metrics
-        except IntegrationError as e:
+        except (IntegrationError, DeadlineExceeded):
             raise
         except Exception as e:
             logger.error(f"Unexpected error in get_enhanced_performance_metrics: {e}")
@@ -388,20 +409,26 @@ class ServerAllocationAdapter:
 
 
 # Example usage
-if __name__ == "__main__":
+async def main():
     adapter = ServerAllocationAdapter()
 
     try:
         print("Fetching server information...")
-        servers = adapter.get_servers()
+        servers = await adapter.get_servers()
         print(json.dumps(servers, indent=2))
 
         print("\nFetching allocation information...")
-        allocations = adapter.get_allocations()
+        allocations = await adapter.get_allocations()
         print(json.dumps(allocations, indent=2))
 
         print("\nFetching enhanced performance metrics...")
-        enhanced_metrics = adapter.get_enhanced_performance_metrics()
+        enhanced_metrics = await adapter.get_enhanced_performance_metrics()
         print(json.dumps(enhanced_metrics, indent=2))
     except IntegrationError as e:
         print(f"Integration failed: {e}")
+    finally:
+        await close_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
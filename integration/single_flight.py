@@ -0,0 +1,31 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+# Coalesces concurrent calls with the same key into one: the first caller issues the call and the
+# others await its result (or exception). The call runs to completion even if its callers are cancelled,
+# and in a fresh context, so the first caller's deadline does not cut it short for the others.
+class SingleFlight:
+    def __init__(self):
+        self.issued = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.issued += 1
+            future = asyncio.get_running_loop().create_task(call(), context=contextvars.Context())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, int]:
+        return {"issued": self.issued, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+
+# Upstream fetches of both adapters, keyed by URL and query parameters
+upstream_fetches = SingleFlight()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+import httpx
+from http_client import get_client
+
+logger = logging.getLogger("snapshots")
+
+# Events read per change feed poll; only the cursor is used, so a page just needs to show that events arrived
+CHANGE_FEED_PAGE_SIZE = 100
+
+
+# A built document, serialized once; never modified after it is built
+@dataclass(frozen=True)
+class Snapshot:
+    document: Dict[str, Any]
+    body: bytes
+    built_at: float  # time.time() when the build finished
+
+    @property
+    def age(self) -> float:
+        return max(0.0, time.time() - self.built_at)
+
+
+# Keeps a snapshot of a document rebuilt every interval seconds, or sooner when notified of a change
+# (but at most once per min_interval). Requests read the current snapshot without building anything;
+# a failed rebuild keeps the previous snapshot. So does a degraded one, as judged by is_degraded, unless
+# the previous snapshot is older than max_age.
+class SnapshotMaterializer:
+    def __init__(
+        self,
+        name: str,
+        build: Callable[[], Awaitable[Dict[str, Any]]],
+        interval: float,
+        min_interval: float,
+        is_degraded: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        max_age: float = float("inf"),
+    ):
+        self.name = name
+        self.build = build
+        self.interval = interval
+        self.min_interval = min_interval
+        self.is_degraded = is_degraded
+        self.max_age = max_age
+        self._snapshot: Optional[Snapshot] = None
+        self._rebuild: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    # Get the current snapshot, building one first if there is none or a fresh one is requested
+    async def get(self, fresh: bool = False) -> Snapshot:
+        if fresh or self._snapshot is None:
+            return await self.rebuild()
+        return self._snapshot
+
+    # Build a new snapshot and swap it in; concurrent callers share one build
+    async def rebuild(self) -> Snapshot:
+        if self._rebuild is None or self._rebuild.done():
+            self._rebuild = asyncio.create_task(self._build())
+        return await asyncio.shield(self._rebuild)
+
+    async def _build(self) -> Snapshot:
+        document = await self.build()
+        current = self._snapshot
+        if self.is_degraded is not None and self.is_degraded(document) and current is not None and current.age <= self.max_age:
+            logger.warning(f"Rebuilt {self.name} snapshot is degraded, keeping the one from {current.age:.0f} seconds ago")
+            return current
+        snapshot = Snapshot(document=document, body=json.dumps(document).encode(), built_at=time.time())
+        self._snapshot = snapshot
+        return snapshot
+
+    # Ask for a rebuild because the data behind the document changed
+    def notify_changed(self) -> None:
+        self._changed.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f"Error rebuilding the {self.name} snapshot: {e}")
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self.interval)
+                await asyncio.sleep(self.min_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+
+
+# Long-poll a Usage Analytics change feed from its current end, calling on_change whenever events arrive.
+# After events arrive the next poll waits min_interval seconds, so steady ingest costs one poll per interval.
+# Stops if the service has no change feed; connection failures are retried after retry_delay seconds.
+async def watch_change_feed(
+    base_url: str, on_change: Callable[[], None], retry_delay: float, min_interval: float, wait: int = 30
+) -> None:
+    cursor = None
+    while True:
+        try:
+            if cursor is None:
+                response = await get_client().get(f"{base_url}/analytics/events", params={"limit": 1}, timeout=10)
+            else:
+                response = await get_client().get(
+                    f"{base_url}/analytics/events/changes",
+                    params={"after_id": cursor, "limit": CHANGE_FEED_PAGE_SIZE, "wait": wait},
+                    timeout=wait + 10,
+                )
+            if response.status_code == 404:
+                logger.warning("Usage Analytics Service has no change feed; snapshots are rebuilt on schedule only")
+                return
+            response.raise_for_status()
+
+            if cursor is None:
+                events = response.json().get("events", [])
+                cursor = events[0]["id"] if events else 0
+                continue
+            next_cursor = int(response.headers.get("X-Next-Cursor", cursor))
+            if next_cursor != cursor:
+                cursor = next_cursor
+                on_change()
+                await asyncio.sleep(min_interval)
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            logger.warning(f"Error reading the usage change feed, retrying in {retry_delay} seconds: {e}")
+            await asyncio.sleep(retry_delay)
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from cache_backends import CacheBackend, CacheEntry
+from resilience import DeadlineExceeded, time_remaining
+
+logger = logging.getLogger("ttl_cache")
+
+# Seconds between checks for a value another worker is fetching
+LEASE_POLL_INTERVAL = 0.05
+
+
+# Cache of upstream responses with per-key TTLs, stored in a backend that may be shared between workers.
+# A fresh entry is served as-is. An expired successful entry is served immediately while one background
+# refresh per key replaces it; past its stale window it is fetched again before answering.
+# Failures are cached for failure_ttl, so a down upstream is not retried by every request; a failed
+# background refresh keeps serving the last good value for that long instead. A fetch cut short by the
+# request's deadline says nothing about the upstream, so it is never cached.
+# Fetches and refreshes take the key's lease first; a worker that cannot waits for the holder's result.
+class TTLCache:
+    def __init__(self, ttl: float, stale_ttl: float, failure_ttl: float, backend: CacheBackend):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.failure_ttl = failure_ttl
+        self.backend = backend
+        self._refreshes: Dict[Hashable, asyncio.Task] = {}
+
+    # Get the value for key, calling fetch when it is missing or too old; fetch raises on upstream failure
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self.backend.get(key)
+        if entry is not None:
+            now = time.time()
+            if now < entry.fresh_until:
+                return self._unwrap(entry)
+            if entry.error is None and now < entry.stale_until:
+                if key not in self._refreshes and self.backend.acquire_lease(key):
+                    # In a fresh context, so the refresh is not cut short by this request's deadline
+                    self._refreshes[key] = asyncio.create_task(self._refresh(key, fetch), context=contextvars.Context())
+                return entry.value
+
+        if not self.backend.acquire_lease(key):
+            entry = await self._wait_for_fetch(key)
+            if entry is not None:
+                return self._unwrap(entry)
+
+        try:
+            value = await fetch()
+            self.backend.set(key, self._success(value))
+            return value
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            now = time.time()
+            self.backend.set(key, CacheEntry(error=e, fresh_until=now + self.failure_ttl, fetched_at=now))
+            raise
+        finally:
+            self.backend.release_lease(key)
+
+    @staticmethod
+    def _unwrap(entry: CacheEntry) -> Any:
+        if entry.error is not None:
+            raise entry.error
+        return entry.value
+
+    def _success(self, value: Any) -> CacheEntry:
+        now = time.time()
+        return CacheEntry(value=value, fresh_until=now + self.ttl, stale_until=now + self.ttl + self.stale_ttl, fetched_at=now)
+
+    # Wait for the worker holding key's lease to store its result. Returns None, to fetch the key here,
+    # if its lease ends without one or the request's deadline passes first.
+    async def _wait_for_fetch(self, key: Hashable) -> Optional[CacheEntry]:
+        while True:
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+            entry = self.backend.get(key)
+            if entry is not None and time.time() < entry.fresh_until:
+                return entry
+            if self.backend.acquire_lease(key):
+                return None
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0:
+                return None
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            value = await fetch()
+            self.backend.set(key, self._success(value))
+        except DeadlineExceeded as e:
+            logger.warning(f"Background refresh of {key} ran out of time, serving the cached value: {e}")
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed, serving the cached value: {e}")
+            entry = self.backend.get(key)
+            if entry is not None and entry.error is None:
+                entry.fresh_until = time.time() + self.failure_ttl
+                self.backend.set(key, entry)
+        finally:
+            self._refreshes.pop(key, None)
+            self.backend.release_lease(key)
+
+    # Drop the entries whose key matches, or all entries, so the next get fetches them again
+    def invalidate(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        self.backend.delete(match)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import integration_api  # noqa: E402
+import lab_utilization_adapter  # noqa: E402
+import server_allocation_adapter  # noqa: E402
+from cache_backends import MemoryCacheBackend  # noqa: E402
+from lab_registry import LabTypeRegistry  # noqa: E402
+from lab_utilization_adapter import LabUtilizationAdapter  # noqa: E402
+from resilience import CircuitBreakers  # noqa: E402
+from server_allocation_adapter import IntegrationError as ServerIntegrationError, ServerAllocationAdapter  # noqa: E402
+from snapshots import SnapshotMaterializer  # noqa: E402
+from ttl_cache import TTLCache  # noqa: E402
+
+CATALOG = [
+    {"name": "Docker Fundamentals", "lab_type": "docker"},
+    {"name": "Linux Basics", "lab_type": "linux-basics"},
+]
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """Answer both adapters' upstream requests from upstreams.routes, a dict of URL path to JSON body (or status
+    code), recording each request's path and query params and the most requests in flight at once. Each request
+    first waits upstreams.delay seconds. Both adapters get empty caches, fresh circuit breakers and a lab type
+    registry of CATALOG, and retry without waiting."""
+    upstreams = SimpleNamespace(routes={}, requests=[], delay=0, in_flight=0, most_in_flight=0)
+
+    async def handler(request):
+        upstreams.requests.append((request.url.path, dict(request.url.params)))
+        upstreams.in_flight += 1
+        upstreams.most_in_flight = max(upstreams.most_in_flight, upstreams.in_flight)
+        try:
+            await asyncio.sleep(upstreams.delay)
+        finally:
+            upstreams.in_flight -= 1
+        route = upstreams.routes.get(request.url.path, 404)
+        if isinstance(route, int):
+            return httpx.Response(route)
+        return httpx.Response(200, json=route)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    registry = LabTypeRegistry({})
+    registry.rebuild(CATALOG)
+    for adapter_module, adapter in ((lab_utilization_adapter, LabUtilizationAdapter), (server_allocation_adapter, ServerAllocationAdapter)):
+        monkeypatch.setattr(adapter_module, "get_client", lambda: client)
+        monkeypatch.setattr(adapter_module, "circuit_breakers", CircuitBreakers(failure_threshold=5, reset_timeout=30))
+        monkeypatch.setattr(adapter_module, "RETRY_DELAY", 0)
+        monkeypatch.setattr(adapter_module, "lab_type_registry", registry)
+        monkeypatch.setattr(
+            adapter, "_cache", TTLCache(ttl=60, stale_ttl=60, failure_ttl=5, backend=MemoryCacheBackend(max_entries=100))
+        )
+    return upstreams
+
+
+class TestLabUtilizationAdapter:
+    """Tests for combining lab monitoring data with our usage analytics."""
+
+    def test_labs_usage_params_are_encoded(self, upstreams):
+        """Test lab types are sent as an encoded query parameter, so names with reserved characters arrive intact."""
+        upstreams.routes["/analytics/usage/labs"] = {"labs": {"c++ & go": {"total_events": 3}}}
+
+        labs = asyncio.run(LabUtilizationAdapter.get_labs_usage(["docker", "c++ & go"], days=7))
+
+        assert upstreams.requests == [("/analytics/usage/labs", {"lab_types": "c++ & go,docker", "days": "7"})]
+        assert labs["c++ & go"] == {"total_events": 3}
+        assert labs["docker"]["total_events"] == 0
+
+    def test_enhanced_analytics_fetches_concurrently(self, upstreams):
+        """Test popular labs, utilization and trends are fetched at once, then combined under our lab types."""
+        upstreams.delay = 0.05
+        upstreams.routes.update({
+            "/monitor/labs/popular": [{"name": "Docker Fundamentals", "total_sessions": 4, "total_user_minutes": 90}],
+            "/monitor/labs/over-under-utilized": [{"name": "Linux Basics", "status": "under", "avg_users": 1}],
+            "/analytics/trends": {"lab_usage": {"linux-basics": {"total_events": 5}}},
+            "/analytics/usage/labs": {"labs": {"docker": {"lab_type": "docker", "total_events": 2}}},
+        })
+
+        analytics = asyncio.run(LabUtilizationAdapter.get_enhanced_lab_analytics())
+
+        assert upstreams.most_in_flight == 3
+        assert [path for path, _ in upstreams.requests[3:]] == ["/analytics/usage/labs"]
+        assert analytics["integration_status"] == "success"
+        assert analytics["infrastructure_insights"]["popular_labs"] == [
+            {"lab_type": "docker", "name": "Docker Fundamentals", "sessions": 4, "user_minutes": 90}
+        ]
+        assert analytics["infrastructure_insights"]["utilization_status"]["linux-basics"]["status"] == "under"
+        assert analytics["lab_usage"]["linux-basics"] == {"total_events": 5}
+        assert analytics["lab_usage"]["docker"] == {"lab_type": "docker", "total_events": 2}
+
+    def test_failed_upstream_degrades(self, upstreams):
+        """Test a failed upstream leaves its part empty and marks the document partial instead of failing it."""
+        upstreams.routes.update({
+            "/monitor/labs/popular": 503,
+            "/monitor/labs/over-under-utilized": 503,
+            "/analytics/trends": {"lab_usage": {"linux-basics": {"total_events": 5}}},
+        })
+
+        analytics = asyncio.run(LabUtilizationAdapter.get_enhanced_lab_analytics())
+
+        assert analytics["integration_status"] == "partial"
+        assert analytics["infrastructure_insights"] == {"popular_labs": [], "utilization_status": {}}
+        assert analytics["lab_usage"]["linux-basics"] == {"total_events": 5}
+
+
+class TestLabScopedAnalytics:
+    """Tests for the analytics of a single lab type."""
+
+    ROUTES = {
+        "/monitor/labs/popular": [
+            {"name": "Docker Fundamentals", "total_sessions": 4},
+            {"name": "Linux Basics", "total_sessions": 9},
+        ],
+        "/monitor/labs/over-under-utilized": [
+            {"name": "Docker Fundamentals", "status": "over"},
+            {"name": "Linux Basics", "status": "under"},
+        ],
+        "/analytics/usage/labs": {"labs": {"docker": {"lab_type": "docker", "total_events": 2}}},
+    }
+
+    def test_fetches_only_that_lab(self, upstreams):
+        """Test only the lab's usage is fetched, not every lab's trends, and the other labs are filtered out."""
+        upstreams.routes.update(self.ROUTES)
+
+        analytics = asyncio.run(LabUtilizationAdapter.get_lab_analytics("docker"))
+
+        assert sorted(path for path, _ in upstreams.requests) == [
+            "/analytics/usage/labs", "/monitor/labs/over-under-utilized", "/monitor/labs/popular"
+        ]
+        assert ("/analytics/usage/labs", {"lab_types": "docker", "days": "7"}) in upstreams.requests
+        assert analytics["lab_usage"] == {"docker": {"lab_type": "docker", "total_events": 2}}
+        assert [lab["lab_type"] for lab in analytics["infrastructure_insights"]["popular_labs"]] == ["docker"]
+        assert list(analytics["infrastructure_insights"]["utilization_status"]) == ["docker"]
+
+    def test_endpoint_serves_recent_snapshot(self, upstreams, monkeypatch):
+        """Test the endpoint answers from a recent full snapshot without any upstream request."""
+        full = {
+            "lab_usage": {"docker": {"total_events": 2}, "linux-basics": {"total_events": 5}},
+            "infrastructure_insights": {
+                "popular_labs": [{"lab_type": "docker"}, {"lab_type": "linux-basics"}],
+                "utilization_status": {"docker": {"status": "over"}, "linux-basics": {"status": "under"}},
+            },
+            "integration_status": "success",
+        }
+
+        async def build():
+            return full
+
+        materializer = SnapshotMaterializer("test", build, interval=3600, min_interval=0)
+        monkeypatch.setattr(integration_api, "lab_utilization_snapshots", materializer)
+
+        async def run():
+            await materializer.rebuild()
+            return await integration_api.get_lab_utilization_by_type("docker")
+
+        response = asyncio.run(run())
+        assert upstreams.requests == []
+        assert "X-Snapshot-Age" in response.headers
+        document = json.loads(response.body)
+        assert document["lab_usage"] == {"docker": {"total_events": 2}}
+        assert document["infrastructure_insights"]["utilization_status"] == {"docker": {"status": "over"}}
+
+    def test_endpoint_without_snapshot_fetches_lab(self, upstreams, monkeypatch):
+        """Test the endpoint fetches just the lab's data when there is no recent snapshot."""
+        upstreams.routes.update(self.ROUTES)
+        monkeypatch.setattr(
+            integration_api, "lab_utilization_snapshots", SnapshotMaterializer("test", None, interval=3600, min_interval=0)
+        )
+
+        response = asyncio.run(integration_api.get_lab_utilization_by_type("docker"))
+
+        assert response.headers["X-Snapshot-Age"] == "0.0"
+        assert json.loads(response.body)["lab_usage"] == {"docker": {"lab_type": "docker", "total_events": 2}}
+        assert "/analytics/trends" not in [path for path, _ in upstreams.requests]
+
+class TestServerAllocationAdapter:
+    """Tests for combining server allocation data with our performance and usage data."""
+
+    def test_enhanced_metrics_fetches_concurrently(self, upstreams):
+        """Test servers, allocations and stats are fetched at once, then each lab's data is added."""
+        upstreams.delay = 0.05
+        upstreams.routes.update({
+            "/servers": [{"id": 1, "name": "alpha", "cpu_usage": 40}],
+            "/allocations": [{"lab_name": "Docker Fundamentals", "server_id": 1}],
+            "/performance/servers/stats": [],
+            "/performance/servers/1/peaks": [{"hour": 14}],
+            "/performance/lab/docker": {"total_users": 3, "success_rate": 0.5},
+            "/analytics/concurrency": {"labs": {"docker": [{"peak_concurrent_sessions": 2}, {"peak_concurrent_sessions": 4}]}},
+        })
+
+        metrics = asyncio.run(ServerAllocationAdapter.get_enhanced_performance_metrics())
+
+        assert upstreams.most_in_flight == 3
+        assert sorted(path for path, _ in upstreams.requests[:3]) == ["/allocations", "/performance/servers/stats", "/servers"]
+        assert metrics["infrastructure"]["allocation_map"] == {"docker": [1]}
+        lab = metrics["labs"]["docker"]
+        assert lab["performance"]["total_users"] == 3
+        assert lab["infrastructure"]["server_name"] == "alpha"
+        assert lab["infrastructure"]["peak_times"] == [{"hour": 14}]
+        assert lab["infrastructure"]["peak_concurrent_sessions_24h"] == 4
+
+    def test_failed_core_fetch_raises(self, upstreams):
+        """Test the document fails when the servers cannot be fetched."""
+        upstreams.routes.update({"/allocations": [], "/performance/servers/stats": []})
+        with pytest.raises(ServerIntegrationError):
+            asyncio.run(ServerAllocationAdapter.get_enhanced_performance_metrics())
@@ -0,0 +1,395 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import ttl_cache  # noqa: E402
+from cache_backends import MemoryCacheBackend, SQLiteCacheBackend  # noqa: E402
+from data_loader import DataLoader  # noqa: E402
+from resilience import DeadlineExceeded, deadline, time_remaining  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+from ttl_cache import TTLCache  # noqa: E402
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class Upstream:
+    """A fetch that counts its calls, returning its current value or raising while failing."""
+
+    def __init__(self, value="v1"):
+        self.value = value
+        self.failing = False
+        self.calls = 0
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.failing:
+            raise UpstreamError("upstream down")
+        return self.value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time the cache sees; advance it by setting clock.now."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ttl_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def cache():
+    return TTLCache(ttl=10, stale_ttl=20, failure_ttl=5, backend=MemoryCacheBackend(max_entries=100))
+
+
+async def _settle(cache):
+    """Let the cache's background refreshes finish."""
+    await asyncio.gather(*list(cache._refreshes.values()))
+
+
+class TestTTLCache:
+    """Tests for the TTL cache in front of upstream fetches."""
+
+    def test_miss_then_hit(self, cache, clock):
+        """Test a miss fetches, and a fresh entry is served without fetching."""
+        upstream = Upstream()
+
+        async def run():
+            assert await cache.get("key", upstream.fetch) == "v1"
+            clock.now += 9
+            assert await cache.get("key", upstream.fetch) == "v1"
+
+        asyncio.run(run())
+        assert upstream.calls == 1
+
+    def test_keys_are_separate(self, cache, clock):
+        """Test each key has its own entry."""
+        first, second = Upstream("a"), Upstream("b")
+
+        async def run():
+            assert await cache.get(("labs", 7), first.fetch) == "a"
+            assert await cache.get(("labs", 30), second.fetch) == "b"
+
+        asyncio.run(run())
+        assert (first.calls, second.calls) == (1, 1)
+
+    def test_stale_while_revalidate(self, cache, clock):
+        """Test an expired entry is served at once while one background refresh replaces it."""
+        upstream = Upstream()
+
+        async def run():
+            await cache.get("key", upstream.fetch)
+            upstream.value = "v2"
+            clock.now += 15
+            assert await cache.get("key", upstream.fetch) == "v1"
+            assert await cache.get("key", upstream.fetch) == "v1"
+            await _settle(cache)
+            assert await cache.get("key", upstream.fetch) == "v2"
+
+        asyncio.run(run())
+        assert upstream.calls == 2
+
+    def test_refresh_outlives_request_deadline(self, cache, clock):
+        """Test a background refresh does not inherit the deadline of the request that started it."""
+        upstream = Upstream()
+        deadlines = []
+
+        async def fetch():
+            deadlines.append(time_remaining())
+            return await upstream.fetch()
+
+        async def run():
+            await cache.get("key", fetch)
+            clock.now += 15
+            with deadline(5):
+                assert await cache.get("key", fetch) == "v1"
+            await _settle(cache)
+
+        asyncio.run(run())
+        assert deadlines == [None, None]
+
+    def test_past_stale_window_fetches(self, cache, clock):
+        """Test an entry past its stale window is fetched again before answering."""
+        upstream = Upstream()
+
+        async def run():
+            await cache.get("key", upstream.fetch)
+            upstream.value = "v2"
+            clock.now += 31
+            assert await cache.get("key", upstream.fetch) == "v2"
+
+        asyncio.run(run())
+        assert upstream.calls == 2
+        assert not cache._refreshes
+
+    def test_failure_is_cached(self, cache, clock):
+        """Test a failure is raised again without fetching until failure_ttl passes."""
+        upstream = Upstream()
+        upstream.failing = True
+
+        async def run():
+            for _ in range(3):
+                with pytest.raises(UpstreamError):
+                    await cache.get("key", upstream.fetch)
+            assert upstream.calls == 1
+
+            upstream.failing = False
+            clock.now += 6
+            assert await cache.get("key", upstream.fetch) == "v1"
+
+        asyncio.run(run())
+        assert upstream.calls == 2
+
+    def test_failed_refresh_keeps_value(self, cache, clock):
+        """Test a failed background refresh keeps serving the last good value for failure_ttl."""
+        upstream = Upstream()
+
+        async def run():
+            await cache.get("key", upstream.fetch)
+            upstream.failing = True
+            clock.now += 15
+            assert await cache.get("key", upstream.fetch) == "v1"
+            await _settle(cache)
+            assert upstream.calls == 2
+
+            # Fresh again for failure_ttl, then refreshed once more
+            clock.now += 4
+            assert await cache.get("key", upstream.fetch) == "v1"
+            assert upstream.calls == 2
+            upstream.failing = False
+            clock.now += 2
+            assert await cache.get("key", upstream.fetch) == "v1"
+            await _settle(cache)
+            assert await cache.get("key", upstream.fetch) == "v1"
+
+        asyncio.run(run())
+        assert upstream.calls == 3
+
+    def test_deadline_is_not_cached(self, cache, clock):
+        """Test a fetch cut short by the request's deadline is raised without being cached."""
+        upstream = Upstream()
+
+        async def out_of_time():
+            raise DeadlineExceeded("Request deadline exceeded")
+
+        async def run():
+            with pytest.raises(DeadlineExceeded):
+                await cache.get("key", out_of_time)
+            assert await cache.get("key", upstream.fetch) == "v1"
+
+        asyncio.run(run())
+        assert upstream.calls == 1
+
+    def test_invalidate(self, cache, clock):
+        """Test invalidated entries are fetched again, and others are kept."""
+        upstream = Upstream()
+
+        async def run():
+            await cache.get(("usage_analytics", 7), upstream.fetch)
+            await cache.get(("lab_monitoring", "popular"), upstream.fetch)
+            cache.invalidate(lambda key: key[0] == "usage_analytics")
+            await cache.get(("usage_analytics", 7), upstream.fetch)
+            await cache.get(("lab_monitoring", "popular"), upstream.fetch)
+
+        asyncio.run(run())
+        assert upstream.calls == 3
+
+    def test_memory_backend_evicts_least_recently_used(self, clock):
+        """Test the memory backend keeps at most max_entries, dropping the least recently used."""
+        cache = TTLCache(ttl=10, stale_ttl=20, failure_ttl=5, backend=MemoryCacheBackend(max_entries=2))
+        upstream = Upstream()
+
+        async def run():
+            await cache.get("a", upstream.fetch)
+            await cache.get("b", upstream.fetch)
+            await cache.get("a", upstream.fetch)
+            await cache.get("c", upstream.fetch)
+
+        asyncio.run(run())
+        assert [key for key, _ in cache.backend.items()] == ["a", "c"]
+
+
+class TestSharedCache:
+    """Tests for caches of several workers sharing a SQLite backend."""
+
+    @staticmethod
+    def _worker_cache(path, owner):
+        backend = SQLiteCacheBackend(str(path), "lab_utilization", max_entries=100, lease_duration=30, error_type=UpstreamError)
+        backend.owner = owner
+        return TTLCache(ttl=10, stale_ttl=20, failure_ttl=5, backend=backend)
+
+    def test_worker_waits_for_lease_holder(self, tmp_path):
+        """Test a worker that cannot take a key's lease serves the holder's result instead of fetching."""
+        first = self._worker_cache(tmp_path / "cache.db", "worker-1")
+        second = self._worker_cache(tmp_path / "cache.db", "worker-2")
+        upstream = Upstream({"labs": ["docker"]})
+
+        async def run():
+            release = asyncio.Event()
+
+            async def slow_fetch():
+                await release.wait()
+                return await upstream.fetch()
+
+            fetching = asyncio.ensure_future(first.get(("labs", 7), slow_fetch))
+            await asyncio.sleep(0)
+            waiting = asyncio.ensure_future(second.get(("labs", 7), upstream.fetch))
+            await asyncio.sleep(0.1)
+            release.set()
+            return await fetching, await waiting
+
+        assert asyncio.run(run()) == ({"labs": ["docker"]}, {"labs": ["docker"]})
+        assert upstream.calls == 1
+
+    def test_cached_failure_is_shared(self, tmp_path):
+        """Test a failure cached by one worker is raised by another as the backend's error type."""
+        first = self._worker_cache(tmp_path / "cache.db", "worker-1")
+        second = self._worker_cache(tmp_path / "cache.db", "worker-2")
+        upstream = Upstream()
+        upstream.failing = True
+
+        async def run():
+            with pytest.raises(UpstreamError):
+                await first.get("key", upstream.fetch)
+            with pytest.raises(UpstreamError, match="upstream down"):
+                await second.get("key", upstream.fetch)
+
+        asyncio.run(run())
+        assert upstream.calls == 1
+
+
+class TestSingleFlight:
+    """Tests for coalescing concurrent identical upstream calls."""
+
+    def test_concurrent_calls_coalesce(self):
+        """Test concurrent calls with one key share a single call and its result."""
+        flights = SingleFlight()
+        upstream = Upstream()
+
+        async def run():
+            return await asyncio.gather(*(flights.do("key", upstream.fetch) for _ in range(5)))
+
+        assert asyncio.run(run()) == ["v1"] * 5
+        assert upstream.calls == 1
+        assert flights.stats() == {"issued": 1, "coalesced": 4, "in_flight": 0}
+
+    def test_exception_is_shared(self):
+        """Test every coalesced caller gets the call's exception, and the next call is issued again."""
+        flights = SingleFlight()
+        upstream = Upstream()
+        upstream.failing = True
+
+        async def run():
+            results = await asyncio.gather(*(flights.do("key", upstream.fetch) for _ in range(3)), return_exceptions=True)
+            assert all(isinstance(result, UpstreamError) for result in results)
+            upstream.failing = False
+            assert await flights.do("key", upstream.fetch) == "v1"
+
+        asyncio.run(run())
+        assert upstream.calls == 2
+
+    def test_cancelled_caller_does_not_cancel_call(self):
+        """Test the call runs to completion for the other callers when one is cancelled."""
+        flights = SingleFlight()
+        release = None
+
+        async def call():
+            await release.wait()
+            return "done"
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            first = asyncio.ensure_future(flights.do("key", call))
+            second = asyncio.ensure_future(flights.do("key", call))
+            await asyncio.sleep(0)
+            first.cancel()
+            release.set()
+            return await second
+
+        assert asyncio.run(run()) == "done"
+
+
+    def test_call_does_not_inherit_caller_deadline(self):
+        """Test the shared call runs without the deadline of the caller that issued it."""
+        flights = SingleFlight()
+        deadlines = []
+
+        async def call():
+            deadlines.append(time_remaining())
+            return "done"
+
+        async def run():
+            with deadline(5):
+                return await flights.do("key", call)
+
+        assert asyncio.run(run()) == "done"
+        assert deadlines == [None]
+
+class TestDataLoader:
+    """Tests for batching and deduplicating the lookups of one document build."""
+
+    def test_batch_load(self):
+        """Test keys requested together are loaded in one batch, once each."""
+        batches = []
+
+        async def batch_load(keys):
+            batches.append(sorted(keys))
+            return {key: key.upper() for key in keys if key != "missing"}
+
+        async def run():
+            loader = DataLoader(batch_load=batch_load)
+            results = await asyncio.gather(*(loader.load(key) for key in ["docker", "linux", "docker", "missing"]))
+            assert results == ["DOCKER", "LINUX", "DOCKER", None]
+            # Already loaded keys are not loaded again
+            assert await loader.load("linux") == "LINUX"
+
+        asyncio.run(run())
+        assert batches == [["docker", "linux", "missing"]]
+
+    def test_batch_failure(self):
+        """Test a failed batch fails every key in it."""
+
+        async def batch_load(keys):
+            raise UpstreamError("upstream down")
+
+        async def run():
+            loader = DataLoader(batch_load=batch_load)
+            return await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+
+        assert all(isinstance(result, UpstreamError) for result in asyncio.run(run()))
+
+    def test_load_per_key_concurrency(self):
+        """Test per-key loads run at most max_concurrency at a time, and a failure only fails its key."""
+        running = 0
+        most_running = 0
+
+        async def load(key):
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if key == 3:
+                raise UpstreamError("upstream down")
+            return key * 2
+
+        async def run():
+            loader = DataLoader(load=load, max_concurrency=2)
+            return await asyncio.gather(*(loader.load(key) for key in range(6)), return_exceptions=True)
+
+        results = asyncio.run(run())
+        assert results[:3] == [0, 2, 4] and results[4:] == [8, 10]
+        assert isinstance(results[3], UpstreamError)
+        assert most_running == 2
+
+    def test_requires_one_loader(self):
+        """Test exactly one of batch_load and load must be given."""
+        with pytest.raises(ValueError):
+            DataLoader()
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import cache_persistence  # noqa: E402
+import ttl_cache  # noqa: E402
+from cache_backends import MemoryCacheBackend  # noqa: E402
+from cache_persistence import load_caches, save_caches  # noqa: E402
+from ttl_cache import TTLCache  # noqa: E402
+
+
+class UpstreamError(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time the cache and its persistence see; advance it by setting clock.now."""
+    clock = SimpleNamespace(now=1000.0)
+    fake_time = SimpleNamespace(time=lambda: clock.now)
+    monkeypatch.setattr(ttl_cache, "time", fake_time)
+    monkeypatch.setattr(cache_persistence, "time", fake_time)
+    return clock
+
+
+def _cache():
+    return TTLCache(ttl=10, stale_ttl=20, failure_ttl=5, backend=MemoryCacheBackend(max_entries=100))
+
+
+def _fill(cache, key, value):
+    async def fetch():
+        return value
+
+    return asyncio.run(cache.get(key, fetch))
+
+
+class TestCachePersistence:
+    """Tests for saving the adapters' caches across restarts."""
+
+    def test_round_trip(self, tmp_path, clock):
+        """Test saved entries load back under their keys, fresh while within their TTL."""
+        path = str(tmp_path / "caches.json")
+        cache = _cache()
+        _fill(cache, "popular_labs", [{"name": "Linux Basics"}])
+        _fill(cache, ("usage_analytics", 7), {"lab_usage": {}})
+
+        assert save_caches(path, {"lab_utilization": cache}) == 2
+        assert os.listdir(tmp_path) == ["caches.json"]
+
+        restored = _cache()
+        assert load_caches(path, {"lab_utilization": restored}, max_age=3600) == 2
+
+        async def unexpected_fetch():
+            raise AssertionError("fresh entries are not fetched")
+
+        async def run():
+            assert await restored.get("popular_labs", unexpected_fetch) == [{"name": "Linux Basics"}]
+            assert await restored.get(("usage_analytics", 7), unexpected_fetch) == {"lab_usage": {}}
+
+        asyncio.run(run())
+
+    def test_failures_are_not_saved(self, tmp_path, clock):
+        """Test cached upstream failures are left out of the saved file."""
+        path = str(tmp_path / "caches.json")
+        cache = _cache()
+
+        async def failing_fetch():
+            raise UpstreamError("upstream down")
+
+        with pytest.raises(UpstreamError):
+            asyncio.run(cache.get("popular_labs", failing_fetch))
+        assert save_caches(path, {"lab_utilization": cache}) == 0
+
+    def test_old_entries_are_discarded(self, tmp_path, clock):
+        """Test entries fetched more than max_age ago are not loaded, and younger stale ones are served stale."""
+        path = str(tmp_path / "caches.json")
+        cache = _cache()
+        _fill(cache, "old", "v-old")
+        clock.now += 100
+        _fill(cache, "recent", "v-recent")
+        save_caches(path, {"lab_utilization": cache})
+
+        clock.now += 50
+        restored = _cache()
+        assert load_caches(path, {"lab_utilization": restored}, max_age=120) == 1
+        assert restored.backend.get("old") is None
+        entry = restored.backend.get("recent")
+        assert entry.fresh_until < clock.now < entry.stale_until
+
+    def test_unknown_cache_and_unreadable_file(self, tmp_path, clock):
+        """Test entries of caches that no longer exist are skipped, and a missing or corrupt file loads nothing."""
+        path = tmp_path / "caches.json"
+        path.write_text(json.dumps([{"cache": "gone", "key": "k", "value": 1, "fetched_at": clock.now}]))
+        assert load_caches(str(path), {"lab_utilization": _cache()}, max_age=3600) == 0
+
+        path.write_text("{not json")
+        assert load_caches(str(path), {"lab_utilization": _cache()}, max_age=3600) == 0
+        assert load_caches(str(tmp_path / "missing.json"), {"lab_utilization": _cache()}, max_age=3600) == 0
+
+    def test_failed_save_keeps_previous_file(self, tmp_path, clock):
+        """Test a save that cannot serialize its entries leaves the previous file and no temporary file."""
+        path = str(tmp_path / "caches.json")
+        cache = _cache()
+        _fill(cache, "popular_labs", ["v1"])
+        save_caches(path, {"lab_utilization": cache})
+
+        _fill(cache, "unserializable", {1, 2})
+        with pytest.raises(TypeError):
+            save_caches(path, {"lab_utilization": cache})
+        assert os.listdir(tmp_path) == ["caches.json"]
+        with open(path) as f:
+            assert [record["key"] for record in json.load(f)] == ["popular_labs"]
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import lab_registry  # noqa: E402
+from lab_registry import AhoCorasick, LabTypeRegistry, normalize_lab_name  # noqa: E402
+
+CATALOG = [
+    {"name": "Linux Basics", "lab_type": "linux-basics"},
+    {"name": "Docker Fundamentals", "lab_type": "docker-fundamentals"},
+    {"name": "Advanced Docker Networking", "lab_type": "docker-networking"},
+]
+
+
+@pytest.fixture
+def catalog_server(monkeypatch):
+    """Serve a lab catalog of the given labs from get_client, recording the paging params of each request."""
+    requests = []
+
+    def serve(labs, fail=False):
+        def handler(request):
+            requests.append(dict(request.url.params))
+            if fail:
+                return httpx.Response(503)
+            skip, limit = int(request.url.params["skip"]), int(request.url.params["limit"])
+            return httpx.Response(200, json=labs[skip:skip + limit])
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(lab_registry, "get_client", lambda: client)
+        return requests
+
+    return serve
+
+
+class TestNormalizeLabName:
+    """Tests for the lab name normalization both indexes are keyed on."""
+
+    def test_normalize_lab_name(self):
+        """Test case, hyphens, underscores and runs of whitespace are normalized away."""
+        assert normalize_lab_name("Linux Basics") == "linux basics"
+        assert normalize_lab_name("linux-basics") == "linux basics"
+        assert normalize_lab_name("  LINUX__basics \t") == "linux basics"
+
+
+class TestAhoCorasick:
+    """Tests for the automaton that finds catalog names inside upstream lab names."""
+
+    def test_find_all(self):
+        """Test every occurrence of every pattern is found, including overlapping ones."""
+        automaton = AhoCorasick({"he": 1, "she": 2, "hers": 3, "his": 4})
+        assert sorted(automaton.find_all("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 3)]
+
+    def test_no_patterns(self):
+        """Test an automaton without patterns finds nothing, and empty patterns are ignored."""
+        assert list(AhoCorasick({}).find_all("docker")) == []
+        assert list(AhoCorasick({"": 1}).find_all("docker")) == []
+
+
+class TestLabTypeRegistry:
+    """Tests for mapping upstream lab names to our lab types."""
+
+    def test_exact_match(self):
+        """Test catalog names and lab types map exactly, whatever their case or separators."""
+        registry = LabTypeRegistry({})
+        registry.rebuild(CATALOG)
+        assert registry.lab_type("Linux Basics") == "linux-basics"
+        assert registry.lab_type("linux_basics") == "linux-basics"
+        assert registry.lab_type("DOCKER FUNDAMENTALS") == "docker-fundamentals"
+
+    def test_override_wins(self):
+        """Test overrides win over catalog names."""
+        registry = LabTypeRegistry({"Linux Basics": "linux"})
+        registry.rebuild(CATALOG)
+        assert registry.lab_type("Linux Basics") == "linux"
+
+    def test_longest_whole_word_match(self):
+        """Test the longest catalog name occurring as whole words is used."""
+        registry = LabTypeRegistry({"Docker": "docker"})
+        registry.rebuild(CATALOG)
+        assert registry.lab_type("Intro to Docker Fundamentals (v2)") == "docker-fundamentals"
+        assert registry.lab_type("Advanced Docker Networking Workshop") == "docker-networking"
+        assert registry.lab_type("Docker Compose") == "docker"
+        # "docker" occurs, but not as a whole word
+        assert registry.lab_type("Dockerfiles") == "dockerfiles"
+
+    def test_slug_fallback(self):
+        """Test unknown names are slugified, and missing names map to None."""
+        registry = LabTypeRegistry({})
+        registry.rebuild(CATALOG)
+        assert registry.lab_type("Rust Ownership") == "rust-ownership"
+        assert registry.lab_type(None) is None
+        assert registry.lab_type("") is None
+
+    def test_rebuild_reports_changes(self):
+        """Test rebuild reports whether the mapping changed."""
+        registry = LabTypeRegistry({})
+        assert registry.rebuild(CATALOG) is True
+        assert registry.rebuild(list(CATALOG)) is False
+        assert registry.rebuild(CATALOG + [{"name": "Kubernetes", "lab_type": "kubernetes"}]) is True
+        assert registry.catalog_size == 4
+
+    def test_refresh_pages_through_catalog(self, catalog_server, monkeypatch):
+        """Test refresh fetches every page of the catalog and loads all of it."""
+        monkeypatch.setattr(lab_registry, "CATALOG_PAGE_SIZE", 2)
+        requests = catalog_server(CATALOG + [{"name": "Kubernetes", "lab_type": "kubernetes"}])
+        registry = LabTypeRegistry({})
+
+        assert asyncio.run(registry.refresh()) is True
+        assert [r["skip"] for r in requests] == ["0", "2", "4"]
+        assert registry.catalog_size == 4
+        assert registry.lab_type("Kubernetes") == "kubernetes"
+
+        # An unchanged catalog is not a change
+        assert asyncio.run(registry.refresh()) is False
+
+    def test_refresh_failure_keeps_indexes(self, catalog_server):
+        """Test a failed refresh keeps the current mapping."""
+        registry = LabTypeRegistry({})
+        registry.rebuild(CATALOG)
+        catalog_server(CATALOG, fail=True)
+
+        assert asyncio.run(registry.refresh()) is False
+        assert registry.catalog_size == 3
+        assert registry.lab_type("Docker Fundamentals") == "docker-fundamentals"
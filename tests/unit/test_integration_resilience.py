@@ -0,0 +1,264 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import integration_api  # noqa: E402
+import lab_utilization_adapter  # noqa: E402
+import resilience  # noqa: E402
+from cache_backends import MemoryCacheBackend  # noqa: E402
+from lab_utilization_adapter import IntegrationError, LabUtilizationAdapter  # noqa: E402
+from resilience import (  # noqa: E402
+    CircuitBreaker,
+    CircuitBreakers,
+    CircuitOpenError,
+    DeadlineExceeded,
+    backoff_delay,
+    deadline,
+    time_remaining,
+    within_deadline,
+)
+from ttl_cache import TTLCache  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the monotonic time the breakers see; advance it by setting clock.now."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Answer the adapter's upstream requests with the given statuses in turn, counting the requests;
+    fresh circuit breakers, and retries without waiting."""
+    upstream = SimpleNamespace(statuses=[], calls=0)
+
+    def handler(request):
+        upstream.calls += 1
+        status = upstream.statuses.pop(0) if upstream.statuses else 200
+        return httpx.Response(status, json={"ok": True})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(lab_utilization_adapter, "get_client", lambda: client)
+    monkeypatch.setattr(lab_utilization_adapter, "circuit_breakers", CircuitBreakers(failure_threshold=3, reset_timeout=30))
+    monkeypatch.setattr(lab_utilization_adapter, "RETRY_DELAY", 0)
+    return upstream
+
+
+class TestCircuitBreaker:
+    """Tests for the circuit breaker of an upstream endpoint."""
+
+    def test_opens_after_consecutive_failures(self, clock):
+        """Test the circuit opens after failure_threshold consecutive failures, and a success resets the count."""
+        breaker = CircuitBreaker("popular", failure_threshold=3, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        breaker.check()
+
+        breaker.record_failure()
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+    def test_half_open_allows_one_trial(self, clock):
+        """Test after reset_timeout one trial request goes through while others still fail at once."""
+        breaker = CircuitBreaker("popular", failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+
+        clock.now += 29
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        clock.now += 1
+        breaker.check()
+        assert breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+    def test_trial_success_closes(self, clock):
+        """Test a successful trial closes the circuit."""
+        breaker = CircuitBreaker("popular", failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        clock.now += 30
+        breaker.check()
+        breaker.record_success()
+        assert breaker.state == "closed"
+        assert breaker.failures == 0
+        breaker.check()
+        breaker.check()
+
+    def test_trial_failure_reopens(self, clock):
+        """Test a failed trial opens the circuit again for another reset_timeout."""
+        breaker = CircuitBreaker("popular", failure_threshold=5, reset_timeout=30)
+        for _ in range(5):
+            breaker.record_failure()
+        clock.now += 30
+        breaker.check()
+        breaker.record_failure()
+        assert breaker.state == "open"
+        clock.now += 29
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+    def test_lost_trial_does_not_block_forever(self, clock):
+        """Test a trial that never reports back lets another trial through after reset_timeout."""
+        breaker = CircuitBreaker("popular", failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        clock.now += 30
+        breaker.check()
+        clock.now += 30
+        breaker.check()
+        assert breaker.state == "half_open"
+
+    def test_breakers_per_endpoint(self):
+        """Test each endpoint gets its own breaker, and states reports them all."""
+        breakers = CircuitBreakers(failure_threshold=1, reset_timeout=30)
+        assert breakers.get("popular") is breakers.get("popular")
+        breakers.get("popular").record_failure()
+        breakers.get("utilization").record_success()
+        assert breakers.states() == {
+            "popular": {"state": "open", "failures": 1},
+            "utilization": {"state": "closed", "failures": 0},
+        }
+
+
+class TestBackoff:
+    """Tests for the delay between retries."""
+
+    def test_backoff_delay_bounds(self, monkeypatch):
+        """Test the delay is jittered up to an exponential bound, capped."""
+        monkeypatch.setattr(resilience.random, "uniform", lambda low, high: (low, high))
+        assert [backoff_delay(attempt, 1, 8) for attempt in range(5)] == [(0, 1), (0, 2), (0, 4), (0, 8), (0, 8)]
+
+    def test_backoff_delay_is_random(self):
+        """Test delays fall within the bound and are spread out."""
+        delays = [backoff_delay(3, 0.5, 8) for _ in range(100)]
+        assert all(0 <= delay <= 4 for delay in delays)
+        assert len(set(delays)) > 1
+
+
+class TestDeadline:
+    """Tests for bounding the upstream calls of a request by its deadline."""
+
+    def test_no_deadline(self):
+        """Test there is no time limit outside a deadline block."""
+        assert time_remaining() is None
+        assert asyncio.run(within_deadline(asyncio.sleep(0, result="done"))) == "done"
+
+    def test_nested_deadline_keeps_sooner(self):
+        """Test a nested deadline cannot extend one already in effect, and each ends with its block."""
+        with deadline(1):
+            with deadline(60):
+                assert time_remaining() <= 1
+            with deadline(0.5):
+                assert time_remaining() <= 0.5
+            assert 0.5 < time_remaining() <= 1
+        assert time_remaining() is None
+
+    def test_within_deadline_expires(self):
+        """Test awaiting past the deadline raises DeadlineExceeded."""
+
+        async def run():
+            with deadline(0.05):
+                await within_deadline(asyncio.sleep(1))
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(run())
+
+    def test_deadline_reaches_started_tasks(self):
+        """Test tasks started inside a deadline block are bounded by it."""
+
+        async def run():
+            with deadline(0.05):
+                task = asyncio.ensure_future(within_deadline(asyncio.sleep(1)))
+            await task
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(run())
+
+    def test_request_deadline_middleware(self, monkeypatch):
+        """Test the middleware bounds what a request does by REQUEST_DEADLINE, and only that request."""
+        monkeypatch.setattr(integration_api, "REQUEST_DEADLINE", 0.05)
+        seen = []
+
+        async def call_next(request):
+            seen.append(time_remaining())
+            return await within_deadline(asyncio.sleep(1))
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(integration_api.apply_request_deadline(None, call_next))
+        assert 0 < seen[0] <= 0.05
+        assert time_remaining() is None
+
+
+class TestUpstreamRequests:
+    """Tests for the retries, circuit breaking and deadlines of the adapters' upstream requests."""
+
+    def test_retries_server_errors(self, upstream):
+        """Test a server error is retried, and a success after it is returned."""
+        upstream.statuses = [503, 200]
+        assert asyncio.run(LabUtilizationAdapter._request("http://upstream/popular", "popular labs", "popular", 2)) == {"ok": True}
+        assert upstream.calls == 2
+
+    def test_client_errors_are_not_retried(self, upstream):
+        """Test a rejected request fails at once, without counting against the circuit."""
+        upstream.statuses = [404]
+        with pytest.raises(IntegrationError):
+            asyncio.run(LabUtilizationAdapter._request("http://upstream/popular", "popular labs", "popular", 2))
+        assert upstream.calls == 1
+        assert lab_utilization_adapter.circuit_breakers.get("popular").state == "closed"
+
+    def test_open_circuit_fails_fast(self, upstream):
+        """Test failures open the endpoint's circuit, after which requests fail without reaching the upstream."""
+        upstream.statuses = [503] * 3
+        with pytest.raises(IntegrationError):
+            asyncio.run(LabUtilizationAdapter._request("http://upstream/popular", "popular labs", "popular", 2))
+        assert upstream.calls == 3
+        assert lab_utilization_adapter.circuit_breakers.get("popular").state == "open"
+
+        with pytest.raises(IntegrationError, match="Circuit open"):
+            asyncio.run(LabUtilizationAdapter._request("http://upstream/popular", "popular labs", "popular", 2))
+        assert upstream.calls == 3
+
+        # Other endpoints are unaffected
+        asyncio.run(LabUtilizationAdapter._request("http://upstream/utilization", "utilization", "utilization", 2))
+        assert upstream.calls == 4
+
+    def test_no_retry_past_deadline(self, upstream, monkeypatch):
+        """Test a retry that would start past the deadline is not made."""
+        monkeypatch.setattr(lab_utilization_adapter, "RETRY_DELAY", 10)
+        monkeypatch.setattr(lab_utilization_adapter, "backoff_delay", lambda attempt, base, cap: base)
+        upstream.statuses = [503]
+
+        async def run():
+            with deadline(1):
+                await LabUtilizationAdapter._request("http://upstream/popular", "popular labs", "popular", 2)
+
+        with pytest.raises(IntegrationError):
+            asyncio.run(run())
+        assert upstream.calls == 1
+
+    def test_spent_deadline_is_not_cached(self, upstream, monkeypatch):
+        """Test a request whose deadline is spent gets empty data, and the next request still reaches the upstream."""
+        cache = TTLCache(ttl=10, stale_ttl=20, failure_ttl=30, backend=MemoryCacheBackend(max_entries=100))
+        monkeypatch.setattr(LabUtilizationAdapter, "_cache", cache)
+        upstream.statuses = [200]
+
+        async def run():
+            with deadline(0):
+                assert await LabUtilizationAdapter.get_popular_labs() == []
+            assert upstream.calls == 0
+            return await LabUtilizationAdapter.get_popular_labs()
+
+        assert asyncio.run(run()) == {"ok": True}
+        assert upstream.calls == 1
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "integration"))
+
+import integration_api  # noqa: E402
+import snapshots  # noqa: E402
+from snapshots import SnapshotMaterializer, watch_change_feed  # noqa: E402
+
+
+class Builder:
+    """A document build that counts its calls, returning numbered documents, degraded ones while degraded."""
+
+    def __init__(self):
+        self.calls = 0
+        self.degraded = False
+        self.failing = False
+
+    async def build(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.failing:
+            raise RuntimeError("build failed")
+        return {"build": self.calls, "integration_status": "partial" if self.degraded else "success"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time snapshots see; advance it by setting clock.now."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(snapshots, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def _materializer(builder, max_age=float("inf")):
+    return SnapshotMaterializer(
+        "test",
+        builder.build,
+        interval=3600,
+        min_interval=0,
+        is_degraded=lambda document: document["integration_status"] != "success",
+        max_age=max_age,
+    )
+
+
+class TestSnapshotMaterializer:
+    """Tests for the snapshots the enhanced analytics endpoints are served from."""
+
+    def test_get_builds_once(self, clock):
+        """Test the first get builds a snapshot, and later gets serve it without building."""
+        builder = Builder()
+        materializer = _materializer(builder)
+
+        async def run():
+            first = await materializer.get()
+            assert await materializer.get() is first
+            return first
+
+        snapshot = asyncio.run(run())
+        assert builder.calls == 1
+        assert json.loads(snapshot.body) == snapshot.document == {"build": 1, "integration_status": "success"}
+
+    def test_rebuild_on_change(self, clock):
+        """Test a change notification rebuilds the snapshot well before the scheduled interval."""
+        builder = Builder()
+        materializer = _materializer(builder)
+
+        async def run():
+            task = asyncio.create_task(materializer.run())
+            try:
+                while materializer.snapshot is None:
+                    await asyncio.sleep(0)
+                materializer.notify_changed()
+                while materializer.snapshot.document["build"] < 2:
+                    await asyncio.sleep(0.01)
+            finally:
+                task.cancel()
+
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+        assert builder.calls == 2
+
+    def test_degraded_rebuild_keeps_snapshot(self, clock):
+        """Test a degraded rebuild keeps the previous snapshot until it is older than max_age."""
+        builder = Builder()
+        materializer = _materializer(builder, max_age=60)
+
+        async def run():
+            previous = await materializer.rebuild()
+            builder.degraded = True
+            clock.now += 30
+            assert await materializer.rebuild() is previous
+            clock.now += 31
+            return await materializer.rebuild()
+
+        snapshot = asyncio.run(run())
+        assert builder.calls == 3
+        assert snapshot.document == {"build": 3, "integration_status": "partial"}
+
+    def test_failed_rebuild_keeps_snapshot(self, clock):
+        """Test a failed rebuild raises, leaving the previous snapshot in place."""
+        builder = Builder()
+        materializer = _materializer(builder)
+
+        async def run():
+            previous = await materializer.rebuild()
+            builder.failing = True
+            with pytest.raises(RuntimeError):
+                await materializer.rebuild()
+            assert materializer.snapshot is previous
+
+        asyncio.run(run())
+
+    def test_concurrent_rebuilds_share_one_build(self, clock):
+        """Test concurrent rebuilds wait for a single build."""
+        builder = Builder()
+        materializer = _materializer(builder)
+
+        async def run():
+            return await asyncio.gather(*(materializer.rebuild() for _ in range(3)))
+
+        first, second, third = asyncio.run(run())
+        assert first is second is third
+        assert builder.calls == 1
+
+
+class TestChangeFeed:
+    """Tests for watching the Usage Analytics change feed."""
+
+    def test_advancing_cursor_signals_change(self, monkeypatch):
+        """Test the watcher starts from the newest event and signals each time the cursor advances."""
+        cursors = iter(["7", "7", "9"])
+        requests = []
+
+        def handler(request):
+            requests.append((request.url.path, dict(request.url.params)))
+            if request.url.path == "/analytics/events":
+                return httpx.Response(200, json={"events": [{"id": 7}]})
+            return httpx.Response(200, json={"events": []}, headers={"X-Next-Cursor": next(cursors)})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(snapshots, "get_client", lambda: client)
+        changes = []
+
+        async def run():
+            task = asyncio.create_task(watch_change_feed("http://usage", lambda: changes.append(True), 0, 0))
+            try:
+                while not changes:
+                    await asyncio.sleep(0)
+            finally:
+                task.cancel()
+
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+        assert changes == [True]
+        assert requests[0] == ("/analytics/events", {"limit": "1"})
+        assert [params["after_id"] for _, params in requests[1:]] == ["7", "7", "7"]
+
+    def test_missing_change_feed_stops(self, monkeypatch):
+        """Test the watcher stops when the service has no change feed."""
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(404)))
+        monkeypatch.setattr(snapshots, "get_client", lambda: client)
+        asyncio.run(asyncio.wait_for(watch_change_feed("http://usage", lambda: None, 0, 0), timeout=5))
+
+
+class TestSnapshotEndpoints:
+    """Tests for serving the snapshots from the enhanced analytics endpoints."""
+
+    @pytest.fixture
+    def served(self, monkeypatch, clock):
+        """Serve lab utilization from a test materializer, recording cache invalidations."""
+        builder = Builder()
+        invalidations = []
+        monkeypatch.setattr(integration_api, "lab_utilization_snapshots", _materializer(builder))
+        monkeypatch.setattr(integration_api.LabUtilizationAdapter, "invalidate_cache", lambda: invalidations.append(True))
+        return SimpleNamespace(builder=builder, invalidations=invalidations)
+
+    def test_snapshot_age_header(self, served, clock):
+        """Test the snapshot is served as built, with its age in X-Snapshot-Age."""
+
+        async def run():
+            await integration_api.get_lab_utilization()
+            clock.now += 12.34
+            return await integration_api.get_lab_utilization()
+
+        response = asyncio.run(run())
+        assert response.headers["X-Snapshot-Age"] == "12.3"
+        assert json.loads(response.body) == {"build": 1, "integration_status": "success"}
+        assert served.builder.calls == 1
+
+    def test_fresh_rebuilds_from_upstream(self, served, clock):
+        """Test fresh=true drops the cached upstream data and serves a new snapshot."""
+
+        async def run():
+            await integration_api.get_lab_utilization()
+            clock.now += 30
+            return await integration_api.get_lab_utilization(fresh=True)
+
+        response = asyncio.run(run())
+        assert response.headers["X-Snapshot-Age"] == "0.0"
+        assert json.loads(response.body)["build"] == 2
+        assert served.invalidations == [True]
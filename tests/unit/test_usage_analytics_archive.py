@@ -0,0 +1,68 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pyarrow")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "usage-analytics-service"))
+
+from app.utils import archive  # noqa: E402
+
+DAY = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def _events(first_id, count, day, lab_type="linux-basics"):
+    return [
+        {
+            "id": first_id + i,
+            "event_id": None,
+            "user_id": f"user-{i % 3}",
+            "lab_type": lab_type,
+            "event_type": "error" if i % 2 else "start",
+            "event_data": {"n": first_id + i, "tag": "odd" if i % 2 else "even"},
+            "timestamp": day + timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def archived_days(tmp_path):
+    """Archive two days of events, as archive_events writes them, and return the files."""
+    return [
+        archive.write_events(str(tmp_path), "usage_events_2024-03-01", _events(1, 50, DAY)),
+        archive.write_events(str(tmp_path), "usage_events_2024-03-02", _events(51, 50, DAY + timedelta(days=1))),
+    ]
+
+
+class TestUsageEventArchive:
+    """Tests for reading archived usage events back the way the event search does."""
+
+    def test_newest_event_ids_across_files(self, archived_days):
+        """Test the newest ids are found across files, highest first, and limited."""
+        assert archive.newest_event_ids(archived_days, 5) == [100, 99, 98, 97, 96]
+        assert archive.newest_event_ids(archived_days, 3, before_id=52) == [51, 50, 49]
+
+    def test_newest_event_ids_filters(self, archived_days):
+        """Test the filters are applied before the limit."""
+        assert archive.newest_event_ids(archived_days, 3, event_type="error") == [100, 98, 96]
+        assert archive.newest_event_ids(archived_days, 3, end=DAY + timedelta(days=1)) == [50, 49, 48]
+        assert archive.newest_event_ids(archived_days, 3, lab_type="docker") == []
+        assert archive.newest_event_ids(archived_days, 2, contains={"tag": "odd"}) == [100, 98]
+        assert archive.newest_event_ids(archived_days, 2, contains={"n": 7}) == [7]
+
+    def test_read_events_by_id(self, archived_days):
+        """Test a page of ids reads back the full archived events."""
+        ids = archive.newest_event_ids(archived_days, 2, contains={"tag": "even"})
+        events = sorted(archive.read_events(archived_days, ids=ids), key=lambda e: e["id"], reverse=True)
+
+        assert [e["id"] for e in events] == [99, 97]
+        assert events[0]["event_data"] == {"n": 99, "tag": "even"}
+        assert events[0]["lab_type"] == "linux-basics"
+        assert events[0]["timestamp"] == DAY + timedelta(days=1, minutes=48)
+
+    def test_read_events_columns(self, archived_days):
+        """Test only the requested columns are read."""
+        events = archive.read_events(archived_days, ids=[1], columns=["id", "user_id"])
+        assert events == [{"id": 1, "user_id": "user-0"}]
@@ -1,11 +1,17 @@
 import pytest
 import httpx
+import json
 import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
 
 # Service URLs
 USER_PROGRESS_URL = os.getenv("USER_PROGRESS_URL", "http://localhost:8004")
 USAGE_ANALYTICS_URL = os.getenv("USAGE_ANALYTICS_URL", "http://localhost:8006")
+USAGE_ANALYTICS_DEFERRED_URL = os.getenv("USAGE_ANALYTICS_DEFERRED_URL", "http://localhost:8008")
 
 class TestUsageAnalyticsService:
     """Tests for the Usage Analytics Service endpoints."""
@@ -131,6 +137,492 @@ class TestUsageAnalyticsService:
         assert "unique_users" in lab_usage
         assert "errors" in lab_usage
     
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_usage_trends_multi(self, created_test_user, created_test_lab, http_client):
+        """Test that a multi-window trend report matches the single-window reports."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "error",
+            "event_data": {"error": "permission denied"}
+        }
+        http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/trends/multi", params={"windows": "1,7,30"})
+        assert response.status_code == HTTPStatus.OK, f"Failed to get trends: {response.text}"
+        windows = response.json()["windows"]
+        assert set(windows) == {"1", "7", "30"}
+        lab_usage = windows["1"]["lab_usage"][created_test_lab["lab_type"]]
+        assert lab_usage["errors"] >= 1
+        assert windows["1"]["total_events"] <= windows["7"]["total_events"] <= windows["30"]["total_events"]
+
+        for days in (1, 7):
+            single = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/trends", params={"days": days})
+            assert single.json()["lab_usage"][created_test_lab["lab_type"]] == windows[str(days)]["lab_usage"][created_test_lab["lab_type"]]
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/trends/multi", params={"windows": "7,x"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_unique_users_estimate_matches_exact(self, created_test_user, created_test_lab, http_client):
+        """Test that the sketch-based unique user count agrees with the exact count."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-hll"}
+        }
+        for _ in range(3):
+            http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        lab_url = f"{USAGE_ANALYTICS_URL}/analytics/usage/lab/{created_test_lab['lab_type']}"
+        estimated = http_client.get(lab_url)
+        exact = http_client.get(lab_url, params={"exact": "true"})
+        assert estimated.status_code == HTTPStatus.OK, f"Failed to get lab usage: {estimated.text}"
+        assert exact.status_code == HTTPStatus.OK, f"Failed to get exact lab usage: {exact.text}"
+        assert estimated.json()["unique_users"] == 1
+        assert exact.json()["unique_users"] == 1
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_sessions_match_on_session_id(self, created_test_user, created_test_lab, http_client):
+        """Test that interleaved sessions are paired by session id rather than by position."""
+        for event_type, session_id in [("start", "s1"), ("start", "s2"), ("complete", "s2"), ("complete", "s1")]:
+            event_data = {
+                "user_id": created_test_user["id"],
+                "lab_type": created_test_lab["lab_type"],
+                "event_type": event_type,
+                "event_data": {"session_id": session_id}
+            }
+            response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+            assert response.status_code == HTTPStatus.OK, f"Failed to record event: {response.text}"
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/usage/lab/{created_test_lab['lab_type']}")
+        assert response.status_code == HTTPStatus.OK, f"Failed to get lab usage: {response.text}"
+
+        usage = response.json()
+        assert usage["total_sessions"] == 2
+        assert usage["completed_sessions"] == 2
+        assert usage["average_session_time_seconds"] > 0
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_live_occupancy(self, created_test_user, created_test_lab, http_client):
+        """Test that live occupancy follows session starts and completions."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-live"}
+        }
+        http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/live")
+        assert response.status_code == HTTPStatus.OK, f"Failed to get live occupancy: {response.text}"
+        assert response.json()["active_sessions"].get(created_test_lab["lab_type"]) == 1
+
+        event_data["event_type"] = "complete"
+        http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        live = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/live").json()
+        assert created_test_lab["lab_type"] not in live["active_sessions"]
+        assert live["total_active"] == sum(live["active_sessions"].values())
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_concurrency(self, created_test_user, created_test_lab, http_client):
+        """Test getting peak concurrent sessions for a lab."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-concurrency"}
+        }
+        http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        response = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/concurrency",
+            params={"lab_type": created_test_lab["lab_type"], "granularity": "hour"}
+        )
+        assert response.status_code == HTTPStatus.OK, f"Failed to get concurrency: {response.text}"
+
+        report = response.json()
+        assert report["granularity"] == "hour"
+        buckets = report["labs"][created_test_lab["lab_type"]]
+        assert buckets[-1]["peak_concurrent_sessions"] == 1
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/concurrency", params={"granularity": "fortnight"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_funnel_and_retention(self, created_test_user, created_test_lab, http_client):
+        """Test getting the daily funnel and retention cohorts for a lab."""
+        for event_type in ["start", "error", "complete"]:
+            event_data = {
+                "user_id": created_test_user["id"],
+                "lab_type": created_test_lab["lab_type"],
+                "event_type": event_type,
+                "event_data": {"session_id": "test-session-funnel"}
+            }
+            http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        params = {"lab_type": created_test_lab["lab_type"], "days": 1}
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/funnel", params=params)
+        assert response.status_code == HTTPStatus.OK, f"Failed to get funnel: {response.text}"
+
+        today = response.json()["funnel"][created_test_lab["lab_type"]][-1]
+        assert today["started"] == 1
+        assert today["errored"] == 1
+        assert today["completed"] == 1
+        assert today["completed_after_error"] == 1
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/retention", params=params)
+        assert response.status_code == HTTPStatus.OK, f"Failed to get retention: {response.text}"
+
+        cohorts = response.json()["cohorts"]
+        assert len(cohorts) == 1
+        assert cohorts[0]["users"] == 1
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_search_events(self, created_test_user, created_test_lab, http_client):
+        """Test finding events by event_data attributes with keyset pagination."""
+        for command in ["ls", "cd", "ls"]:
+            event_data = {
+                "user_id": created_test_user["id"],
+                "lab_type": created_test_lab["lab_type"],
+                "event_type": "command",
+                "event_data": {"session_id": "test-session-search", "command": command}
+            }
+            http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        params = {
+            "lab_type": created_test_lab["lab_type"],
+            "contains": '{"command": "ls"}',
+            "limit": 1
+        }
+        first = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/events", params=params)
+        assert first.status_code == HTTPStatus.OK, f"Failed to search events: {first.text}"
+        first_page = first.json()
+        assert len(first_page["events"]) == 1
+        assert first_page["next_cursor"] is not None
+
+        second = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/events",
+            params={**params, "cursor": first_page["next_cursor"]}
+        )
+        second_page = second.json()
+        assert len(second_page["events"]) == 1
+        assert second_page["events"][0]["id"] < first_page["events"][0]["id"]
+        assert second_page["events"][0]["event_data"]["command"] == "ls"
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/events", params={"contains": "not-json"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_event_change_feed(self, created_test_user, created_test_lab, http_client):
+        """Test replaying events after a cursor and long-polling for new ones."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-feed"}
+        }
+        first = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data).json()
+
+        response = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/events/changes",
+            params={"after_id": first["id"] - 1, "wait": 0}
+        )
+        assert response.status_code == HTTPStatus.OK, f"Failed to read changes: {response.text}"
+        assert response.headers["content-type"] == "application/x-ndjson"
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert events[0]["id"] == first["id"]
+        assert [e["id"] for e in events] == sorted(e["id"] for e in events)
+        cursor = int(response.headers["x-next-cursor"])
+        assert cursor == events[-1]["id"]
+
+        # A caught-up consumer is answered as soon as the next event is recorded
+        threading.Timer(
+            0.5, httpx.post, args=(f"{USAGE_ANALYTICS_URL}/analytics/event",), kwargs={"json": event_data}
+        ).start()
+        response = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/events/changes",
+            params={"after_id": cursor, "wait": 4}
+        )
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert events, "Long-poll returned without the new event"
+        assert events[0]["id"] > cursor
+        assert events[0]["event_data"]["session_id"] == "test-session-feed"
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_record_event_idempotent(self, created_test_user, created_test_lab, http_client):
+        """Test that retrying an event with the same event_id records it once."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-retry"},
+            "event_id": str(uuid.uuid4())
+        }
+        first = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+        assert first.status_code == HTTPStatus.OK, f"Failed to record event: {first.text}"
+        retry = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+        assert retry.status_code == HTTPStatus.OK
+        assert retry.json()["id"] == first.json()["id"]
+        assert retry.json()["event_id"] == event_data["event_id"]
+
+        response = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/events",
+            params={"lab_type": created_test_lab["lab_type"], "contains": '{"session_id": "test-session-retry"}'}
+        )
+        assert len(response.json()["events"]) == 1
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_usage_heatmap(self, created_test_user, created_test_lab, http_client):
+        """Test the hour-of-week usage heatmap, all-time and bounded by day."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "command",
+            "event_data": {"command": "ls"}
+        }
+        event = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data).json()
+        recorded_at = datetime.fromisoformat(event["timestamp"].replace("Z", "+00:00")).astimezone(timezone.utc)
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/heatmap/{created_test_lab['lab_type']}")
+        assert response.status_code == HTTPStatus.OK, f"Failed to get heatmap: {response.text}"
+        heatmap = response.json()["heatmap"]
+        assert len(heatmap) == 7 and all(len(row) == 24 for row in heatmap)
+        assert heatmap[recorded_at.weekday()][recorded_at.hour] >= 1
+
+        day = recorded_at.date().isoformat()
+        bounded = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/heatmap/{created_test_lab['lab_type']}",
+            params={"from": day, "to": day}
+        ).json()
+        assert bounded["heatmap"][recorded_at.weekday()][recorded_at.hour] >= 1
+        assert bounded["total_events"] <= response.json()["total_events"]
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_top_users(self, created_test_user, created_test_lab, http_client):
+        """Test that the top users estimate agrees with the exact ranking."""
+        event_data = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "command",
+            "event_data": {"command": "pwd"}
+        }
+        for _ in range(3):
+            http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event_data)
+
+        url = f"{USAGE_ANALYTICS_URL}/analytics/top-users/{created_test_lab['lab_type']}"
+        response = http_client.get(url, params={"days": 7, "k": 5})
+        assert response.status_code == HTTPStatus.OK, f"Failed to get top users: {response.text}"
+        estimate = response.json()["top_users"]
+        exact = http_client.get(url, params={"days": 7, "k": 5, "exact": "true"}).json()["top_users"]
+
+        assert estimate[0]["user_id"] == created_test_user["id"]
+        assert estimate[0]["events"] >= 3
+        assert [u["user_id"] for u in estimate] == [u["user_id"] for u in exact]
+        for estimated, counted in zip(estimate, exact):
+            assert estimated["events"] - estimated["max_overcount"] <= counted["events"] <= estimated["events"]
+
+        response = http_client.get(url, params={"k": 0})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_archive_events(self, http_client):
+        """Test archiving validates its cutoff and leaves recent events in place."""
+        response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/archive", params={"before": "2000-01-01"})
+        if response.status_code == HTTPStatus.SERVICE_UNAVAILABLE:
+            pytest.skip("Archiving requires pyarrow in the service environment")
+        assert response.status_code == HTTPStatus.OK, f"Failed to archive events: {response.text}"
+        assert response.json()["total_events"] == 0
+
+        response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/archive", params={"before": "2999-01-01"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        # Days inside the longest report window stay in PostgreSQL
+        yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).date().isoformat()
+        response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/archive", params={"before": yesterday})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/trends", params={"days": 367})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_labs_usage(self, created_test_user, created_test_lab, http_client):
+        """Test getting usage analytics for several lab types in one call."""
+        event = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "start",
+            "event_data": {"session_id": "test-session-batch"}
+        }
+        http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event)
+
+        lab_types = f"{created_test_lab['lab_type']},no-such-lab-type"
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/usage/labs", params={"lab_types": lab_types})
+        assert response.status_code == HTTPStatus.OK, f"Failed to get labs usage: {response.text}"
+
+        labs = response.json()["labs"]
+        assert list(labs) == [created_test_lab["lab_type"]]
+        single = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/usage/lab/{created_test_lab['lab_type']}").json()
+        assert labs[created_test_lab["lab_type"]] == single
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_update_event_sessions(self, created_test_user, created_test_lab, http_client):
+        """Test editing and deleting events rebuilds the lab sessions they belong to."""
+        lab_type = created_test_lab["lab_type"]
+        usage_url = f"{USAGE_ANALYTICS_URL}/analytics/usage/lab/{lab_type}"
+
+        def record(event_type):
+            event = {
+                "user_id": created_test_user["id"],
+                "lab_type": lab_type,
+                "event_type": event_type,
+                "event_data": {"session_id": "test-session-edit"}
+            }
+            response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event)
+            assert response.status_code == HTTPStatus.OK, f"Failed to record event: {response.text}"
+            return event, response.json()["id"]
+
+        def active_sessions():
+            return http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/live").json()["active_sessions"].get(lab_type, 0)
+
+        start, start_id = record("start")
+        complete, complete_id = record("complete")
+        usage = http_client.get(usage_url).json()
+        assert (usage["total_sessions"], usage["completed_sessions"]) == (1, 1)
+        assert active_sessions() == 0
+
+        # The complete event no longer ends the session, which is open again
+        response = http_client.put(f"{USAGE_ANALYTICS_URL}/analytics/event/{complete_id}", json={**complete, "event_type": "error"})
+        assert response.status_code == HTTPStatus.OK, f"Failed to update event: {response.text}"
+        usage = http_client.get(usage_url).json()
+        assert (usage["total_sessions"], usage["completed_sessions"]) == (1, 0)
+        assert usage["average_session_time_seconds"] == 0
+        assert active_sessions() == 1
+
+        # Changing it back closes the session at the complete event again
+        http_client.put(f"{USAGE_ANALYTICS_URL}/analytics/event/{complete_id}", json=complete)
+        usage = http_client.get(usage_url).json()
+        assert (usage["total_sessions"], usage["completed_sessions"]) == (1, 1)
+        assert usage["average_session_time_seconds"] > 0
+        assert active_sessions() == 0
+
+        # Without its start event there is no session
+        http_client.delete(f"{USAGE_ANALYTICS_URL}/analytics/event/{start_id}")
+        usage = http_client.get(usage_url).json()
+        assert usage["total_sessions"] == 0
+        assert active_sessions() == 0
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_deferred_validation(self, created_test_user, created_test_lab, http_client):
+        """Test events recorded in deferred mode are quarantined or counted once validated."""
+        try:
+            http_client.get(f"{USAGE_ANALYTICS_DEFERRED_URL}/docs")
+        except httpx.HTTPError:
+            pytest.skip("No Usage Analytics instance running with VALIDATION_MODE=deferred")
+
+        lab_type = created_test_lab["lab_type"]
+        unknown_user = f"no-such-user-{uuid.uuid4()}"
+        event_ids = {}
+        for user_id in [created_test_user["id"], unknown_user, unknown_user, unknown_user]:
+            event = {"user_id": user_id, "lab_type": lab_type, "event_type": "error", "event_data": {}}
+            response = http_client.post(f"{USAGE_ANALYTICS_DEFERRED_URL}/analytics/event", json=event)
+            assert response.status_code == HTTPStatus.OK, f"Failed to record event: {response.text}"
+            event_ids.setdefault(user_id, []).append(response.json()["id"])
+
+        # Events with an unknown user are quarantined; the others stay
+        deadline = time.monotonic() + 30
+        while http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{event_ids[unknown_user][-1]}").status_code == HTTPStatus.OK:
+            assert time.monotonic() < deadline, "Events were not validated in time"
+            time.sleep(0.5)
+        for event_id in event_ids[unknown_user]:
+            response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{event_id}")
+            assert response.status_code == HTTPStatus.NOT_FOUND
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{event_ids[created_test_user['id']][0]}")
+        assert response.status_code == HTTPStatus.OK
+
+        # Only the validated event is counted
+        usage = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/usage/lab/{lab_type}").json()
+        assert usage["total_events"] == 1
+        assert usage["unique_users"] == 1
+
+        url = f"{USAGE_ANALYTICS_URL}/analytics/top-users/{lab_type}"
+        top_users = http_client.get(url).json()["top_users"]
+        while not top_users:  # Counted by whichever instance validated it, once that instance flushes
+            assert time.monotonic() < deadline + 15, "Top users were not updated in time"
+            time.sleep(0.5)
+            top_users = http_client.get(url).json()["top_users"]
+        assert [u["user_id"] for u in top_users] == [created_test_user["id"]]
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_large_payload(self, created_test_user, created_test_lab, http_client):
+        """Test a payload over the compression threshold round-trips through the payload side table."""
+        session_id = f"test-session-{uuid.uuid4()}"
+        event_data = {"session_id": session_id, "exit_code": 2, "transcript": "$ make test\n" * 2000}
+        event = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "error",
+            "event_data": event_data
+        }
+        response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event)
+        assert response.status_code == HTTPStatus.OK, f"Failed to record event: {response.text}"
+        created = response.json()
+        if created["payload_size"] is None:
+            pytest.skip("Payload compression is disabled; set PAYLOAD_COMPRESSION_THRESHOLD in the service environment")
+
+        # Only the short fields stay inline
+        assert created["payload_size"] == len(json.dumps(event_data, separators=(",", ":")))
+        assert created["event_data"] == {"session_id": session_id, "exit_code": 2}
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{created['id']}")
+        assert response.status_code == HTTPStatus.OK, f"Failed to get event: {response.text}"
+        assert response.json()["event_data"] == event_data
+
+        # Searches on the inline fields still find it
+        response = http_client.get(
+            f"{USAGE_ANALYTICS_URL}/analytics/events",
+            params={"contains": json.dumps({"session_id": session_id})}
+        )
+        assert [e["id"] for e in response.json()["events"]] == [created["id"]]
+
+        # Updating replaces the stored payload
+        updated_data = {**event_data, "transcript": "$ make lint\n" * 2000}
+        response = http_client.put(
+            f"{USAGE_ANALYTICS_URL}/analytics/event/{created['id']}", json={**event, "event_data": updated_data}
+        )
+        assert response.status_code == HTTPStatus.OK, f"Failed to update event: {response.text}"
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{created['id']}")
+        assert response.json()["event_data"] == updated_data
+
+        response = http_client.delete(f"{USAGE_ANALYTICS_URL}/analytics/event/{created['id']}")
+        assert response.status_code == HTTPStatus.OK, f"Failed to delete event: {response.text}"
+
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_get_event(self, created_test_user, created_test_lab, http_client):
+        """Test reading a single event with its full payload."""
+        transcript = "$ ls -la\n" * 1000
+        event = {
+            "user_id": created_test_user["id"],
+            "lab_type": created_test_lab["lab_type"],
+            "event_type": "error",
+            "event_data": {"session_id": "test-session-large", "transcript": transcript}
+        }
+        create_response = http_client.post(f"{USAGE_ANALYTICS_URL}/analytics/event", json=event)
+        assert create_response.status_code == HTTPStatus.OK, f"Failed to create event: {create_response.text}"
+        event_id = create_response.json()["id"]
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/{event_id}")
+        assert response.status_code == HTTPStatus.OK, f"Failed to get event: {response.text}"
+        fetched = response.json()
+        assert fetched["id"] == event_id
+        assert fetched["event_data"]["session_id"] == "test-session-large"
+        assert fetched["event_data"]["transcript"] == transcript
+
+        response = http_client.get(f"{USAGE_ANALYTICS_URL}/analytics/event/999999999")
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
     @pytest.mark.usefixtures("wait_for_services")
     def test_update_event(self, created_test_user, created_test_lab, http_client):
         """Test updating a usage event."""
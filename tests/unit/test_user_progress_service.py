@@ -99,6 +99,23 @@ class TestUserProgressService:
         assert len(labs) > 0, "No labs returned"
         assert labs[0]["lab_type"] == lab_type
     
+    @pytest.mark.usefixtures("wait_for_services")
+    def test_batch_existence_checks(self, created_test_user, created_test_lab, http_client):
+        """Test checking a batch of user IDs and lab types at once."""
+        response = http_client.post(
+            f"{USER_PROGRESS_URL}/users/exists",
+            json={"ids": [created_test_user["id"], "no-such-user"]}
+        )
+        assert response.status_code == HTTPStatus.OK, f"Failed to check users: {response.text}"
+        assert response.json()["existing"] == [created_test_user["id"]]
+
+        response = http_client.post(
+            f"{USER_PROGRESS_URL}/labs/types/exists",
+            json={"ids": [created_test_lab["lab_type"], "no-such-type"]}
+        )
+        assert response.status_code == HTTPStatus.OK, f"Failed to check lab types: {response.text}"
+        assert response.json()["existing"] == [created_test_lab["lab_type"]]
+
     @pytest.mark.usefixtures("wait_for_services")
     def test_record_lab_attempt(self, created_test_user, created_test_lab, http_client):
         """Test recording a lab attempt."""
@@ -1,17 +1,102 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+import asyncio
+import json
+import os
 from typing import List
-from app.database import get_db
+from app.database import get_db, SessionLocal
 from app.models import schemas
 from app import crud
 from app.utils.service_client import ServiceClient
+from app.utils.live import occupancy, new_events, format_sse
+from app.utils.cache import ClosedPeriodCache
+from app.utils.archive import MissingArchiveFile, archive_available
+
+# "sync" validates each event's user and lab type against the User Progress Service before recording it;
+# "deferred" records events at once and validates them in batches afterwards
+VALIDATION_MODE = os.getenv("VALIDATION_MODE", "sync")
+
+# Seconds between keep-alive comments on idle live streams
+LIVE_STREAM_KEEPALIVE = 15
+
+# Bucket sizes supported by the concurrency report, and the most buckets one request may span
+CONCURRENCY_GRANULARITIES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+MAX_CONCURRENCY_BUCKETS = 5000
+
+# Peaks of buckets that have already ended, keyed by ((lab_type, granularity), bucket start)
+concurrency_cache = ClosedPeriodCache()
+
+# Funnels of past days keyed by (lab_type, day); retention of cohorts whose last reported day has passed,
+# keyed by (lab_type, cohort day, max_day)
+funnel_cache = ClosedPeriodCache()
+retention_cache = ClosedPeriodCache()
+
+# Id of the last event edit whose periods were dropped from the caches; edits are logged in the database,
+# so edits made through any instance reach every instance's caches
+_edits_cursor: Optional[int] = None
+
+# Longest window a report may cover; older events may have been archived
+MAX_REPORT_DAYS = crud.MAX_REPORT_DAYS
+
+# Most windows one multi-window trend report may request
+MAX_TREND_WINDOWS = 10
+
+# Most users a top users report may return
+MAX_TOP_USERS = 100
+
+# Most lab types one batched usage request may ask for
+MAX_USAGE_LABS = 100
+
+# Largest page size for the filtered event query
+MAX_EVENT_PAGE_SIZE = 1000
+
+# Largest change feed batch, longest long-poll, and how often a long-poll re-checks for events
+# recorded by other service instances
+MAX_CHANGE_BATCH = 10000
+MAX_CHANGE_WAIT = 60
+CHANGE_POLL_SECONDS = 1
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Convert to naive UTC, treating naive input as UTC already
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Round down to the start of the bucket containing value
+def _bucket_start(value: datetime, step: timedelta) -> datetime:
+    return _EPOCH + ((value - _EPOCH) // step) * step
+
+# Drop the cached results of the periods that events edited, deleted or quarantined since the last call fall in
+def _drop_edited_periods(db: Session):
+    global _edits_cursor
+    if _edits_cursor is None:
+        _edits_cursor = crud.get_settled_edit_id(db)
+    edits, _edits_cursor = crud.get_edits_after(db, _edits_cursor)
+    for edit in edits:
+        labs = (edit.lab_type, None)
+        # An event can extend a session up to SESSION_TIMEOUT past it
+        edited_from = _as_utc(edit.timestamp) - crud.SESSION_TIMEOUT
+        concurrency_cache.invalidate(
+            lambda key: key[0][0] in labs and key[1] + CONCURRENCY_GRANULARITIES[key[0][1]] > edited_from
+        )
+        edited_day = crud.utc_day(edit.timestamp)
+        funnel_cache.invalidate(lambda key: key[0] in labs and key[1] == edited_day)
+        # An event can change a user's first day, so later cohorts are dropped too
+        retention_cache.invalidate(lambda key: key[0] in labs and key[1] + timedelta(days=key[2]) >= edited_day)
 
 router = APIRouter()
 
 # Analytics events endpoints
 @router.post("/analytics/event", response_model=schemas.LabUsageEvent)
 async def record_event(event: schemas.LabUsageEventCreate, db: Session = Depends(get_db)):
+    if VALIDATION_MODE == "deferred":
+        return crud.create_event(db=db, event=event, validated=False)
+
     # Verify user exists via service client
     user_exists = await ServiceClient.validate_user_exists(event.user_id)
     if not user_exists:
@@ -24,76 +109,386 @@ async def record_event(event: schemas.LabUsageEventCreate, db: Session = Depends
     
     return crud.create_event(db=db, event=event)
 
-@router.get("/analytics/usage/lab/{lab_type}")
-async def get_lab_usage(lab_type: str, days: int = 7, db: Session = Depends(get_db)):
-    # Verify lab type exists
-    lab_exists = await ServiceClient.validate_lab_exists(lab_type)
-    if not lab_exists:
-        raise HTTPException(status_code=404, detail="Lab type not found")
-        
-    events = crud.get_lab_events(db, lab_type, days)
-    if not events:
-        raise HTTPException(status_code=404, detail="No usage data found for lab type")
-    
-    unique_users = len(set(e.user_id for e in events))
-    event_counts = {}
-    sessions = {}
-    
-    for event in events:
-        event_counts[event.event_type] = event_counts.get(event.event_type, 0) + 1
-        if event.event_type in ['start', 'complete']:
-            if event.user_id not in sessions:
-                sessions[event.user_id] = []
-            sessions[event.user_id].append(event)
-    
-    total_session_time = timedelta()
-    session_count = 0
-    for user_sessions in sessions.values():
-        user_sessions.sort(key=lambda x: x.timestamp)
-        for i in range(0, len(user_sessions) - 1, 2):
-            if i + 1 < len(user_sessions):
-                session_time = user_sessions[i + 1].timestamp - user_sessions[i].timestamp
-                total_session_time += session_time
-                session_count += 1
+@router.get("/analytics/events", response_model=schemas.LabUsageEventPage)
+async def search_events(
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    contains: Optional[str] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+):
+    if not 1 <= limit <= MAX_EVENT_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_EVENT_PAGE_SIZE}")
+    filters = None
+    if contains is not None:
+        try:
+            filters = json.loads(contains)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="contains must be a JSON object")
+        if not isinstance(filters, dict):
+            raise HTTPException(status_code=400, detail="contains must be a JSON object")
+
+    try:
+        events = crud.search_events(db, lab_type, event_type, filters, start, end, cursor, limit)
+    except MissingArchiveFile as e:
+        raise HTTPException(status_code=503, detail=f"Archived events unavailable: {e}")
+    return {
+        "events": events,
+        "next_cursor": events[-1].id if len(events) == limit else None
+    }
+
+# One change feed poll in its own short-lived session, so a long-poll holds no connection while it waits
+def _poll_changes(after_id: int, limit: int) -> List[schemas.LabUsageEvent]:
+    db = SessionLocal()
+    try:
+        return [schemas.LabUsageEvent.model_validate(event) for event in crud.get_events_after(db, after_id, limit)]
+    finally:
+        db.close()
+
+@router.get("/analytics/events/changes")
+async def get_event_changes(after_id: int = 0, limit: int = 1000, wait: float = 30):
+    if not 1 <= limit <= MAX_CHANGE_BATCH:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_CHANGE_BATCH}")
+    if not 0 <= wait <= MAX_CHANGE_WAIT:
+        raise HTTPException(status_code=400, detail=f"wait must be between 0 and {MAX_CHANGE_WAIT} seconds")
+
+    # Long-poll until events arrive or the wait runs out
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    events = _poll_changes(after_id, limit)
+    while not events and loop.time() < deadline:
+        await new_events.wait(min(CHANGE_POLL_SECONDS, deadline - loop.time()))
+        events = _poll_changes(after_id, limit)
+
+    lines = (event.model_dump_json() + "\n" for event in events)
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"X-Next-Cursor": str(events[-1].id if events else after_id)}
+    )
+
+# Usage summary of one lab type; None if it has no events in the period
+def _lab_usage_summary(db: Session, lab_type: str, days: int, exact: bool) -> Optional[dict]:
+    event_counts = crud.get_event_distribution(db, lab_type, days)
+    if not event_counts:
+        return None
     
-    avg_session_time = (total_session_time.total_seconds() / session_count) if session_count > 0 else 0
+    unique_users = crud.get_unique_users(db, days, lab_type, exact=exact).get(lab_type, 0)
+    session_stats = crud.get_session_stats(db, lab_type, days)
     
     return {
         "lab_type": lab_type,
         "time_period_days": days,
         "unique_users": unique_users,
-        "total_events": len(events),
+        "total_events": sum(event_counts.values()),
         "event_distribution": event_counts,
-        "average_session_time_seconds": avg_session_time
+        "average_session_time_seconds": session_stats["average_session_time_seconds"],
+        "total_sessions": session_stats["total_sessions"],
+        "completed_sessions": session_stats["completed_sessions"]
     }
 
+@router.get("/analytics/usage/lab/{lab_type}")
+async def get_lab_usage(lab_type: str, days: int = 7, exact: bool = False, db: Session = Depends(get_db)):
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+    # Verify lab type exists
+    lab_exists = await ServiceClient.validate_lab_exists(lab_type)
+    if not lab_exists:
+        raise HTTPException(status_code=404, detail="Lab type not found")
+        
+    usage = _lab_usage_summary(db, lab_type, days, exact)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="No usage data found for lab type")
+    return usage
+
+# Usage summaries of several lab types in one call; unknown lab types and those without usage data are left out
+@router.get("/analytics/usage/labs")
+async def get_labs_usage(lab_types: str, days: int = 7, exact: bool = False, db: Session = Depends(get_db)):
+    requested = list(dict.fromkeys(lab_type for lab_type in lab_types.split(",") if lab_type))
+    if not 1 <= len(requested) <= MAX_USAGE_LABS:
+        raise HTTPException(status_code=400, detail=f"lab_types must list between 1 and {MAX_USAGE_LABS} lab types")
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+
+    existing = await ServiceClient.find_existing_lab_types(requested)
+    if existing is None:
+        raise HTTPException(status_code=503, detail="User Progress Service unavailable")
+
+    labs = {}
+    for lab_type in requested:
+        if lab_type in existing:
+            usage = _lab_usage_summary(db, lab_type, days, exact)
+            if usage is not None:
+                labs[lab_type] = usage
+    return {"time_period_days": days, "labs": labs}
+
 @router.get("/analytics/trends")
-async def get_usage_trends(days: int = 30, db: Session = Depends(get_db)):
-    events = crud.get_recent_events(db, days)
-    
+async def get_usage_trends(days: int = 30, exact: bool = False, db: Session = Depends(get_db)):
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+    totals = crud.get_lab_event_totals(db, days)
+    unique_users = crud.get_unique_users(db, days, exact=exact)
+
     lab_usage = {}
-    for event in events:
-        if event.lab_type not in lab_usage:
-            lab_usage[event.lab_type] = {
-                "total_events": 0,
-                "unique_users": set(),
-                "errors": 0
-            }
-        lab_usage[event.lab_type]["total_events"] += 1
-        lab_usage[event.lab_type]["unique_users"].add(event.user_id)
-        if event.event_type == "error":
-            lab_usage[event.lab_type]["errors"] += 1
-    
-    # Convert sets to counts for JSON serialization
-    for lab in lab_usage.values():
-        lab["unique_users"] = len(lab["unique_users"])
+    for row in totals:
+        lab_usage[row.lab_type] = {
+            "total_events": row.total_events,
+            "unique_users": unique_users.get(row.lab_type, 0),
+            "errors": row.errors
+        }
     
     return {
         "time_period_days": days,
-        "total_events": len(events),
+        "total_events": sum(row.total_events for row in totals),
         "lab_usage": lab_usage
     }
 
+@router.get("/analytics/trends/multi")
+async def get_usage_trends_multi(windows: str = "1,7,30", exact: bool = False, db: Session = Depends(get_db)):
+    try:
+        window_days = sorted({int(days) for days in windows.split(",")})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="windows must be a comma-separated list of day counts")
+    if not window_days or len(window_days) > MAX_TREND_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"windows must list between 1 and {MAX_TREND_WINDOWS} day counts")
+    if not all(1 <= days <= MAX_REPORT_DAYS for days in window_days):
+        raise HTTPException(status_code=400, detail=f"Each window must be between 1 and {MAX_REPORT_DAYS} days")
+
+    totals = crud.get_lab_event_totals_multi(db, window_days, count_users=exact)
+    unique_users = None if exact else crud.estimate_unique_users_multi(db, window_days)
+
+    trends = {}
+    for days in window_days:
+        lab_usage = {}
+        for lab_type, lab_totals in totals[days].items():
+            lab_usage[lab_type] = {
+                "total_events": lab_totals["total_events"],
+                "unique_users": lab_totals["unique_users"] if exact else unique_users[days].get(lab_type, 0),
+                "errors": lab_totals["errors"]
+            }
+        trends[days] = {
+            "time_period_days": days,
+            "total_events": sum(usage["total_events"] for usage in lab_usage.values()),
+            "lab_usage": lab_usage
+        }
+    return {"windows": trends}
+
+@router.get("/analytics/concurrency")
+async def get_concurrency(
+    lab_type: Optional[str] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    granularity: str = "hour",
+    db: Session = Depends(get_db),
+):
+    step = CONCURRENCY_GRANULARITIES.get(granularity)
+    if step is None:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(CONCURRENCY_GRANULARITIES)}")
+
+    now = datetime.utcnow()
+    end = _as_utc(end) if end else now
+    start = _as_utc(start) if start else end - timedelta(days=1)
+    start = _bucket_start(start, step)
+    if _bucket_start(end, step) < end:
+        end = _bucket_start(end, step) + step
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    if (end - start) / step > MAX_CONCURRENCY_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {MAX_CONCURRENCY_BUCKETS} buckets")
+
+    buckets = [start + i * step for i in range(int((end - start) / step))]
+    scope = (lab_type, granularity)
+    _drop_edited_periods(db)
+    peaks = {bucket: concurrency_cache.get((scope, bucket)) for bucket in buckets}
+
+    # Closed buckets are cached, so only the span from the first uncached bucket is swept
+    missing = [bucket for bucket in buckets if peaks[bucket] is None]
+    if missing:
+        computed = crud.get_peak_concurrency(db, missing[0], end, granularity, step, lab_type)
+        for bucket in buckets[buckets.index(missing[0]):]:
+            peaks[bucket] = {lab: lab_peaks[bucket] for lab, lab_peaks in computed.items() if lab_peaks[bucket]}
+            if bucket + step <= now:
+                concurrency_cache.put((scope, bucket), peaks[bucket])
+
+    labs = sorted({lab for bucket_peaks in peaks.values() for lab in bucket_peaks})
+    return {
+        "granularity": granularity,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "labs": {
+            lab: [
+                {"bucket": bucket.isoformat(), "peak_concurrent_sessions": peaks[bucket].get(lab, 0)}
+                for bucket in buckets
+            ]
+            for lab in labs
+        }
+    }
+
+@router.get("/analytics/funnel")
+async def get_funnel(lab_type: Optional[str] = None, days: int = 7, db: Session = Depends(get_db)):
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+
+    _drop_edited_periods(db)
+    today = datetime.utcnow().date()
+    report_days = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    funnels = {day: funnel_cache.get((lab_type, day)) for day in report_days}
+
+    missing = [day for day in report_days if funnels[day] is None]
+    if missing:
+        computed = crud.get_funnel(db, missing[0], today + timedelta(days=1), lab_type)
+        for day in report_days[report_days.index(missing[0]):]:
+            funnels[day] = computed.get(day, {})
+            if day < today:
+                funnel_cache.put((lab_type, day), funnels[day])
+
+    empty = {"started": 0, "errored": 0, "completed": 0, "completed_after_error": 0}
+    labs = sorted({lab for day_funnels in funnels.values() for lab in day_funnels})
+    return {
+        "time_period_days": days,
+        "funnel": {
+            lab: [{"day": day.isoformat(), **funnels[day].get(lab, empty)} for day in report_days]
+            for lab in labs
+        }
+    }
+
+@router.get("/analytics/retention")
+async def get_retention(lab_type: Optional[str] = None, days: int = 14, max_day: int = 7, db: Session = Depends(get_db)):
+    if not 1 <= days <= MAX_REPORT_DAYS or not 1 <= max_day <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days and max_day must be between 1 and {MAX_REPORT_DAYS}")
+
+    _drop_edited_periods(db)
+    today = datetime.utcnow().date()
+    cohort_days = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    cohorts = {day: retention_cache.get((lab_type, day, max_day)) for day in cohort_days}
+
+    missing = [day for day in cohort_days if cohorts[day] is None]
+    if missing:
+        computed = crud.get_retention(db, missing[0], today + timedelta(days=1), max_day, lab_type)
+        for day in cohort_days[cohort_days.index(missing[0]):]:
+            cohorts[day] = computed.get(day, {"users": 0, "retained": {}})
+            if day + timedelta(days=max_day) < today:
+                retention_cache.put((lab_type, day, max_day), cohorts[day])
+
+    return {
+        "lab_type": lab_type,
+        "max_day": max_day,
+        "cohorts": [
+            {
+                "cohort_day": day.isoformat(),
+                "users": cohorts[day]["users"],
+                "retained_users": cohorts[day]["retained"],
+                "retention_rates": {
+                    n: (retained / cohorts[day]["users"]) if cohorts[day]["users"] else 0
+                    for n, retained in cohorts[day]["retained"].items()
+                }
+            }
+            for day in cohort_days
+        ]
+    }
+
+@router.get("/analytics/heatmap/{lab_type}")
+async def get_usage_heatmap(
+    lab_type: str,
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+):
+    if start is not None and end is not None and end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+
+    # Date bounds are inclusive UTC days
+    heatmap = crud.get_usage_heatmap(db, lab_type, start, end + timedelta(days=1) if end is not None else None)
+    return {
+        "lab_type": lab_type,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "days": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+        "heatmap": heatmap,
+        "total_events": sum(map(sum, heatmap))
+    }
+
+@router.get("/analytics/top-users/{lab_type}")
+async def get_top_users(lab_type: str, days: int = 7, k: int = 20, exact: bool = False, db: Session = Depends(get_db)):
+    if not 1 <= k <= MAX_TOP_USERS:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_TOP_USERS}")
+    if not 1 <= days <= MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_REPORT_DAYS}")
+
+    top_users = crud.get_top_users(db, lab_type, days, k, exact=exact)
+    return {
+        "lab_type": lab_type,
+        "time_period_days": days,
+        "exact": exact,
+        "top_users": [
+            {"user_id": user_id, "events": events, "max_overcount": error}
+            for user_id, events, error in top_users
+        ]
+    }
+
+@router.post("/analytics/archive")
+async def archive_events(before: date, db: Session = Depends(get_db)):
+    if not archive_available():
+        raise HTTPException(status_code=503, detail="Archiving requires pyarrow")
+    if before > crud.latest_archive_day():
+        raise HTTPException(
+            status_code=400,
+            detail=f"before must be more than {MAX_REPORT_DAYS} days ago, so reports never reach archived events"
+        )
+
+    archived = crud.archive_events(db, before)
+    return {
+        "archived_files": [
+            {
+                "path": entry.path,
+                "from": entry.start_at.isoformat(),
+                "to": entry.end_at.isoformat(),
+                "events": entry.row_count
+            }
+            for entry in archived
+        ],
+        "total_events": sum(entry.row_count for entry in archived)
+    }
+
+@router.get("/analytics/live")
+async def get_live_occupancy():
+    active_sessions = occupancy.snapshot()
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "active_sessions": active_sessions,
+        "total_active": sum(active_sessions.values())
+    }
+
+@router.get("/analytics/live/stream")
+async def stream_live_occupancy(request: Request):
+    queue = occupancy.subscribe()
+
+    async def events():
+        try:
+            yield format_sse("snapshot", json.dumps(occupancy.snapshot()))
+            while not await request.is_disconnected():
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=LIVE_STREAM_KEEPALIVE)
+                    yield format_sse("delta", json.dumps(delta))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            occupancy.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/analytics/event/{event_id}", response_model=schemas.LabUsageEvent)
+async def get_event(event_id: int, db: Session = Depends(get_db)):
+    db_event = crud.get_event(db, event_id)
+    if not db_event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    # The full payload is only read here; listings return the fields kept inline
+    event = schemas.LabUsageEvent.model_validate(db_event)
+    return event.model_copy(update={"event_data": crud.get_event_data(db_event)})
+
 @router.put("/analytics/event/{event_id}", response_model=schemas.LabUsageEvent)
 async def update_event(event_id: int, event: schemas.LabUsageEventCreate, db: Session = Depends(get_db)):
     # Verify user exists via service client
@@ -1,44 +1,316 @@
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from sqlalchemy import distinct, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, make_transient_to_detached, selectinload
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import os
 from app.models import models, schemas
+from app.utils.sketches import HyperLogLog, HLL_REGISTERS, PendingTopUsers, SpaceSaving, TOP_K_CAPACITY
+from app.utils.live import occupancy, new_events
+from app.utils.dictionary import DimensionDictionary
+from app.utils.bloom import ScalableBloomFilter
+from app.utils.counters import PendingUsageCounts
+from app.utils import archive, compression
+
+# Open sessions without a matching 'complete' within this window are treated as timed out
+SESSION_TIMEOUT = timedelta(minutes=int(os.getenv("SESSION_TIMEOUT_MINUTES", "120")))
+
+# Ids are taken when an insert starts but become visible at commit, so for this long a gap in the ids is
+# treated as an event still being written; older gaps are rolled back or deleted events
+IN_FLIGHT_GRACE = timedelta(seconds=5)
+
+# Process-wide encode/decode caches, one per dimension table
+DIMENSIONS = {
+    models.DimUser: DimensionDictionary(),
+    models.DimLabType: DimensionDictionary(),
+    models.DimEventType: DimensionDictionary(),
+}
+
+# Longest window, in days, a report may read raw events for. Only events a day older than that are archived,
+# so reports, which read only PostgreSQL, never miss archived events.
+MAX_REPORT_DAYS = 366
+
+# Directory for archived event files; every instance sharing the database must see the same files
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/var/lib/usage-analytics/archive")
+
+# event_data payloads larger than this many bytes are compressed into usage_event_payloads; unset keeps all inline
+PAYLOAD_COMPRESSION_THRESHOLD = os.getenv("PAYLOAD_COMPRESSION_THRESHOLD")
+
+# Client event ids recorded so far; a miss means the event is new without querying the unique index
+seen_event_ids = ScalableBloomFilter()
+
+# Top user counts of events recorded here, until flush_top_users writes them
+pending_top_users = PendingTopUsers()
+
+# Hourly event count changes made here, until flush_usage_counters writes them
+pending_usage_counts = PendingUsageCounts()
+
+# Dimension operations
+# Get the surrogate key of a dimension value, assigning one on first sight.
+# New values are committed on their own connection, so a cached key never refers to a rolled-back row.
+def encode(db: Session, dimension, value: str) -> int:
+    dictionary = DIMENSIONS[dimension]
+    key = dictionary.key(value)
+    if key is None:
+        with db.get_bind().begin() as connection:
+            connection.execute(
+                pg_insert(dimension).values(value=value).on_conflict_do_nothing(index_elements=["value"])
+            )
+            key = connection.execute(select(dimension.id).where(dimension.value == value)).scalar_one()
+        dictionary.add(key, value)
+    return key
+
+# Get the surrogate key of a dimension value without assigning one; None if the value was never seen
+def lookup_key(db: Session, dimension, value: str) -> Optional[int]:
+    dictionary = DIMENSIONS[dimension]
+    key = dictionary.key(value)
+    if key is None:
+        key = db.query(dimension.id).filter(dimension.value == value).scalar()
+        if key is not None:
+            dictionary.add(key, value)
+    return key
+
+# Get the dimension value for a surrogate key
+def decode(db: Session, dimension, key: int) -> str:
+    dictionary = DIMENSIONS[dimension]
+    value = dictionary.value(key)
+    if value is None:
+        value = db.query(dimension.value).filter(dimension.id == key).scalar()
+        dictionary.add(key, value)
+    return value
+
+# Dimension row for a value, attached to the session without a query
+def _dimension_row(db: Session, dimension, value: str):
+    row = dimension(id=encode(db, dimension, value), value=value)
+    make_transient_to_detached(row)
+    return db.merge(row, load=False)
+
+# Split a payload over the compression threshold into the fields kept inline, its size and its compressed form
+def _split_payload(payload: Optional[Dict]) -> Tuple[Optional[Dict], Optional[int], Optional[models.EventPayload]]:
+    if PAYLOAD_COMPRESSION_THRESHOLD is None or not payload:
+        return payload, None, None
+    size = compression.payload_size(payload)
+    if size <= int(PAYLOAD_COMPRESSION_THRESHOLD):
+        return payload, None, None
+    codec, data = compression.compress(payload)
+    return compression.inline_fields(payload), size, models.EventPayload(codec=codec, data=data)
+
+# Map an event's strings to dimension rows for the fact table
+def _event_columns(db: Session, event: schemas.LabUsageEventCreate) -> Dict:
+    event_data, payload_size, payload = _split_payload(event.event_data)
+    return {
+        "user_dim": _dimension_row(db, models.DimUser, event.user_id),
+        "lab_type_dim": _dimension_row(db, models.DimLabType, event.lab_type),
+        "event_type_dim": _dimension_row(db, models.DimEventType, event.event_type),
+        "event_data": event_data,
+        "payload_size": payload_size,
+        "payload": payload,
+    }
 
 # Event CRUD operations
-# Create a new lab usage event
-def create_event(db: Session, event: schemas.LabUsageEventCreate):
-    db_event = models.UsageEvent(**event.model_dump())
+# Create a new lab usage event; an event_id that was already recorded returns the stored event instead
+def create_event(db: Session, event: schemas.LabUsageEventCreate, validated: bool = True):
+    if event.event_id is not None and event.event_id in seen_event_ids:
+        existing = get_event_by_event_id(db, event.event_id)
+        if existing is not None:
+            return existing
+
+    db_event = models.UsageEvent(event_id=event.event_id, validated=validated, **_event_columns(db, event))
     db.add(db_event)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Recorded concurrently or by another instance since the filter was checked
+        db.rollback()
+        existing = get_event_by_event_id(db, event.event_id) if event.event_id is not None else None
+        if existing is None:
+            raise
+        seen_event_ids.add(event.event_id)
+        return existing
+    # Events awaiting deferred validation join the sketches and the duplicate filter once they pass
+    if validated:
+        update_user_sketch(db, db_event.lab_type, utc_day(db_event.timestamp), db_event.user_id)
+    opened, closed = update_sessions(db, db_event)
     db.commit()
+    pending_usage_counts.add(db_event.lab_type, db_event.timestamp, 1)
+    if validated:
+        pending_top_users.add(db_event.lab_type, utc_day(db_event.timestamp), db_event.user_id)
+        if event.event_id is not None:
+            seen_event_ids.add(event.event_id)
+    _update_occupancy(opened, closed)
+    new_events.notify()
     db.refresh(db_event)
     return db_event
 
-# Get events for a specific lab type
-def get_lab_events(db: Session, lab_type: str, days: int = 7):
-    cutoff_date = datetime.now() - timedelta(days=days)
-    return (
+# Get an event by id
+def get_event(db: Session, event_id: int):
+    return db.query(models.UsageEvent).filter(models.UsageEvent.id == event_id).first()
+
+# Full event_data of an event, decompressing it if it was moved to usage_event_payloads
+def get_event_data(db_event: models.UsageEvent) -> Optional[Dict]:
+    if db_event.payload_size is None:
+        return db_event.event_data
+    return compression.decompress(db_event.payload.codec, db_event.payload.data)
+
+# Get an event by its client-generated id
+def get_event_by_event_id(db: Session, event_id: str):
+    return db.query(models.UsageEvent).filter(models.UsageEvent.event_id == event_id).first()
+
+# Seed the duplicate filter with the client event ids already stored
+def load_seen_event_ids(db: Session) -> int:
+    rows = db.query(models.UsageEvent.event_id).filter(models.UsageEvent.event_id.isnot(None), models.UsageEvent.validated)
+    loaded = 0
+    for (event_id,) in rows.yield_per(10000):
+        seen_event_ids.add(event_id)
+        loaded += 1
+    return loaded
+
+# Get a page of events, newest first, matching the filters; contains is matched with JSONB @>.
+# Strings that were never seen have no key, and an IS NULL filter on the key matches nothing.
+def search_events(
+    db: Session,
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    contains: Optional[Dict] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = 100,
+):
+    query = db.query(models.UsageEvent)
+    if lab_type is not None:
+        query = query.filter(models.UsageEvent.lab_type_key == lookup_key(db, models.DimLabType, lab_type))
+    if event_type is not None:
+        query = query.filter(models.UsageEvent.event_type_key == lookup_key(db, models.DimEventType, event_type))
+    if contains:
+        query = query.filter(models.UsageEvent.event_data.contains(contains))
+    if start is not None:
+        query = query.filter(models.UsageEvent.timestamp >= start)
+    if end is not None:
+        query = query.filter(models.UsageEvent.timestamp < end)
+    if cursor is not None:
+        query = query.filter(models.UsageEvent.id < cursor)
+    events = query.order_by(models.UsageEvent.id.desc()).limit(limit).all()
+
+    # Ranges reaching back into the archive also read it; archived and live ids never overlap
+    if start is not None:
+        archived = get_archived_events(db, start, limit, end, lab_type, event_type, cursor, contains)
+        if archived:
+            events = sorted(events + archived, key=lambda e: e.id, reverse=True)[:limit]
+    return events
+
+# Get up to limit events after an id, in id order, for the change feed.
+# Stops before a recent gap in the ids so a consumer's cursor never passes an event that has yet to commit.
+def get_events_after(db: Session, after_id: int, limit: int = 1000) -> List[models.UsageEvent]:
+    events = (
         db.query(models.UsageEvent)
+        .filter(models.UsageEvent.id > after_id)
+        .order_by(models.UsageEvent.id)
+        .limit(limit)
+        .all()
+    )
+    # now() is frozen at the start of the transaction; the cutoff needs the current time
+    settled_before = db.scalar(select(func.clock_timestamp())) - IN_FLIGHT_GRACE
+    previous_id = after_id
+    for i, event in enumerate(events):
+        if event.id != previous_id + 1 and event.timestamp > settled_before:
+            return events[:i]
+        previous_id = event.id
+    return events
+
+# Get event counts per event type for a lab type
+def get_event_distribution(db: Session, lab_type: str, days: int = 7) -> Dict[str, int]:
+    cutoff_date = datetime.now() - timedelta(days=days)
+    counts = (
+        db.query(models.UsageEvent.event_type_key, func.count(models.UsageEvent.id))
         .filter(
-            models.UsageEvent.lab_type == lab_type,
+            models.UsageEvent.lab_type_key == lookup_key(db, models.DimLabType, lab_type),
             models.UsageEvent.timestamp >= cutoff_date,
         )
+        .group_by(models.UsageEvent.event_type_key)
         .all()
     )
+    return {decode(db, models.DimEventType, key): count for key, count in counts}
 
-# Get all recent events 
-def get_recent_events(db: Session, days: int = 30):
+# Get event and error totals per lab type; grouped on the integer key, then joined to the lab names
+def get_lab_event_totals(db: Session, days: int = 30):
     cutoff_date = datetime.now() - timedelta(days=days)
-    return (
-        db.query(models.UsageEvent)
+    totals = (
+        db.query(
+            models.UsageEvent.lab_type_key,
+            func.count(models.UsageEvent.id).label("total_events"),
+            func.count(models.UsageEvent.id)
+            .filter(models.UsageEvent.event_type_key == lookup_key(db, models.DimEventType, "error"))
+            .label("errors"),
+        )
         .filter(models.UsageEvent.timestamp >= cutoff_date)
+        .group_by(models.UsageEvent.lab_type_key)
+        .subquery()
+    )
+    return (
+        db.query(models.DimLabType.value.label("lab_type"), totals.c.total_events, totals.c.errors)
+        .join(totals, totals.c.lab_type_key == models.DimLabType.id)
+        .all()
+    )
+
+# Get event and error totals per lab type for several trailing windows in one scan of the largest,
+# optionally with exact distinct users; returns {days: {lab_type: totals}}
+def get_lab_event_totals_multi(db: Session, windows: List[int], count_users: bool = False) -> Dict[int, Dict[str, Dict[str, int]]]:
+    now = datetime.now()
+    error_key = lookup_key(db, models.DimEventType, "error")
+    columns = [models.UsageEvent.lab_type_key]
+    for days in windows:
+        in_window = models.UsageEvent.timestamp >= now - timedelta(days=days)
+        columns.append(func.count(models.UsageEvent.id).filter(in_window).label(f"total_events_{days}"))
+        columns.append(
+            func.count(models.UsageEvent.id)
+            .filter(in_window, models.UsageEvent.event_type_key == error_key)
+            .label(f"errors_{days}")
+        )
+        if count_users:
+            columns.append(func.count(distinct(models.UsageEvent.user_key)).filter(in_window).label(f"unique_users_{days}"))
+    rows = (
+        db.query(*columns)
+        .filter(models.UsageEvent.timestamp >= now - timedelta(days=max(windows)))
+        .group_by(models.UsageEvent.lab_type_key)
         .all()
     )
 
+    totals = {days: {} for days in windows}
+    for row in rows:
+        lab_type = decode(db, models.DimLabType, row.lab_type_key)
+        for days in windows:
+            total_events = getattr(row, f"total_events_{days}")
+            if not total_events:
+                continue
+            totals[days][lab_type] = {"total_events": total_events, "errors": getattr(row, f"errors_{days}")}
+            if count_users:
+                totals[days][lab_type]["unique_users"] = getattr(row, f"unique_users_{days}")
+    return totals
+
 # Update event information
 def update_event(db: Session, event_id: int, event: schemas.LabUsageEventCreate):
     db_event = (db.query(models.UsageEvent).filter(models.UsageEvent.id == event_id).first())
     if db_event:
-        for key, value in event.model_dump().items():
+        previous_user_id, previous_lab_type = db_event.user_id, db_event.lab_type
+        for key, value in _event_columns(db, event).items():
             setattr(db_event, key, value)
+        db.flush()
+        _record_edit(db, previous_lab_type, db_event.timestamp)
+        if db_event.lab_type != previous_lab_type:
+            _record_edit(db, db_event.lab_type, db_event.timestamp)
+        if db_event.validated:
+            update_user_sketch(db, db_event.lab_type, utc_day(db_event.timestamp), db_event.user_id)
+        opened, closed = rebuild_sessions(db, previous_user_id, previous_lab_type, db_event.timestamp)
+        if (db_event.user_id, db_event.lab_type) != (previous_user_id, previous_lab_type):
+            moved_opened, moved_closed = rebuild_sessions(db, db_event.user_id, db_event.lab_type, db_event.timestamp)
+            opened, closed = opened + moved_opened, closed + moved_closed
         db.commit()
+        if db_event.lab_type != previous_lab_type:
+            pending_usage_counts.add(previous_lab_type, db_event.timestamp, -1)
+            pending_usage_counts.add(db_event.lab_type, db_event.timestamp, 1)
+        _update_occupancy(opened, closed)
         db.refresh(db_event)
     return db_event
 
@@ -46,7 +318,843 @@ def update_event(db: Session, event_id: int, event: schemas.LabUsageEventCreate)
 def delete_event(db: Session, event_id: int):
     db_event = (db.query(models.UsageEvent).filter(models.UsageEvent.id == event_id).first())
     if db_event:
-        db.delete(db_event)
+        lab_type, timestamp = db_event.lab_type, db_event.timestamp
+        opened, closed = _delete_event(db, db_event)
         db.commit()
+        pending_usage_counts.add(lab_type, timestamp, -1)
+        _update_occupancy(opened, closed)
         return True
     return False
+
+# Delete an event without committing, undoing its effect on sessions; the caller takes it off the usage
+# counters once committed. Returns the (lab_type, session id) pairs opened and closed
+def _delete_event(db: Session, db_event: models.UsageEvent):
+    user_id, lab_type, timestamp = db_event.user_id, db_event.lab_type, db_event.timestamp
+    _record_edit(db, lab_type, timestamp)
+    db.delete(db_event)
+    db.flush()
+    return rebuild_sessions(db, user_id, lab_type, timestamp)
+
+# Record that a lab's past events changed at a time, in the caller's transaction
+def _record_edit(db: Session, lab_type: str, timestamp: datetime):
+    db.add(models.EventEdit(lab_type=lab_type, timestamp=timestamp))
+
+# Get the event edits recorded after an id, in id order, and the id to read after next time. Ids become
+# visible at commit, so edits of the last IN_FLIGHT_GRACE are returned again rather than passed over.
+def get_edits_after(db: Session, after_id: int) -> Tuple[List[models.EventEdit], int]:
+    edits = db.query(models.EventEdit).filter(models.EventEdit.id > after_id).order_by(models.EventEdit.id).all()
+    settled_before = db.scalar(select(func.clock_timestamp())) - IN_FLIGHT_GRACE
+    next_id = after_id
+    for edit in edits:
+        if edit.edited_at >= settled_before:
+            break
+        next_id = edit.id
+    return edits, next_id
+
+# Get the id of the latest event edit recorded more than IN_FLIGHT_GRACE ago, or 0
+def get_settled_edit_id(db: Session) -> int:
+    settled_before = db.scalar(select(func.clock_timestamp())) - IN_FLIGHT_GRACE
+    return db.query(func.max(models.EventEdit.id)).filter(models.EventEdit.edited_at < settled_before).scalar() or 0
+
+# Deferred validation operations
+# Claim the oldest events still waiting for validation. Their rows stay locked until the transaction ends,
+# and rows another instance has claimed are skipped, so each event is checked by one instance.
+def claim_unvalidated_events(db: Session, limit: int = 500) -> List[models.UsageEvent]:
+    return (
+        db.query(models.UsageEvent)
+        .filter(~models.UsageEvent.validated)
+        .order_by(models.UsageEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=models.UsageEvent)
+        .all()
+    )
+
+# Finish validating claimed events in one transaction. Valid events are marked validated and only now
+# counted in the sketches and the duplicate filter. Rejected events, given as (event, reason), are moved
+# to quarantined_events, undoing their effect on sessions and counters.
+def finish_validation(db: Session, valid: List[models.UsageEvent], rejected: List[Tuple[models.UsageEvent, str]]):
+    opened, closed = [], []
+    removed = [(db_event.lab_type, db_event.timestamp) for db_event, _ in rejected]
+    for db_event, reason in rejected:
+        db.add(models.QuarantinedEvent(
+            id=db_event.id,
+            event_id=db_event.event_id,
+            user_id=db_event.user_id,
+            lab_type=db_event.lab_type,
+            event_type=db_event.event_type,
+            event_data=get_event_data(db_event),
+            timestamp=db_event.timestamp,
+            reason=reason,
+        ))
+        event_opened, event_closed = _delete_event(db, db_event)
+        opened, closed = opened + event_opened, closed + event_closed
+
+    counted = [(e.lab_type, e.timestamp, e.user_id, e.event_id) for e in valid]
+    if valid:
+        db.query(models.UsageEvent).filter(models.UsageEvent.id.in_([e.id for e in valid])).update(
+            {"validated": True}, synchronize_session=False
+        )
+    for lab_type, timestamp, user_id, _ in counted:
+        update_user_sketch(db, lab_type, utc_day(timestamp), user_id)
+    db.commit()
+
+    for lab_type, timestamp in removed:
+        pending_usage_counts.add(lab_type, timestamp, -1)
+    for lab_type, timestamp, user_id, event_id in counted:
+        pending_top_users.add(lab_type, utc_day(timestamp), user_id)
+        if event_id is not None:
+            seen_event_ids.add(event_id)
+    _update_occupancy(opened, closed)
+
+# Session operations
+# Session id sent by the client in event_data, if any
+def _session_key(event) -> Optional[str]:
+    session_id = (event.event_data or {}).get("session_id")
+    return str(session_id) if session_id is not None else None
+
+# Apply a start/complete event to the open sessions of its (user, lab); returns the new session, if any
+def _apply_session_event(open_sessions: List[models.LabSession], event) -> Optional[models.LabSession]:
+    timestamp = event.timestamp
+    key = _session_key(event)
+
+    for session in open_sessions:
+        if session.started_at < timestamp - SESSION_TIMEOUT:
+            session.status = "timed_out"
+            session.ended_at = session.started_at + SESSION_TIMEOUT
+    still_open = [s for s in open_sessions if s.status == "open"]
+
+    if event.event_type == "start":
+        if key is not None and any(s.session_key == key for s in still_open):
+            return None  # Repeated start for a session that is already open
+        if key is None:
+            # Without session ids a new start supersedes the previous one
+            for session in still_open:
+                if session.session_key is None:
+                    session.status = "abandoned"
+                    session.ended_at = timestamp
+        return models.LabSession(
+            user_id=event.user_id,
+            lab_type=event.lab_type,
+            session_key=key,
+            status="open",
+            start_event_id=event.id,
+            started_at=timestamp,
+        )
+
+    # A 'complete' closes the matching session, falling back to the latest session without an id
+    candidates = [s for s in still_open if s.session_key == key] if key is not None else still_open
+    if key is not None and not candidates:
+        candidates = [s for s in still_open if s.session_key is None]
+    if candidates:
+        session = max(candidates, key=lambda s: s.started_at)
+        session.status = "completed"
+        session.end_event_id = event.id
+        session.ended_at = timestamp
+        session.duration_seconds = (timestamp - session.started_at).total_seconds()
+    return None
+
+# Open or close the lab session an ingested event belongs to; returns (lab_type, session id) pairs opened and closed
+def update_sessions(db: Session, db_event: models.UsageEvent):
+    if db_event.event_type not in ("start", "complete"):
+        return [], []
+    open_sessions = (
+        db.query(models.LabSession)
+        .filter(
+            models.LabSession.user_id == db_event.user_id,
+            models.LabSession.lab_type == db_event.lab_type,
+            models.LabSession.status == "open",
+        )
+        .with_for_update()
+        .all()
+    )
+    new_session = _apply_session_event(open_sessions, db_event)
+    opened = []
+    if new_session is not None:
+        db.add(new_session)
+        db.flush()
+        opened.append((new_session.lab_type, new_session.id))
+    closed = [(s.lab_type, s.id) for s in open_sessions if s.status != "open"]
+    return opened, closed
+
+# Rebuild the sessions of a (user, lab) after one of its events at timestamp changed or was deleted, by replaying
+# its start/complete events. Replay begins at the start of the earliest session still running at that time
+# (or overlapping one that is), so every session it replaces is rebuilt whole and earlier ones are kept.
+# Returns (lab_type, session id) pairs opened and closed.
+def rebuild_sessions(db: Session, user_id: str, lab_type: str, timestamp: datetime):
+    sessions = models.LabSession
+    same_pair = (sessions.user_id == user_id, sessions.lab_type == lab_type)
+    replay_from = timestamp
+    while True:
+        earliest = db.scalar(
+            select(func.min(sessions.started_at))
+            .where(*same_pair, or_(sessions.ended_at.is_(None), sessions.ended_at >= replay_from))
+        )
+        if earliest is None or earliest >= replay_from:
+            break
+        replay_from = earliest
+
+    replaced = (
+        db.query(sessions)
+        .filter(*same_pair, or_(sessions.ended_at.is_(None), sessions.ended_at >= replay_from))
+        .with_for_update()
+        .all()
+    )
+    closed = [(s.lab_type, s.id) for s in replaced if s.status == "open"]
+    for session in replaced:
+        db.delete(session)
+
+    user_key = lookup_key(db, models.DimUser, user_id)
+    lab_type_key = lookup_key(db, models.DimLabType, lab_type)
+    session_event_keys = [
+        key for key in (lookup_key(db, models.DimEventType, name) for name in ("start", "complete")) if key is not None
+    ]
+    events = (
+        db.query(models.UsageEvent)
+        .filter(
+            models.UsageEvent.user_key == user_key,
+            models.UsageEvent.lab_type_key == lab_type_key,
+            models.UsageEvent.event_type_key.in_(session_event_keys),
+            models.UsageEvent.timestamp >= replay_from,
+        )
+        .order_by(models.UsageEvent.timestamp, models.UsageEvent.id)
+    )
+    open_sessions = []
+    created = []
+    for event in events:
+        new_session = _apply_session_event(open_sessions, event)
+        open_sessions = [s for s in open_sessions if s.status == "open"]
+        if new_session is not None:
+            open_sessions.append(new_session)
+            created.append(new_session)
+    db.add_all(created)
+    db.flush()
+    return [(s.lab_type, s.id) for s in created if s.status == "open"], closed
+
+# Apply committed session changes to the live occupancy counters
+def _update_occupancy(opened, closed):
+    for lab_type, session_id in closed:
+        occupancy.session_closed(lab_type, session_id)
+    for lab_type, session_id in opened:
+        occupancy.session_opened(lab_type, session_id)
+
+# Mark sessions open longer than the timeout as timed out
+def expire_sessions(db: Session) -> int:
+    sessions = models.LabSession
+    expired = (
+        db.query(sessions)
+        .filter(sessions.status == "open", sessions.started_at < datetime.now() - SESSION_TIMEOUT)
+        .update(
+            {"status": "timed_out", "ended_at": sessions.started_at + SESSION_TIMEOUT},
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return expired
+
+# Get (id, lab_type) of every open session
+def get_open_sessions(db: Session):
+    return (
+        db.query(models.LabSession.id, models.LabSession.lab_type)
+        .filter(models.LabSession.status == "open")
+        .all()
+    )
+
+# Get session counts and average completed session time for a lab type
+def get_session_stats(db: Session, lab_type: str, days: int = 7) -> Dict[str, float]:
+    cutoff_date = datetime.now() - timedelta(days=days)
+    sessions = models.LabSession
+    completed = sessions.status == "completed"
+    total, completed_count, avg_duration = (
+        db.query(
+            func.count(sessions.id),
+            func.count(sessions.id).filter(completed),
+            func.avg(sessions.duration_seconds).filter(completed),
+        )
+        .filter(sessions.lab_type == lab_type, sessions.started_at >= cutoff_date)
+        .one()
+    )
+    return {
+        "total_sessions": total,
+        "completed_sessions": completed_count,
+        "average_session_time_seconds": float(avg_duration or 0),
+    }
+
+# Sweep-line over session boundaries: for each lab and bucket, the highest number of
+# overlapping sessions and the net change in open sessions. Times are naive UTC.
+# Only sessions still running at the start of the range are read, through the ended_at and open-session indexes.
+_CONCURRENCY_SQL = """
+WITH spans AS (
+    SELECT lab_type,
+           started_at AS session_start,
+           COALESCE(ended_at, LEAST(started_at + :timeout, now())) AS session_end
+    FROM lab_sessions
+    WHERE started_at < :end_at
+      AND (ended_at > :start_at OR (status = 'open' AND started_at > :start_at - :timeout))
+      AND (CAST(:lab_type AS varchar) IS NULL OR lab_type = :lab_type)
+),
+boundaries AS (
+    SELECT lab_type, GREATEST(session_start, :start_at) AS ts, 1 AS delta
+    FROM spans WHERE session_end > :start_at AND session_end > session_start
+    UNION ALL
+    SELECT lab_type, session_end AS ts, -1 AS delta
+    FROM spans WHERE session_end > :start_at AND session_end > session_start AND session_end < :end_at
+),
+changes AS (
+    SELECT lab_type, ts, SUM(delta) AS delta
+    FROM boundaries
+    GROUP BY lab_type, ts
+),
+sweep AS (
+    SELECT lab_type, ts, delta,
+           SUM(delta) OVER (PARTITION BY lab_type ORDER BY ts ROWS UNBOUNDED PRECEDING) AS concurrent
+    FROM changes
+)
+SELECT lab_type,
+       date_trunc(:granularity, ts AT TIME ZONE 'UTC') AS bucket,
+       MIN(ts AT TIME ZONE 'UTC') AS first_boundary,
+       MAX(concurrent) AS peak,
+       SUM(delta) AS net_change
+FROM sweep
+GROUP BY lab_type, bucket
+"""
+
+# Get peak concurrent sessions per lab type for each bucket in [start, end)
+def get_peak_concurrency(
+    db: Session, start: datetime, end: datetime, granularity: str, step: timedelta, lab_type: Optional[str] = None
+) -> Dict[str, Dict[datetime, int]]:
+    rows = db.execute(
+        text(_CONCURRENCY_SQL),
+        {
+            "start_at": start.replace(tzinfo=timezone.utc),
+            "end_at": end.replace(tzinfo=timezone.utc),
+            "timeout": SESSION_TIMEOUT,
+            "granularity": granularity,
+            "lab_type": lab_type,
+        },
+    )
+    by_lab = {}
+    for row in rows:
+        by_lab.setdefault(row.lab_type, {})[row.bucket] = row
+
+    peaks = {}
+    for lab, buckets in by_lab.items():
+        level = 0  # Sessions open at the start of the current bucket
+        bucket = start
+        lab_peaks = peaks[lab] = {}
+        while bucket < end:
+            row = buckets.get(bucket)
+            if row is None:
+                lab_peaks[bucket] = level
+            elif row.first_boundary > bucket:
+                lab_peaks[bucket] = max(level, row.peak)
+            else:
+                # Boundaries at the bucket start already define the opening level
+                lab_peaks[bucket] = row.peak
+            if row is not None:
+                level += row.net_change
+            bucket += step
+    return peaks
+
+# Per (lab, UTC day): users who started, then hit an error and/or completed after their first start
+_FUNNEL_SQL = """
+WITH steps AS (
+    SELECT lab_type_key, user_key, event_type_key, timestamp,
+           CAST(timestamp AT TIME ZONE 'UTC' AS date) AS day,
+           MIN(timestamp) FILTER (WHERE event_type_key = :start_key)
+               OVER (PARTITION BY lab_type_key, user_key, CAST(timestamp AT TIME ZONE 'UTC' AS date)) AS first_start,
+           MIN(timestamp) FILTER (WHERE event_type_key = :error_key)
+               OVER (PARTITION BY lab_type_key, user_key, CAST(timestamp AT TIME ZONE 'UTC' AS date)) AS first_error
+    FROM usage_events
+    WHERE timestamp >= :start_at AND timestamp < :end_at
+      AND event_type_key IN (:start_key, :error_key, :complete_key)
+      AND (CAST(:lab_type_key AS smallint) IS NULL OR lab_type_key = :lab_type_key)
+)
+SELECT lab_type_key, day,
+       COUNT(DISTINCT user_key) FILTER (WHERE event_type_key = :start_key) AS started,
+       COUNT(DISTINCT user_key) FILTER (WHERE event_type_key = :error_key AND timestamp > first_start) AS errored,
+       COUNT(DISTINCT user_key) FILTER (WHERE event_type_key = :complete_key AND timestamp > first_start) AS completed,
+       COUNT(DISTINCT user_key) FILTER (
+           WHERE event_type_key = :complete_key AND timestamp > first_start
+             AND first_error > first_start AND timestamp > first_error
+       ) AS completed_after_error
+FROM steps
+GROUP BY lab_type_key, day
+"""
+
+# Get start -> error -> complete funnel counts per lab type for each UTC day in [start_day, end_day)
+def get_funnel(db: Session, start_day: date, end_day: date, lab_type: Optional[str] = None) -> Dict[date, Dict[str, Dict[str, int]]]:
+    lab_type_key = lookup_key(db, models.DimLabType, lab_type) if lab_type is not None else None
+    if lab_type is not None and lab_type_key is None:
+        return {}
+    rows = db.execute(
+        text(_FUNNEL_SQL),
+        {
+            "start_at": datetime.combine(start_day, datetime.min.time(), timezone.utc),
+            "end_at": datetime.combine(end_day, datetime.min.time(), timezone.utc),
+            "lab_type_key": lab_type_key,
+            "start_key": lookup_key(db, models.DimEventType, "start"),
+            "error_key": lookup_key(db, models.DimEventType, "error"),
+            "complete_key": lookup_key(db, models.DimEventType, "complete"),
+        },
+    )
+    funnel = {}
+    for row in rows:
+        funnel.setdefault(row.day, {})[decode(db, models.DimLabType, row.lab_type_key)] = {
+            "started": row.started,
+            "errored": row.errored,
+            "completed": row.completed,
+            "completed_after_error": row.completed_after_error,
+        }
+    return funnel
+
+# Active (user, UTC day) pairs with each user's first active day and a dense integer id for bitmaps
+_RETENTION_SQL = """
+WITH activity AS (
+    SELECT DISTINCT user_key, CAST(timestamp AT TIME ZONE 'UTC' AS date) AS day
+    FROM usage_events
+    WHERE timestamp < :end_at
+      AND (CAST(:lab_type_key AS smallint) IS NULL OR lab_type_key = :lab_type_key)
+),
+ranked AS (
+    SELECT day,
+           MIN(day) OVER (PARTITION BY user_key) AS cohort_day,
+           DENSE_RANK() OVER (ORDER BY user_key) AS uid
+    FROM activity
+)
+SELECT cohort_day, day, uid FROM ranked WHERE cohort_day >= :start_day
+"""
+
+# Build an integer bitset with the given (dense, non-negative) ids set
+def _bitmap(ids: List[int]) -> int:
+    bits = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+# Get day-N retention for cohorts of users first active on each UTC day in [start_day, end_day)
+def get_retention(db: Session, start_day: date, end_day: date, max_day: int, lab_type: Optional[str] = None) -> Dict[date, Dict]:
+    lab_type_key = lookup_key(db, models.DimLabType, lab_type) if lab_type is not None else None
+    if lab_type is not None and lab_type_key is None:
+        return {}
+    rows = db.execute(
+        text(_RETENTION_SQL),
+        {
+            "start_day": start_day,
+            "end_at": datetime.combine(end_day, datetime.min.time(), timezone.utc),
+            "lab_type_key": lab_type_key,
+        },
+    )
+    cohort_ids, active_ids = {}, {}
+    for row in rows:
+        active_ids.setdefault(row.day, []).append(row.uid)
+        if row.day == row.cohort_day:
+            cohort_ids.setdefault(row.cohort_day, []).append(row.uid)
+    # Per-day user bitmaps, so each cohort/day intersection is a single AND and popcount
+    cohorts = {day: _bitmap(ids) for day, ids in cohort_ids.items()}
+    active = {day: _bitmap(ids) for day, ids in active_ids.items()}
+
+    retention = {}
+    for cohort_day, cohort in cohorts.items():
+        retained = {}
+        for n in range(1, max_day + 1):
+            day = cohort_day + timedelta(days=n)
+            if day >= end_day:
+                break
+            retained[n] = (cohort & active.get(day, 0)).bit_count()
+        retention[cohort_day] = {"users": cohort.bit_count(), "retained": retained}
+    return retention
+
+# Rebuild sessions by replaying start/complete events when none exist yet (e.g. after upgrading)
+def backfill_sessions(db: Session) -> int:
+    if db.query(models.LabSession).first() is not None:
+        return 0
+
+    session_event_keys = [
+        key for key in (lookup_key(db, models.DimEventType, name) for name in ("start", "complete")) if key is not None
+    ]
+    events = (
+        db.query(models.UsageEvent)
+        .filter(models.UsageEvent.event_type_key.in_(session_event_keys))
+        .order_by(models.UsageEvent.timestamp, models.UsageEvent.id)
+    )
+    open_sessions = {}
+    created = []
+    for event in events.yield_per(10000):
+        user_lab = (event.user_id, event.lab_type)
+        candidates = open_sessions.get(user_lab, [])
+        new_session = _apply_session_event(candidates, event)
+        candidates = [s for s in candidates if s.status == "open"]
+        if new_session is not None:
+            candidates.append(new_session)
+            created.append(new_session)
+        open_sessions[user_lab] = candidates
+
+    db.add_all(created)
+    db.commit()
+    return len(created)
+
+# Distinct user sketch operations
+# UTC day of a stored timestamp; sketches are kept per UTC day and windows are measured from the current UTC time
+def utc_day(timestamp: datetime) -> date:
+    return timestamp.astimezone(timezone.utc).date()
+
+# Add a user to the (lab_type, day) sketch; only the affected register byte is written
+def update_user_sketch(db: Session, lab_type: str, day: date, user_id: str):
+    index, rank = HyperLogLog.position(user_id)
+    sketch = models.LabUserSketch
+    db.execute(
+        pg_insert(sketch)
+        .values(lab_type=lab_type, day=day, registers=bytes(HLL_REGISTERS))
+        .on_conflict_do_nothing(index_elements=["lab_type", "day"])
+    )
+    db.execute(
+        update(sketch)
+        .where(
+            sketch.lab_type == lab_type,
+            sketch.day == day,
+            func.get_byte(sketch.registers, index) < rank,
+        )
+        .values(registers=func.set_byte(sketch.registers, index, rank))
+    )
+
+# Estimate distinct users per lab type by merging the daily sketches covering the window
+def estimate_unique_users(db: Session, days: int, lab_type: Optional[str] = None) -> Dict[str, int]:
+    start_day = utc_day(datetime.now(timezone.utc) - timedelta(days=days))
+    query = db.query(models.LabUserSketch).filter(models.LabUserSketch.day >= start_day)
+    if lab_type is not None:
+        query = query.filter(models.LabUserSketch.lab_type == lab_type)
+
+    merged = {}
+    for sketch in query:
+        if sketch.lab_type in merged:
+            merged[sketch.lab_type].merge(HyperLogLog(sketch.registers))
+        else:
+            merged[sketch.lab_type] = HyperLogLog(sketch.registers)
+    return {lab: hll.count() for lab, hll in merged.items()}
+
+# Estimate distinct users per lab type for several trailing windows, merging each day's sketch once:
+# days are visited newest first and each window's estimate is read off the running union
+def estimate_unique_users_multi(db: Session, windows: List[int]) -> Dict[int, Dict[str, int]]:
+    now = datetime.now(timezone.utc)
+    start_days = {days: utc_day(now - timedelta(days=days)) for days in windows}
+    sketches = (
+        db.query(models.LabUserSketch)
+        .filter(models.LabUserSketch.day >= min(start_days.values()))
+        .order_by(models.LabUserSketch.lab_type, models.LabUserSketch.day.desc())
+    )
+    by_lab = {}
+    for sketch in sketches:
+        by_lab.setdefault(sketch.lab_type, []).append(sketch)
+
+    estimates = {days: {} for days in windows}
+    for lab_type, lab_sketches in by_lab.items():
+        merged, merged_count, i = HyperLogLog(), 0, 0
+        for days in sorted(windows):
+            while i < len(lab_sketches) and lab_sketches[i].day >= start_days[days]:
+                merged.merge(HyperLogLog(lab_sketches[i].registers))
+                merged_count, i = merged_count + 1, i + 1
+            if merged_count:
+                estimates[days][lab_type] = merged.count()
+    return estimates
+
+# Count distinct users per lab type exactly with COUNT(DISTINCT)
+def count_unique_users(db: Session, days: int, lab_type: Optional[str] = None) -> Dict[str, int]:
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
+    query = (
+        db.query(models.UsageEvent.lab_type_key, func.count(distinct(models.UsageEvent.user_key)))
+        .filter(models.UsageEvent.timestamp >= cutoff_date)
+    )
+    if lab_type is not None:
+        query = query.filter(models.UsageEvent.lab_type_key == lookup_key(db, models.DimLabType, lab_type))
+    counts = query.group_by(models.UsageEvent.lab_type_key).all()
+    return {decode(db, models.DimLabType, key): count for key, count in counts}
+
+# Get distinct users per lab type, approximately unless exact is requested
+def get_unique_users(db: Session, days: int, lab_type: Optional[str] = None, exact: bool = False) -> Dict[str, int]:
+    if exact:
+        return count_unique_users(db, days, lab_type)
+    return estimate_unique_users(db, days, lab_type)
+
+# Build the daily user sketches from raw events when none exist yet (e.g. after upgrading)
+def backfill_user_sketches(db: Session) -> int:
+    if db.query(models.LabUserSketch).first() is not None:
+        return 0
+
+    day = func.date(func.timezone("UTC", models.UsageEvent.timestamp))
+    rows = (
+        db.query(models.UsageEvent.lab_type_key, day, models.UsageEvent.user_key)
+        .filter(models.UsageEvent.validated)
+        .distinct()
+    )
+    sketches = {}
+    for lab_type_key, event_day, user_key in rows.yield_per(10000):
+        lab_type = decode(db, models.DimLabType, lab_type_key)
+        sketches.setdefault((lab_type, event_day), HyperLogLog()).add(decode(db, models.DimUser, user_key))
+
+    db.add_all(
+        models.LabUserSketch(lab_type=lab_type, day=event_day, registers=hll.to_bytes())
+        for (lab_type, event_day), hll in sketches.items()
+    )
+    db.commit()
+    return len(sketches)
+
+# Usage counter operations
+# Add delta events to the counter row with the given keys
+def _add_events(db: Session, table, keys: Dict, delta: int):
+    db.execute(
+        pg_insert(table)
+        .values(events=delta, **keys)
+        .on_conflict_do_update(index_elements=list(keys), set_={"events": table.events + delta})
+    )
+
+# Add the event counts buffered since the last flush to the hourly rollups and the hour-of-week heatmap,
+# in one transaction. Rows are upserted in key order, so concurrent flushes from other instances cannot
+# deadlock; on failure the counts are kept.
+def flush_usage_counters(db: Session) -> int:
+    pending = {key: delta for key, delta in pending_usage_counts.drain().items() if delta}
+    heatmap = {}
+    for (lab_type, hour), delta in pending.items():
+        key = (lab_type, hour.weekday(), hour.hour)
+        heatmap[key] = heatmap.get(key, 0) + delta
+    try:
+        for (lab_type, hour), delta in sorted(pending.items()):
+            _add_events(db, models.LabHourlyUsage, {"lab_type": lab_type, "hour": hour}, delta)
+        for (lab_type, dow, hour), delta in sorted(heatmap.items()):
+            _add_events(db, models.LabUsageHeatmap, {"lab_type": lab_type, "dow": dow, "hour": hour}, delta)
+        db.commit()
+    except Exception:
+        db.rollback()
+        pending_usage_counts.restore(pending)
+        raise
+    return len(pending)
+
+# Get the 7x24 (Monday first, UTC) event counts of a lab type; bounded by day from the hourly rollups,
+# otherwise from the all-time heatmap, including this instance's counts not yet flushed
+def get_usage_heatmap(db: Session, lab_type: str, start_day: Optional[date] = None, end_day: Optional[date] = None) -> List[List[int]]:
+    start_at = datetime.combine(start_day, datetime.min.time(), timezone.utc) if start_day is not None else None
+    end_at = datetime.combine(end_day, datetime.min.time(), timezone.utc) if end_day is not None else None
+    if start_day is None and end_day is None:
+        heatmap = models.LabUsageHeatmap
+        rows = (
+            db.query(heatmap.dow, heatmap.hour, heatmap.events)
+            .filter(heatmap.lab_type == lab_type)
+            .all()
+        )
+    else:
+        hourly = models.LabHourlyUsage
+        utc_hour = func.timezone("UTC", hourly.hour)
+        dow = (func.extract("isodow", utc_hour) - 1).label("dow")
+        hour = func.extract("hour", utc_hour).label("hour")
+        query = db.query(dow, hour, func.sum(hourly.events)).filter(hourly.lab_type == lab_type)
+        if start_at is not None:
+            query = query.filter(hourly.hour >= start_at)
+        if end_at is not None:
+            query = query.filter(hourly.hour < end_at)
+        rows = query.group_by(dow, hour).all()
+
+    grid = [[0] * 24 for _ in range(7)]
+    for dow, hour, events in rows:
+        grid[int(dow)][int(hour)] = int(events)
+    for hour, delta in pending_usage_counts.get(lab_type, start_at, end_at).items():
+        grid[hour.weekday()][hour.hour] += delta
+    return grid
+
+# Build the hourly rollups and the heatmap from raw events when none exist yet (e.g. after upgrading)
+def backfill_usage_counters(db: Session) -> int:
+    if db.query(models.LabHourlyUsage).first() is not None:
+        return 0
+
+    hourly = db.execute(text("""
+        INSERT INTO lab_hourly_usage (lab_type, hour, events)
+        SELECT l.value, date_trunc('hour', e.timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', COUNT(*)
+        FROM usage_events e JOIN dim_lab_types l ON l.id = e.lab_type_key
+        GROUP BY 1, 2
+    """)).rowcount
+    db.execute(text("DELETE FROM lab_usage_heatmap"))
+    db.execute(text("""
+        INSERT INTO lab_usage_heatmap (lab_type, dow, hour, events)
+        SELECT lab_type,
+               EXTRACT(isodow FROM hour AT TIME ZONE 'UTC') - 1,
+               EXTRACT(hour FROM hour AT TIME ZONE 'UTC'),
+               SUM(events)
+        FROM lab_hourly_usage
+        GROUP BY 1, 2, 3
+    """))
+    db.commit()
+    return hourly
+
+# Top user sketch operations
+# Merge the top user counts buffered since the last flush into the stored daily sketches. Sketches are locked
+# in key order, so concurrent flushes from other instances cannot deadlock; on failure the counts are kept.
+def flush_top_users(db: Session) -> int:
+    pending = pending_top_users.drain()
+    table = models.LabTopUserSketch
+    try:
+        for (lab_type, day), sketch in sorted(pending.items(), key=lambda item: item[0]):
+            db.execute(
+                pg_insert(table)
+                .values(lab_type=lab_type, day=day, counters={})
+                .on_conflict_do_nothing(index_elements=["lab_type", "day"])
+            )
+            row = db.query(table).filter(table.lab_type == lab_type, table.day == day).with_for_update().one()
+            row.counters = SpaceSaving(TOP_K_CAPACITY, row.counters).merge(sketch).to_dict()
+        db.commit()
+    except Exception:
+        db.rollback()
+        pending_top_users.restore(pending)
+        raise
+    return len(pending)
+
+# Estimate the k most active users of a lab type by merging the daily sketches covering the window,
+# including this instance's counts not yet flushed; returns (user_id, events, error) with events
+# overcounted by at most error
+def estimate_top_users(db: Session, lab_type: str, days: int, k: int) -> List[tuple]:
+    start_day = utc_day(datetime.now(timezone.utc) - timedelta(days=days))
+    table = models.LabTopUserSketch
+    merged = SpaceSaving(TOP_K_CAPACITY)
+    for row in db.query(table).filter(table.lab_type == lab_type, table.day >= start_day):
+        merged.merge(SpaceSaving(TOP_K_CAPACITY, row.counters))
+    for sketch in pending_top_users.get(lab_type, start_day):
+        merged.merge(sketch)
+    return merged.top(k)
+
+# Count the k most active users of a lab type exactly with GROUP BY
+def count_top_users(db: Session, lab_type: str, days: int, k: int) -> List[tuple]:
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
+    events = func.count(models.UsageEvent.id)
+    rows = (
+        db.query(models.UsageEvent.user_key, events)
+        .filter(
+            models.UsageEvent.lab_type_key == lookup_key(db, models.DimLabType, lab_type),
+            models.UsageEvent.timestamp >= cutoff_date,
+        )
+        .group_by(models.UsageEvent.user_key)
+        .order_by(events.desc())
+        .limit(k)
+        .all()
+    )
+    return [(decode(db, models.DimUser, user_key), count, 0) for user_key, count in rows]
+
+# Get the k most active users of a lab type, approximately unless exact is requested
+def get_top_users(db: Session, lab_type: str, days: int, k: int, exact: bool = False) -> List[tuple]:
+    if exact:
+        return count_top_users(db, lab_type, days, k)
+    return estimate_top_users(db, lab_type, days, k)
+
+# Build the daily top user sketches from raw events when none exist yet (e.g. after upgrading).
+# Users are added busiest first, so all but the last counter of each sketch hold exact counts.
+def backfill_top_users(db: Session) -> int:
+    if db.query(models.LabTopUserSketch).first() is not None:
+        return 0
+
+    day = func.date(func.timezone("UTC", models.UsageEvent.timestamp))
+    events = func.count(models.UsageEvent.id)
+    rows = (
+        db.query(models.UsageEvent.lab_type_key, day, models.UsageEvent.user_key, events)
+        .filter(models.UsageEvent.validated)
+        .group_by(models.UsageEvent.lab_type_key, day, models.UsageEvent.user_key)
+        .order_by(events.desc())
+    )
+    sketches = {}
+    for lab_type_key, event_day, user_key, count in rows.yield_per(10000):
+        lab_type = decode(db, models.DimLabType, lab_type_key)
+        sketch = sketches.setdefault((lab_type, event_day), SpaceSaving(TOP_K_CAPACITY))
+        sketch.add(decode(db, models.DimUser, user_key), count)
+
+    db.add_all(
+        models.LabTopUserSketch(lab_type=lab_type, day=event_day, counters=sketch.to_dict())
+        for (lab_type, event_day), sketch in sketches.items()
+    )
+    db.commit()
+    return len(sketches)
+
+# Archive operations
+# Latest UTC day before which events may be archived
+def latest_archive_day() -> date:
+    return datetime.now(timezone.utc).date() - timedelta(days=MAX_REPORT_DAYS + 1)
+
+# Move validated events recorded before a UTC day into Parquet files, one per day, recording each in the manifest.
+# Events awaiting deferred validation stay in PostgreSQL until validated.
+def archive_events(db: Session, before_day: date) -> List[models.EventArchive]:
+    cutoff = datetime.combine(before_day, datetime.min.time(), timezone.utc)
+    utc_day = func.date(func.timezone("UTC", models.UsageEvent.timestamp))
+    days = [
+        day for (day,) in
+        db.query(utc_day)
+        .filter(models.UsageEvent.timestamp < cutoff, models.UsageEvent.validated)
+        .distinct()
+        .order_by(utc_day)
+    ]
+
+    archived = []
+    for day in days:
+        start_at = datetime.combine(day, datetime.min.time(), timezone.utc)
+        end_at = start_at + timedelta(days=1)
+        in_day = (models.UsageEvent.timestamp >= start_at, models.UsageEvent.timestamp < end_at)
+        events = (
+            db.query(models.UsageEvent)
+            .options(selectinload(models.UsageEvent.payload))
+            .filter(*in_day, models.UsageEvent.validated)
+            .order_by(models.UsageEvent.id)
+            .all()
+        )
+        min_id, max_id = events[0].id, events[-1].id
+        path = archive.write_events(
+            ARCHIVE_DIR,
+            f"usage_events_{day.isoformat()}_{min_id}-{max_id}",
+            [
+                {**schemas.LabUsageEvent.model_validate(event).model_dump(), "event_data": get_event_data(event)}
+                for event in events
+            ],
+        )
+        entry = models.EventArchive(
+            path=path, start_at=start_at, end_at=end_at, min_id=min_id, max_id=max_id, row_count=len(events)
+        )
+        db.add(entry)
+        # Only the rows written out, not events of the day validated since they were read
+        db.query(models.UsageEvent).filter(
+            models.UsageEvent.id.in_([event.id for event in events])
+        ).delete(synchronize_session=False)
+        db.commit()
+        archived.append(entry)
+    return archived
+
+# Get the newest limit archived events in a time range, highest id first, from the files the manifest lists for it.
+# Files are scanned newest first, reading only ids, and stop once no older file can hold a newer event than
+# those found; only the events kept are then read in full.
+def get_archived_events(
+    db: Session,
+    start: datetime,
+    limit: int,
+    end: Optional[datetime] = None,
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    before_id: Optional[int] = None,
+    contains: Optional[Dict] = None,
+) -> List[schemas.LabUsageEvent]:
+    if not archive.archive_available():
+        return []
+    # Naive times are local, as with the live queries
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc) if end is not None else None
+    query = db.query(models.EventArchive.path, models.EventArchive.max_id).filter(models.EventArchive.end_at > start)
+    if end is not None:
+        query = query.filter(models.EventArchive.start_at < end)
+    if before_id is not None:
+        query = query.filter(models.EventArchive.min_id < before_id)
+
+    ids: List[int] = []
+    paths = []
+    for path, max_id in query.order_by(models.EventArchive.max_id.desc()):
+        if len(ids) == limit and max_id < ids[-1]:
+            break
+        if not os.path.exists(path):
+            raise archive.MissingArchiveFile(f"Archived events file {path} is missing from this instance")
+        found = archive.newest_event_ids([path], limit, lab_type, event_type, start, end, before_id, contains)
+        if found:
+            ids = sorted(ids + found, reverse=True)[:limit]
+            paths.append(path)
+    if not ids:
+        return []
+    rows = archive.read_events(paths, ids=ids)
+    return sorted((schemas.LabUsageEvent(**row) for row in rows), key=lambda e: e.id, reverse=True)
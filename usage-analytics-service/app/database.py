@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -10,6 +10,77 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Idempotent DDL bringing tables created by earlier versions up to date; create_all only adds missing tables
+SCHEMA_UPGRADES = [
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'usage_events' AND column_name = 'event_data') = 'json' THEN
+            ALTER TABLE usage_events ALTER COLUMN event_data TYPE JSONB USING event_data::jsonb;
+        END IF;
+    END $$
+    """,
+    # Move the user, lab type and event type strings into dimension tables, keeping integer keys on usage_events.
+    # The table is rebuilt rather than altered, since dropped columns keep their space until the rows are rewritten.
+    # create_all has already made usage_event_payloads, whose foreign key would follow the renamed table,
+    # so it is dropped first and pointed at the new table afterwards.
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'usage_events' AND column_name = 'user_id') THEN
+            INSERT INTO dim_users (value)
+                SELECT DISTINCT COALESCE(user_id, '') FROM usage_events ON CONFLICT DO NOTHING;
+            INSERT INTO dim_lab_types (value)
+                SELECT DISTINCT COALESCE(lab_type, '') FROM usage_events ON CONFLICT DO NOTHING;
+            INSERT INTO dim_event_types (value)
+                SELECT DISTINCT COALESCE(event_type, '') FROM usage_events ON CONFLICT DO NOTHING;
+
+            ALTER TABLE IF EXISTS usage_event_payloads DROP CONSTRAINT IF EXISTS usage_event_payloads_id_fkey;
+            ALTER TABLE usage_events RENAME TO usage_events_strings;
+            ALTER SEQUENCE usage_events_id_seq OWNED BY NONE;
+            CREATE TABLE usage_events (
+                id integer NOT NULL DEFAULT nextval('usage_events_id_seq'),
+                user_key integer NOT NULL REFERENCES dim_users (id),
+                lab_type_key smallint NOT NULL REFERENCES dim_lab_types (id),
+                event_type_key smallint NOT NULL REFERENCES dim_event_types (id),
+                event_data jsonb,
+                timestamp timestamp with time zone
+            );
+            INSERT INTO usage_events (id, user_key, lab_type_key, event_type_key, event_data, timestamp)
+                SELECT e.id, u.id, l.id, t.id, e.event_data, e.timestamp
+                FROM usage_events_strings e
+                JOIN dim_users u ON u.value = COALESCE(e.user_id, '')
+                JOIN dim_lab_types l ON l.value = COALESCE(e.lab_type, '')
+                JOIN dim_event_types t ON t.value = COALESCE(e.event_type, '');
+            DROP TABLE usage_events_strings;
+            ALTER SEQUENCE usage_events_id_seq OWNED BY usage_events.id;
+            ALTER TABLE usage_events ADD PRIMARY KEY (id);
+            IF to_regclass('usage_event_payloads') IS NOT NULL THEN
+                ALTER TABLE usage_event_payloads ADD CONSTRAINT usage_event_payloads_id_fkey
+                    FOREIGN KEY (id) REFERENCES usage_events (id) ON DELETE CASCADE;
+            END IF;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_usage_events_id ON usage_events (id)",
+    "CREATE INDEX IF NOT EXISTS ix_usage_events_user_key ON usage_events (user_key)",
+    "CREATE INDEX IF NOT EXISTS ix_usage_events_lab_type_key ON usage_events (lab_type_key)",
+    "CREATE INDEX IF NOT EXISTS ix_usage_events_event_data ON usage_events USING gin (event_data jsonb_path_ops)",
+    "ALTER TABLE usage_events ADD COLUMN IF NOT EXISTS event_id varchar",
+    "CREATE UNIQUE INDEX IF NOT EXISTS usage_events_event_id_key ON usage_events (event_id)",
+    "ALTER TABLE usage_events ADD COLUMN IF NOT EXISTS validated boolean NOT NULL DEFAULT true",
+    "CREATE INDEX IF NOT EXISTS ix_usage_events_unvalidated ON usage_events (id) WHERE NOT validated",
+    "ALTER TABLE usage_events ADD COLUMN IF NOT EXISTS payload_size integer",
+    "CREATE INDEX IF NOT EXISTS ix_lab_sessions_ended ON lab_sessions (ended_at)",
+]
+
+def upgrade_schema():
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
 def get_db():
     db = SessionLocal()
     try:
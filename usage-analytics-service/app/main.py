@@ -1,9 +1,34 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import engine, Base
+from app.database import engine, Base, SessionLocal, upgrade_schema
 from app.api import router as analytics_router
+from app import crud
+from app.utils.live import occupancy
+from app.utils.archive import archive_available
+from app.utils.service_client import ServiceClient
+
+# How often open sessions are expired and the live counters reconciled with the database
+LIVE_REFRESH_SECONDS = int(os.getenv("LIVE_REFRESH_SECONDS", "30"))
+
+# How often events recorded in deferred validation mode are checked, and how many per User Progress Service call
+VALIDATION_INTERVAL_SECONDS = int(os.getenv("VALIDATION_INTERVAL_SECONDS", "5"))
+VALIDATION_BATCH_SIZE = 500
+
+# How often the top user counts buffered at ingest are merged into the stored sketches
+TOP_USERS_FLUSH_SECONDS = int(os.getenv("TOP_USERS_FLUSH_SECONDS", "5"))
+
+# How often the hourly event counts buffered at ingest are added to the rollups and the heatmap
+USAGE_COUNTERS_FLUSH_SECONDS = int(os.getenv("USAGE_COUNTERS_FLUSH_SECONDS", "5"))
+
+# Events older than this many days are archived to Parquet once a day; unset disables archiving
+ARCHIVE_AFTER_DAYS = os.getenv("ARCHIVE_AFTER_DAYS")
+ARCHIVE_INTERVAL_SECONDS = 24 * 60 * 60
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema()
 
 app = FastAPI(title="Usage Analytics Service")
 
@@ -18,6 +43,172 @@ app.add_middleware(
 # Include the router without a prefix to match test expectations
 app.include_router(analytics_router)
 
+# Build ingest-time aggregates for events recorded before they existed
+@app.on_event("startup")
+def backfill_aggregates():
+    db = SessionLocal()
+    try:
+        crud.backfill_user_sketches(db)
+        crud.backfill_sessions(db)
+        crud.backfill_usage_counters(db)
+        crud.backfill_top_users(db)
+    finally:
+        db.close()
+
+# Seed the duplicate filter used for idempotent ingest
+@app.on_event("startup")
+def load_seen_event_ids():
+    db = SessionLocal()
+    try:
+        crud.load_seen_event_ids(db)
+    finally:
+        db.close()
+
+# Persist session timeouts and rebuild the live occupancy counters from the open sessions
+def refresh_live_occupancy():
+    db = SessionLocal()
+    try:
+        crud.expire_sessions(db)
+        occupancy.load(crud.get_open_sessions(db))
+    finally:
+        db.close()
+
+async def refresh_live_occupancy_periodically():
+    while True:
+        await asyncio.sleep(LIVE_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(refresh_live_occupancy)
+        except Exception as e:
+            print(f"Error refreshing live occupancy: {e}")
+
+@app.on_event("startup")
+async def start_live_occupancy():
+    await asyncio.to_thread(refresh_live_occupancy)
+    app.state.live_refresh_task = asyncio.create_task(refresh_live_occupancy_periodically())
+
+# Merge the buffered top user counts into the stored sketches
+def flush_top_users():
+    db = SessionLocal()
+    try:
+        crud.flush_top_users(db)
+    finally:
+        db.close()
+
+async def flush_top_users_periodically():
+    while True:
+        await asyncio.sleep(TOP_USERS_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_top_users)
+        except Exception as e:
+            print(f"Error flushing top users: {e}")
+
+@app.on_event("startup")
+async def start_top_users_flush():
+    app.state.top_users_flush_task = asyncio.create_task(flush_top_users_periodically())
+
+# Write out the counts buffered since the last flush
+@app.on_event("shutdown")
+def flush_top_users_on_shutdown():
+    flush_top_users()
+
+# Add the buffered hourly event counts to the rollups and the heatmap
+def flush_usage_counters():
+    db = SessionLocal()
+    try:
+        crud.flush_usage_counters(db)
+    finally:
+        db.close()
+
+async def flush_usage_counters_periodically():
+    while True:
+        await asyncio.sleep(USAGE_COUNTERS_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_usage_counters)
+        except Exception as e:
+            print(f"Error flushing usage counters: {e}")
+
+@app.on_event("startup")
+async def start_usage_counters_flush():
+    app.state.usage_counters_flush_task = asyncio.create_task(flush_usage_counters_periodically())
+
+# Write out the counts buffered since the last flush
+@app.on_event("shutdown")
+def flush_usage_counters_on_shutdown():
+    flush_usage_counters()
+
+# Check events recorded in deferred mode in batches, quarantining those with an unknown user or lab type.
+# Each batch is claimed with its rows locked until it is finished, so several instances never check the same events.
+# Events stay pending while the User Progress Service cannot answer.
+async def validate_deferred_events():
+    db = SessionLocal()
+    try:
+        while True:
+            events = await asyncio.to_thread(crud.claim_unvalidated_events, db, VALIDATION_BATCH_SIZE)
+            if not events:
+                return
+            checks = [(e, e.user_id, e.lab_type) for e in events]
+            users = await ServiceClient.find_existing_users(sorted({user_id for _, user_id, _ in checks}))
+            lab_types = await ServiceClient.find_existing_lab_types(sorted({lab_type for _, _, lab_type in checks}))
+            if users is None or lab_types is None:
+                return
+
+            valid, rejected = [], []
+            for event, user_id, lab_type in checks:
+                if user_id not in users:
+                    rejected.append((event, "User not found"))
+                elif lab_type not in lab_types:
+                    rejected.append((event, "Lab type not found"))
+                else:
+                    valid.append(event)
+            await asyncio.to_thread(crud.finish_validation, db, valid, rejected)
+            if len(events) < VALIDATION_BATCH_SIZE:
+                return
+    finally:
+        # Releases the claim on a batch left unfinished
+        db.close()
+
+async def validate_deferred_events_periodically():
+    while True:
+        try:
+            await validate_deferred_events()
+        except Exception as e:
+            print(f"Error validating deferred events: {e}")
+        await asyncio.sleep(VALIDATION_INTERVAL_SECONDS)
+
+# Events left unvalidated by an earlier deferred-mode run are checked in either mode
+@app.on_event("startup")
+async def start_deferred_validation():
+    app.state.validation_task = asyncio.create_task(validate_deferred_events_periodically())
+
+# Move events past the retention window into the archive
+def archive_old_events():
+    db = SessionLocal()
+    try:
+        before = (datetime.utcnow() - timedelta(days=int(ARCHIVE_AFTER_DAYS))).date()
+        crud.archive_events(db, before)
+    finally:
+        db.close()
+
+async def archive_old_events_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(archive_old_events)
+        except Exception as e:
+            print(f"Error archiving events: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_archiving():
+    if ARCHIVE_AFTER_DAYS is None:
+        return
+    if not archive_available():
+        print("ARCHIVE_AFTER_DAYS is set but pyarrow is not installed; events will not be archived")
+        return
+    if int(ARCHIVE_AFTER_DAYS) <= crud.MAX_REPORT_DAYS:
+        print(f"ARCHIVE_AFTER_DAYS must be more than {crud.MAX_REPORT_DAYS}, the longest report window; events will not be archived")
+        return
+    app.state.archive_task = asyncio.create_task(archive_old_events_periodically())
+
 # Add a root path handler to avoid 404 on root path
 @app.get("/")
 async def root():
@@ -26,7 +217,19 @@ async def root():
         "status": "running",
         "endpoints": [
             "/analytics/event",
+            "/analytics/events",
+            "/analytics/events/changes",
             "/analytics/usage/lab/{lab_type}",
-            "/analytics/trends"
+            "/analytics/usage/labs",
+            "/analytics/trends",
+            "/analytics/trends/multi",
+            "/analytics/concurrency",
+            "/analytics/funnel",
+            "/analytics/retention",
+            "/analytics/heatmap/{lab_type}",
+            "/analytics/top-users/{lab_type}",
+            "/analytics/archive",
+            "/analytics/live",
+            "/analytics/live/stream"
         ]
     }
@@ -1,15 +1,176 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import Boolean, Column, Integer, SmallInteger, String, DateTime, Date, Float, LargeBinary, Index, ForeignKey, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
 
 
-# Define the UsageEvent model
+# Dimension tables mapping the repeated strings of usage_events to small surrogate keys
+class DimUser(Base):
+    __tablename__ = "dim_users"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)  # Reference to User in User Progress Service
+
+
+class DimLabType(Base):
+    __tablename__ = "dim_lab_types"
+
+    id = Column(SmallInteger, primary_key=True)
+    value = Column(String, nullable=False, unique=True)  # Reference to Lab type in User Progress Service
+
+
+class DimEventType(Base):
+    __tablename__ = "dim_event_types"
+
+    id = Column(SmallInteger, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+# Define the UsageEvent model; user, lab type and event type are stored as dimension keys
 class UsageEvent(Base):
     __tablename__ = "usage_events"
+    __table_args__ = (
+        Index(
+            "ix_usage_events_event_data",
+            "event_data",
+            postgresql_using="gin",
+            postgresql_ops={"event_data": "jsonb_path_ops"},
+        ),
+        Index("ix_usage_events_unvalidated", "id", postgresql_where=text("NOT validated")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, index=True)  # Reference to User in User Progress Service
-    lab_type = Column(String, index=True)  # Reference to Lab type in User Progress Service
-    event_type = Column(String)
-    event_data = Column(JSON, default={})
+    event_id = Column(String, nullable=True, unique=True)  # Client-generated id for idempotent retries
+    user_key = Column(Integer, ForeignKey("dim_users.id"), nullable=False, index=True)
+    lab_type_key = Column(SmallInteger, ForeignKey("dim_lab_types.id"), nullable=False, index=True)
+    event_type_key = Column(SmallInteger, ForeignKey("dim_event_types.id"), nullable=False)
+    event_data = Column(JSONB, default={})
     timestamp = Column(DateTime(timezone=True), default=func.now())
+    validated = Column(Boolean, nullable=False, default=True, server_default=text("true"))  # False until checked in deferred mode
+    payload_size = Column(Integer, nullable=True)  # Size of the full event_data when it is kept compressed in usage_event_payloads
+
+    user_dim = relationship(DimUser, lazy="joined", innerjoin=True)
+    lab_type_dim = relationship(DimLabType, lazy="joined", innerjoin=True)
+    event_type_dim = relationship(DimEventType, lazy="joined", innerjoin=True)
+    payload = relationship("EventPayload", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
+    @property
+    def user_id(self) -> str:
+        return self.user_dim.value
+
+    @property
+    def lab_type(self) -> str:
+        return self.lab_type_dim.value
+
+    @property
+    def event_type(self) -> str:
+        return self.event_type_dim.value
+
+
+# Compressed event_data of events whose payload is over the size threshold; only its short fields stay in usage_events
+class EventPayload(Base):
+    __tablename__ = "usage_event_payloads"
+
+    id = Column(Integer, ForeignKey("usage_events.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String, nullable=False)  # See app.utils.compression
+    data = Column(LargeBinary, nullable=False)
+
+
+# Events that failed deferred validation, removed from usage_events
+class QuarantinedEvent(Base):
+    __tablename__ = "quarantined_events"
+
+    id = Column(Integer, primary_key=True)  # The id the event had in usage_events
+    event_id = Column(String)
+    user_id = Column(String, nullable=False)
+    lab_type = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)
+    event_data = Column(JSONB)
+    timestamp = Column(DateTime(timezone=True))
+    reason = Column(String, nullable=False)
+    quarantined_at = Column(DateTime(timezone=True), default=func.now())
+
+
+# Usage events edited, deleted or quarantined after being recorded, so that every instance drops its cached
+# reports of the periods they fall in
+class EventEdit(Base):
+    __tablename__ = "usage_event_edits"
+
+    id = Column(Integer, primary_key=True)
+    lab_type = Column(String, nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False)  # When the edited event happened
+    edited_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+# Manifest of Parquet files holding usage events moved out of usage_events
+class EventArchive(Base):
+    __tablename__ = "usage_event_archives"
+    __table_args__ = (Index("ix_usage_event_archives_range", "start_at", "end_at"),)
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    start_at = Column(DateTime(timezone=True), nullable=False)  # Events with start_at <= timestamp < end_at
+    end_at = Column(DateTime(timezone=True), nullable=False)
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), default=func.now())
+
+
+# HyperLogLog sketch of the distinct users seen per lab type per day
+class LabUserSketch(Base):
+    __tablename__ = "lab_user_sketches"
+
+    lab_type = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)  # See app.utils.sketches.HyperLogLog
+
+
+# Space-Saving sketch of the most active users per lab type per day
+class LabTopUserSketch(Base):
+    __tablename__ = "lab_top_user_sketches"
+
+    lab_type = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    counters = Column(JSONB, nullable=False, default={})  # See app.utils.sketches.SpaceSaving
+
+
+# Events per lab type per UTC hour, maintained at ingest
+class LabHourlyUsage(Base):
+    __tablename__ = "lab_hourly_usage"
+
+    lab_type = Column(String, primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)  # Start of the UTC hour
+    events = Column(Integer, nullable=False, default=0)
+
+
+# All-time events per lab type per UTC hour of the week, maintained at ingest
+class LabUsageHeatmap(Base):
+    __tablename__ = "lab_usage_heatmap"
+
+    lab_type = Column(String, primary_key=True)
+    dow = Column(SmallInteger, primary_key=True)  # 0 = Monday ... 6 = Sunday
+    hour = Column(SmallInteger, primary_key=True)  # 0 - 23
+    events = Column(Integer, nullable=False, default=0)
+
+
+# A lab session built from 'start' and 'complete' events at ingest time
+class LabSession(Base):
+    __tablename__ = "lab_sessions"
+    __table_args__ = (
+        Index("ix_lab_sessions_lab_started", "lab_type", "started_at"),
+        Index("ix_lab_sessions_ended", "ended_at"),
+        Index("ix_lab_sessions_open", "user_id", "lab_type", postgresql_where=text("status = 'open'")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    lab_type = Column(String, nullable=False)
+    session_key = Column(String, nullable=True)  # event_data["session_id"] when the client sends one
+    status = Column(String, nullable=False, default="open")  # open, completed, abandoned or timed_out
+    start_event_id = Column(Integer)
+    end_event_id = Column(Integer)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True))
+    duration_seconds = Column(Float)  # Only set for completed sessions
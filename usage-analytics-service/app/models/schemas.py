@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 
 # Lab Usage Event schemas
@@ -9,6 +9,7 @@ class LabUsageEventBase(BaseModel):
     lab_type: str
     event_type: str
     event_data: Optional[Dict] = {}
+    event_id: Optional[str] = None  # Client-generated id; retries with the same id are recorded once
 
 
 # LabUsageEventCreate schema for creating a new lab usage event
@@ -20,5 +21,12 @@ class LabUsageEventCreate(LabUsageEventBase):
 class LabUsageEvent(LabUsageEventBase):
     id: int
     timestamp: datetime
+    payload_size: Optional[int] = None  # Set when event_data holds only the short fields of a large payload
 
     model_config = ConfigDict(from_attributes=True)
+
+
+# One page of events from a filtered event query; pass next_cursor back as cursor for the next page
+class LabUsageEventPage(BaseModel):
+    events: List[LabUsageEvent]
+    next_cursor: Optional[int] = None
@@ -0,0 +1,140 @@
+import heapq
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Archiving is unavailable without pyarrow
+    pa = ds = pq = None
+
+# Columns of an archived event; event_data is kept as JSON text
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("event_id", pa.string()),
+    ("user_id", pa.string()),
+    ("lab_type", pa.string()),
+    ("event_type", pa.string()),
+    ("event_data", pa.string()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+]) if pa is not None else None
+
+
+# Raised when a file the archive manifest lists cannot be read, e.g. when the archive directory is not shared
+class MissingArchiveFile(Exception):
+    pass
+
+
+def archive_available() -> bool:
+    return pa is not None
+
+
+# Write events (dicts in the LabUsageEvent shape, ordered by id) to a zstd-compressed Parquet file.
+# The file is written under a temporary name and renamed, so readers never see a partial file.
+def write_events(directory: str, name: str, events: List[Dict]) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.parquet")
+    rows = [{**event, "event_data": json.dumps(event.get("event_data") or {})} for event in events]
+    table = pa.Table.from_pylist(rows, schema=ARCHIVE_SCHEMA)
+    pq.write_table(table, f"{path}.tmp", compression="zstd")
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+# Filter expression for the Parquet scan, so row groups outside it are skipped
+def _condition(
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    ids: Optional[List[int]] = None,
+):
+    conditions = []
+    if lab_type is not None:
+        conditions.append(ds.field("lab_type") == lab_type)
+    if event_type is not None:
+        conditions.append(ds.field("event_type") == event_type)
+    if start is not None:
+        conditions.append(ds.field("timestamp") >= pa.scalar(start, ARCHIVE_SCHEMA.field("timestamp").type))
+    if end is not None:
+        conditions.append(ds.field("timestamp") < pa.scalar(end, ARCHIVE_SCHEMA.field("timestamp").type))
+    if before_id is not None:
+        conditions.append(ds.field("id") < before_id)
+    if ids is not None:
+        conditions.append(ds.field("id").isin(ids))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return condition
+
+
+# Ids of the newest limit archived events matching the filters, highest first. Only the id column is read,
+# with event_data when contains (matched as with JSONB @>) is given, one record batch at a time.
+def newest_event_ids(
+    paths: List[str],
+    limit: int,
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    contains: Optional[Dict] = None,
+) -> List[int]:
+    if not paths:
+        return []
+    dataset = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format="parquet")
+    batches = dataset.to_batches(
+        columns=["id", "event_data"] if contains else ["id"],
+        filter=_condition(lab_type, event_type, start, end, before_id),
+    )
+    newest: List[int] = []  # Min-heap of the ids kept so far
+    for batch in batches:
+        ids = batch.column("id").to_pylist()
+        if contains:
+            documents = batch.column("event_data").to_pylist()
+            ids = [i for i, document in zip(ids, documents) if json_contains(json.loads(document), contains)]
+        for i in ids:
+            if len(newest) < limit:
+                heapq.heappush(newest, i)
+            elif i > newest[0]:
+                heapq.heapreplace(newest, i)
+    return sorted(newest, reverse=True)
+
+
+# Read archived events, pushing the filters and columns down to the Parquet scan
+def read_events(
+    paths: List[str],
+    lab_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    ids: Optional[List[int]] = None,
+    columns: Optional[List[str]] = None,
+) -> List[Dict]:
+    if not paths:
+        return []
+    dataset = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format="parquet")
+    condition = _condition(lab_type, event_type, start, end, before_id, ids)
+    events = dataset.to_table(columns=columns, filter=condition).to_pylist()
+    for event in events:
+        if "event_data" in event:
+            event["event_data"] = json.loads(event["event_data"])
+    return events
+
+
+# JSONB containment (@>) for decoded JSON values
+def json_contains(document, subset) -> bool:
+    if isinstance(subset, dict):
+        return isinstance(document, dict) and all(
+            key in document and json_contains(document[key], value) for key, value in subset.items()
+        )
+    if isinstance(subset, list):
+        if not isinstance(document, list):
+            return False
+        return all(any(json_contains(item, wanted) for item in document) for wanted in subset)
+    return document == subset
@@ -0,0 +1,57 @@
+import hashlib
+import math
+import threading
+from typing import List, Tuple
+
+
+# Two independent 64-bit hashes for double hashing (Kirsch and Mitzenmacher)
+def _hash_pair(value: str) -> Tuple[int, int]:
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+
+
+# Fixed-size Bloom filter sized for a capacity and false positive rate
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        h1, h2 = _hash_pair(value)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+# Bloom filter that grows by adding larger filters with tighter error rates as each one fills
+# (Almeida et al., "Scalable Bloom Filters"), keeping the overall false positive rate below error_rate
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity: int = 100000, error_rate: float = 0.001, growth: int = 2, tightening: float = 0.5):
+        self.growth = growth
+        self.tightening = tightening
+        self._lock = threading.Lock()
+        self._filters: List[BloomFilter] = [BloomFilter(initial_capacity, error_rate * (1 - tightening))]
+
+    def add(self, value: str):
+        with self._lock:
+            current = self._filters[-1]
+            if current.count >= current.capacity:
+                current = BloomFilter(current.capacity * self.growth, current.error_rate * self.tightening)
+                self._filters.append(current)
+            current.add(value)
+
+    def __contains__(self, value: str) -> bool:
+        return any(value in f for f in self._filters)
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self._filters)
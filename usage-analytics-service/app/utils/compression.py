@@ -0,0 +1,50 @@
+import json
+import zlib
+from typing import Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Payloads are compressed with zlib without zstandard
+    zstandard = None
+
+# Top-level values of a moved payload that stay inline, so session tracking and containment
+# searches on short fields keep working: numbers, booleans, nulls and strings up to this length
+MAX_INLINE_STRING = 128
+
+
+def _encode(payload: Dict) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+# Serialized size of a payload in bytes
+def payload_size(payload: Optional[Dict]) -> int:
+    return len(_encode(payload or {}))
+
+
+# Compress a payload; returns the codec name and the compressed bytes
+def compress(payload: Dict) -> Tuple[str, bytes]:
+    raw = _encode(payload)
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> Dict:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed payloads")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        raw = zlib.decompress(data)
+    else:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    return json.loads(raw)
+
+
+# The short top-level fields of a payload that stay in usage_events when the payload is moved out
+def inline_fields(payload: Dict) -> Dict:
+    return {
+        key: value for key, value in payload.items()
+        if value is None or isinstance(value, (bool, int, float))
+        or (isinstance(value, str) and len(value) <= MAX_INLINE_STRING)
+    }
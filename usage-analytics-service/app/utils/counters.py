@@ -0,0 +1,38 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+
+# Event count changes per (lab_type, UTC hour) made by this process and not yet added to the hourly rollups
+# and the heatmap. Ingest only updates memory; a periodic flush adds the totals to the stored counters, so
+# concurrent events of a lab do not queue on the same counter rows.
+class PendingUsageCounts:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, datetime], int] = {}
+
+    def add(self, lab_type: str, timestamp: datetime, delta: int):
+        hour = timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            self._counts[(lab_type, hour)] = self._counts.get((lab_type, hour), 0) + delta
+
+    # Buffered count changes of a lab type per hour, for hours in [start, end) when bounded
+    def get(self, lab_type: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[datetime, int]:
+        with self._lock:
+            return {
+                hour: delta
+                for (lab, hour), delta in self._counts.items()
+                if lab == lab_type and (start is None or hour >= start) and (end is None or hour < end)
+            }
+
+    # Take all buffered count changes, leaving the buffer empty
+    def drain(self) -> Dict[Tuple[str, datetime], int]:
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+    # Put back count changes that could not be flushed
+    def restore(self, counts: Dict[Tuple[str, datetime], int]):
+        with self._lock:
+            for key, delta in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + delta
@@ -0,0 +1,22 @@
+import threading
+from typing import Dict, Optional
+
+
+# In-process two-way map between the strings of one dimension and their surrogate keys.
+# Keys never change once assigned, so entries never need invalidating.
+class DimensionDictionary:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: Dict[str, int] = {}
+        self._values: Dict[int, str] = {}
+
+    def key(self, value: str) -> Optional[int]:
+        return self._keys.get(value)
+
+    def value(self, key: int) -> Optional[str]:
+        return self._values.get(key)
+
+    def add(self, key: int, value: str):
+        with self._lock:
+            self._keys[value] = key
+            self._values[key] = value
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Bound on undelivered deltas per stream subscriber; slow subscribers miss deltas beyond this
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# In-memory count of active lab sessions per lab type, with delta fan-out to stream subscribers
+class LiveOccupancy:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[str, Set[int]] = {}  # lab_type -> open session ids
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+
+    # Current active session count per lab type
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {lab_type: len(sessions) for lab_type, sessions in self._active.items() if sessions}
+
+    def session_opened(self, lab_type: str, session_id: int):
+        with self._lock:
+            sessions = self._active.setdefault(lab_type, set())
+            if session_id in sessions:
+                return
+            sessions.add(session_id)
+            active = len(sessions)
+        self._publish(lab_type, active, 1)
+
+    def session_closed(self, lab_type: str, session_id: int):
+        with self._lock:
+            sessions = self._active.get(lab_type, set())
+            if session_id not in sessions:
+                return
+            sessions.discard(session_id)
+            active = len(sessions)
+        self._publish(lab_type, active, -1)
+
+    # Replace the counters with the persisted open sessions, publishing any differences
+    def load(self, open_sessions: Iterable[Tuple[int, str]]):
+        active: Dict[str, Set[int]] = {}
+        for session_id, lab_type in open_sessions:
+            active.setdefault(lab_type, set()).add(session_id)
+        with self._lock:
+            previous = {lab_type: len(sessions) for lab_type, sessions in self._active.items()}
+            self._active = active
+        for lab_type in set(previous) | set(active):
+            before, after = previous.get(lab_type, 0), len(active.get(lab_type, ()))
+            if before != after:
+                self._publish(lab_type, after, after - before)
+
+    # Register a stream subscriber on the running event loop
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+
+    def _publish(self, lab_type: str, active: int, delta: int):
+        message = {"lab_type": lab_type, "active": active, "delta": delta}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(_offer, queue, message)
+
+
+def _offer(queue: asyncio.Queue, message: Dict):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+# Process-wide occupancy counters, fed by session changes at ingest
+occupancy = LiveOccupancy()
+
+
+# Wakes requests long-polling for new events when one is recorded in this process
+class EventNotifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    # Wait up to timeout seconds for notify(); returns whether it was called
+    async def wait(self, timeout: float) -> bool:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+# Process-wide notifier for the event change feed, fed by ingest
+new_events = EventNotifier()
+
+
+# Shape of a server-sent event
+def format_sse(event: str, data: str) -> str:
+    lines = [f"event: {event}"] + [f"data: {line}" for line in data.splitlines() or [""]]
+    return "\n".join(lines) + "\n\n"
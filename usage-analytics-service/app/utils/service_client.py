@@ -1,6 +1,6 @@
 import httpx
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set
 
 # Fix the default service URL to match the docker-compose service name
 USER_SERVICE_URL = os.getenv("USER_PROGRESS_SERVICE_URL", "http://user-progress:8000")
@@ -44,3 +44,40 @@ class ServiceClient:
     async def validate_lab_exists(lab_type: str) -> bool:
         labs = await ServiceClient.get_lab(lab_type)
         return labs is not None and len(labs) > 0
+
+    # Find which of a batch of user IDs exist; None if the User Progress Service could not answer
+    @staticmethod
+    async def find_existing_users(user_ids: List[str]) -> Optional[Set[str]]:
+        return await ServiceClient._find_existing(
+            "/users/exists", user_ids, lambda user_id: f"/users/{user_id}", lambda body: True
+        )
+
+    # Find which of a batch of lab types have labs; None if the User Progress Service could not answer
+    @staticmethod
+    async def find_existing_lab_types(lab_types: List[str]) -> Optional[Set[str]]:
+        return await ServiceClient._find_existing(
+            "/labs/types/exists", lab_types, lambda lab_type: f"/labs/type/{lab_type}", lambda labs: len(labs) > 0
+        )
+
+    # Ask the batch endpoint, falling back to one lookup per id on services that predate it
+    @staticmethod
+    async def _find_existing(batch_path: str, ids: List[str], item_path, found) -> Optional[Set[str]]:
+        async with httpx.AsyncClient() as client:
+            try:
+                response = await client.post(f"{USER_SERVICE_URL}{batch_path}", json={"ids": ids})
+                if response.status_code == 200:
+                    return set(response.json()["existing"])
+                if response.status_code not in (404, 405):
+                    return None
+
+                existing = set()
+                for item in ids:
+                    response = await client.get(f"{USER_SERVICE_URL}{item_path(item)}")
+                    if response.status_code == 200 and found(response.json()):
+                        existing.add(item)
+                    elif response.status_code not in (200, 404):
+                        return None
+                return existing
+            except httpx.RequestError as e:
+                print(f"Error connecting to User Progress Service: {e}")
+                return None
@@ -0,0 +1,153 @@
+import hashlib
+import math
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# HyperLogLog precision: 2^12 = 4096 one-byte registers per sketch (4 KiB).
+# The relative standard error is 1.04 / sqrt(4096) ~= 1.6%, so roughly 95% of
+# estimates fall within +/-3.25% of the true distinct count.
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_STANDARD_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+
+_HASH_BITS = 64
+_RANK_BITS = _HASH_BITS - HLL_PRECISION
+
+
+# Stable 64-bit hash; Python's built-in hash() is salted per process
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# Mergeable distinct-count sketch (Flajolet et al. HyperLogLog)
+class HyperLogLog:
+    def __init__(self, registers: Optional[bytes] = None):
+        if registers is None:
+            self.registers = bytearray(HLL_REGISTERS)
+        elif len(registers) != HLL_REGISTERS:
+            raise ValueError(f"Expected {HLL_REGISTERS} registers, got {len(registers)}")
+        else:
+            self.registers = bytearray(registers)
+
+    # Register index and rank (position of the leftmost 1-bit) for a value
+    @staticmethod
+    def position(value: str) -> Tuple[int, int]:
+        x = _hash64(value)
+        index = x >> _RANK_BITS
+        rest = x & ((1 << _RANK_BITS) - 1)
+        return index, _RANK_BITS - rest.bit_length() + 1
+
+    def add(self, value: str) -> bool:
+        index, rank = self.position(value)
+        if self.registers[index] < rank:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values: Iterable[str]):
+        for value in values:
+            self.add(value)
+
+    # In-place union with another sketch (register-wise max)
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = HLL_REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Small-range correction: linear counting is more accurate here
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+# Counters kept per top-k sketch; users with more than 1/TOP_K_CAPACITY of a lab's events are never dropped
+TOP_K_CAPACITY = 200
+
+
+# Heavy-hitters sketch (Metwally et al. Space-Saving) holding at most capacity [count, error] counters,
+# where count overestimates an item's true count by at most error
+class SpaceSaving:
+    def __init__(self, capacity: int = TOP_K_CAPACITY, counters: Optional[Dict[str, List[int]]] = None):
+        self.capacity = capacity
+        self.counters: Dict[str, List[int]] = {item: list(counter) for item, counter in (counters or {}).items()}
+
+    # Smallest count, which bounds the count of any item not in a full sketch
+    def min_count(self) -> int:
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def add(self, item: str, count: int = 1):
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            # Replace the smallest counter; its count becomes the new item's possible overcount
+            evicted = min(self.counters, key=lambda i: self.counters[i][0])
+            floor = self.counters.pop(evicted)[0]
+            self.counters[item] = [floor + count, floor]
+
+    # Union with another sketch (Cafaro et al.); items missing from one side are charged its minimum
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        own_floor, other_floor = self.min_count(), other.min_count()
+        combined = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, (own_floor, own_floor))
+            other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+            combined[item] = [count + other_count, error + other_error]
+        kept = sorted(combined, key=lambda i: combined[i][0], reverse=True)[:self.capacity]
+        self.counters = {item: combined[item] for item in kept}
+        return self
+
+    # The k largest (item, count, error) triples, largest first
+    def top(self, k: int) -> List[Tuple[str, int, int]]:
+        items = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:k]
+        return [(item, count, error) for item, (count, error) in items]
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return {item: list(counter) for item, counter in self.counters.items()}
+
+
+# Top user counts recorded by this process and not yet merged into the stored sketches, per (lab_type, day).
+# Each event is counted in memory; a periodic flush merges the buffered sketches into the database.
+class PendingTopUsers:
+    def __init__(self, capacity: int = TOP_K_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._sketches: Dict[Tuple[str, date], SpaceSaving] = {}
+
+    def add(self, lab_type: str, day: date, user_id: str, count: int = 1):
+        with self._lock:
+            self._sketches.setdefault((lab_type, day), SpaceSaving(self.capacity)).add(user_id, count)
+
+    # Copies of the buffered sketches of a lab type from start_day on
+    def get(self, lab_type: str, start_day: date) -> List[SpaceSaving]:
+        with self._lock:
+            return [
+                SpaceSaving(self.capacity, sketch.counters)
+                for (lab, day), sketch in self._sketches.items()
+                if lab == lab_type and day >= start_day
+            ]
+
+    # Take all buffered sketches, leaving the buffer empty
+    def drain(self) -> Dict[Tuple[str, date], SpaceSaving]:
+        with self._lock:
+            sketches, self._sketches = self._sketches, {}
+        return sketches
+
+    # Put back sketches that could not be flushed
+    def restore(self, sketches: Dict[Tuple[str, date], SpaceSaving]):
+        with self._lock:
+            for key, sketch in sketches.items():
+                if key in self._sketches:
+                    sketch.merge(self._sketches[key])
+                self._sketches[key] = sketch
@@ -10,6 +10,7 @@ from app.crud import (
     create_user,
     get_user,
     get_users,
+    get_existing_user_ids,
     get_user_by_email,
     get_user_by_username,
     update_user,
@@ -19,6 +20,7 @@ from app.crud import (
     get_lab_by_name,
     get_labs,
     get_labs_by_type,
+    get_existing_lab_types,
     update_lab,
     delete_lab,
 )
@@ -26,6 +28,9 @@ from app.models import schemas
 
 router = APIRouter()
 
+# Largest batch accepted by the existence check endpoints
+MAX_EXISTENCE_BATCH = 1000
+
 
 # User management endpoints
 # Create a new user
@@ -50,6 +55,14 @@ def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return users
 
 
+# Check which of a batch of user IDs exist
+@router.post("/users/exists", response_model=schemas.ExistenceResult)
+def check_users_exist(query: schemas.ExistenceQuery, db: Session = Depends(get_db)):
+    if len(query.ids) > MAX_EXISTENCE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_EXISTENCE_BATCH} ids per request")
+    return {"existing": get_existing_user_ids(db, query.ids)}
+
+
 # Get user by ID
 @router.get("/users/{user_id}", response_model=schemas.UserRead)
 def read_user(user_id: str, db: Session = Depends(get_db)):
@@ -107,6 +120,14 @@ def read_labs_by_type(lab_type: str, db: Session = Depends(get_db)):
     return labs
 
 
+# Check which of a batch of lab types have labs
+@router.post("/labs/types/exists", response_model=schemas.ExistenceResult)
+def check_lab_types_exist(query: schemas.ExistenceQuery, db: Session = Depends(get_db)):
+    if len(query.ids) > MAX_EXISTENCE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_EXISTENCE_BATCH} ids per request")
+    return {"existing": get_existing_lab_types(db, query.ids)}
+
+
 # Get lab by ID
 @router.get("/labs/{lab_id}", response_model=schemas.LabRead)
 def read_lab(lab_id: str, db: Session = Depends(get_db)):
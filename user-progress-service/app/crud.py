@@ -3,6 +3,7 @@ from app.models import models, schemas
 from sqlalchemy.sql import func
 import uuid
 from datetime import datetime
+from typing import List
 
 
 # User CRUD operations
@@ -42,6 +43,11 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
 
+# Get which of the given user IDs exist
+def get_existing_user_ids(db: Session, user_ids: List[str]) -> List[str]:
+    return [user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))]
+
+
 # Update user information
 def update_user(db: Session, user_id: str, user_data: dict):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -97,6 +103,12 @@ def get_labs_by_type(db: Session, lab_type: str):
     return db.query(models.Lab).filter(models.Lab.lab_type == lab_type).all()
 
 
+# Get which of the given lab types have at least one lab
+def get_existing_lab_types(db: Session, lab_types: List[str]) -> List[str]:
+    query = db.query(models.Lab.lab_type).filter(models.Lab.lab_type.in_(lab_types)).distinct()
+    return [lab_type for (lab_type,) in query]
+
+
 # Get all labs with pagination
 def get_labs(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Lab).offset(skip).limit(limit).all()
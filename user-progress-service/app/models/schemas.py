@@ -48,6 +48,15 @@ class LabRead(LabBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+# Batch existence check schemas
+class ExistenceQuery(BaseModel):
+    ids: List[str]
+
+
+class ExistenceResult(BaseModel):
+    existing: List[str]
+
+
 # Lab Attempt schemas
 class LabAttemptBase(BaseModel):
     user_id: str